@@ -49,6 +49,8 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    "core.middleware.RequestInstrumentationMiddleware",
+    "core.middleware.ContentHistoryMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -150,6 +152,98 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Render image thumbnails in the background instead of during the upload request.
+# Requires `python manage.py media_worker` to be running.
+MEDIA_ASYNC_PROCESSING = os.getenv('MEDIA_ASYNC_PROCESSING', 'false').lower() == 'true'
+
+# On-demand image renditions (/api/media/<id>/rendition/) are cached here and
+# evicted least-recently-used once the directory grows past the byte limit
+MEDIA_RENDITION_CACHE_DIR = BASE_DIR / 'rendition_cache'
+MEDIA_RENDITION_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Chunked upload sessions (/api/media-uploads/) assemble files here until finalized
+MEDIA_UPLOAD_SESSION_DIR = BASE_DIR / 'upload_sessions'
+
+# Thumbnail rendering threads per bulk upload request (/api/media/bulk-upload/)
+MEDIA_BULK_UPLOAD_WORKERS = 4
+
+# Media served through /media-files/<id>/[<variant>/] can be streamed by the
+# fronting web server: set to 'x-accel-redirect' (nginx, with an internal
+# location mapping MEDIA_ACCEL_REDIRECT_PREFIX to MEDIA_ROOT) or 'x-sendfile'
+MEDIA_SERVE_OFFLOAD = os.getenv('MEDIA_SERVE_OFFLOAD') or None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Per-request instrumentation (core.middleware.RequestInstrumentationMiddleware):
+# query count, DB/serializer time and slowest query are sent as Server-Timing
+# headers; slow requests and views running more queries than their budget
+# (a view's query_budget, else REQUEST_QUERY_BUDGET) are logged to core.performance
+REQUEST_INSTRUMENTATION = os.getenv('REQUEST_INSTRUMENTATION', 'true').lower() == 'true'
+REQUEST_SERVER_TIMING = True
+REQUEST_SLOW_THRESHOLD_MS = int(os.getenv('REQUEST_SLOW_THRESHOLD_MS', '500'))
+REQUEST_QUERY_BUDGET = 20
+
+# Staff activity logs (/api/staff/log-activity/) are spooled to disk and stored
+# in batches of ACTIVITY_LOG_FLUSH_SIZE events or every ACTIVITY_LOG_FLUSH_INTERVAL
+# seconds; set ACTIVITY_LOG_FSYNC to also survive power loss. A single event sent
+# with ?return_id=true is stored at once so its log_id can be returned
+ACTIVITY_LOG_WRITE_BEHIND = os.getenv('ACTIVITY_LOG_WRITE_BEHIND', 'true').lower() == 'true'
+ACTIVITY_LOG_SPOOL_DIR = BASE_DIR / 'activity_spool'
+ACTIVITY_LOG_FLUSH_SIZE = 200
+ACTIVITY_LOG_FLUSH_INTERVAL = 2.0
+ACTIVITY_LOG_MAX_BUFFERED = 10000
+ACTIVITY_LOG_MAX_BATCH = 500
+ACTIVITY_LOG_FSYNC = False
+
+# manage.py archive_user_logs moves user logs older than USER_LOG_RETENTION_DAYS
+# into monthly gzip NDJSON files here, readable through /api/user-logs/archive/
+USER_LOG_ARCHIVE_DIR = BASE_DIR / 'log_archive'
+USER_LOG_RETENTION_DAYS = 90
+
+# Content changes are recorded as field-level diffs in ContentHistory; changes
+# to a record within CONTENT_HISTORY_COALESCE_SECONDS of its latest entry are
+# merged into it (0 keeps every change)
+CONTENT_HISTORY_COALESCE_SECONDS = 300
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'core.performance': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Caches. Public content responses (core.cache) are invalidated by bumping
+# version keys, which all worker processes must share: set REDIS_URL in
+# production, the local-memory default only suits a single process
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'staff-default',
+    }
+}
+if os.getenv('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    }
+
+CONTENT_CACHE_ALIAS = 'default'
+CONTENT_CACHE_TIMEOUT = 60 * 60
+
+# Embed the /api/site/ document in index.html as <script id="site-document">,
+# for SITE_DOCUMENT_COMPANY_ID or, when unset, the content of all companies
+SITE_DOCUMENT_INLINE = os.getenv('SITE_DOCUMENT_INLINE', 'false').lower() == 'true'
+SITE_DOCUMENT_COMPANY_ID = os.getenv('SITE_DOCUMENT_COMPANY_ID') or None
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,283 @@
+"""
+Write-behind ingestion of staff activity logs
+
+Accepted events are appended to an NDJSON spool file before the request is
+answered, buffered in memory and written with ``bulk_create`` once the buffer
+reaches ACTIVITY_LOG_FLUSH_SIZE events or its oldest event is
+ACTIVITY_LOG_FLUSH_INTERVAL seconds old. A spool segment is deleted only after
+its events are stored; segments left behind by a process that died are
+replayed by the next process that starts logging. Each live process holds an
+exclusive lock on its segments, so they are never replayed twice. Events the
+database rejects (a user deleted meanwhile, a value too long for its column)
+are moved to ``dead-letter.ndjson`` in the spool directory so they cannot
+block the events behind them.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, connection, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .activity_rollups import add_log_rollups
+from .cache import get_cache
+from .models import User, UserLog
+
+try:
+    import fcntl
+except ImportError:  # Windows: segments are not locked
+    fcntl = None
+
+STAFF_IDS_CACHE_KEY = 'activity-log:staff-ids'
+STAFF_IDS_CACHE_TIMEOUT = 5 * 60
+DEAD_LETTER_NAME = 'dead-letter.ndjson'
+
+# Errors caused by the events themselves rather than by the database being unavailable
+REJECTED_EVENT_ERRORS = (IntegrityError, DataError, KeyError, TypeError, ValueError)
+
+
+class BufferFull(Exception):
+    """Raised when events cannot be buffered until earlier ones are stored"""
+
+
+def get_active_staff_ids():
+    """Ids of active staff users, cached until a user changes (see core.signals)"""
+    cache = get_cache()
+    staff_ids = cache.get(STAFF_IDS_CACHE_KEY)
+    if staff_ids is None:
+        staff_ids = frozenset(User.objects.filter(role='staff', is_active=True).values_list('id', flat=True))
+        cache.set(STAFF_IDS_CACHE_KEY, staff_ids, STAFF_IDS_CACHE_TIMEOUT)
+    return staff_ids
+
+
+def forget_active_staff_ids():
+    get_cache().delete(STAFF_IDS_CACHE_KEY)
+
+
+def _lock(handle):
+    """Take the segment's exclusive lock, returning False when another process holds it"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _to_user_log(event):
+    return UserLog(
+        user_id=event['user_id'],
+        activity=event['activity'],
+        ip_address=event.get('ip_address'),
+        user_agent=event.get('user_agent'),
+        created_at=parse_datetime(event['created_at']),
+    )
+
+
+def store_events(events, with_ids=False):
+    """Insert events as UserLog rows and add them to the activity rollups
+
+    With ``with_ids`` the rows are saved one by one where the database cannot
+    return the ids of a bulk insert, so the returned rows all have their ids.
+    """
+    logs = [_to_user_log(event) for event in events]
+    with transaction.atomic():
+        if with_ids and not connection.features.can_return_rows_from_bulk_insert:
+            for log in logs:
+                log._rolled_up = True  # Added below with the others, not by core.signals
+                log.save()
+        else:
+            UserLog.objects.bulk_create(logs, batch_size=500)
+        add_log_rollups(logs)
+    return logs
+
+
+def _read_segment(handle):
+    events = []
+    handle.seek(0)
+    for line in handle:
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue  # A line cut short by the crash
+    return events
+
+
+class ActivityLogBuffer:
+    """Bounded per-process buffer of activity events backed by a spool directory"""
+
+    def __init__(self, spool_dir, flush_size=200, flush_interval=2.0, max_buffered=10000, fsync=False):
+        self.spool_dir = Path(spool_dir)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.fsync = fsync
+
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.events = []
+        self.oldest = None
+        self.segment = None
+        self.segment_paths = {}
+        self.sealed_segments = []
+        self.started = False
+
+    def add(self, events):
+        """Spool and buffer events (dicts with user_id, activity, ip_address, user_agent, created_at)"""
+        with self.lock:
+            if not self.started:
+                self.start()
+            if len(self.events) + len(events) > self.max_buffered:
+                raise BufferFull(f'{len(self.events)} activity events are waiting to be stored')
+
+            self.spool(events)
+            self.events.extend(events)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            full = len(self.events) >= self.flush_size
+
+        if full:
+            self.flush()
+
+    def spool(self, events):
+        if self.segment is None:
+            # Locked before it gets the name recovery looks for
+            path = self.spool_dir / f'activity-{os.getpid()}-{uuid.uuid4().hex}.ndjson'
+            temp_path = path.with_suffix('.tmp')
+            self.segment = open(temp_path, 'a+', encoding='utf-8')
+            _lock(self.segment)
+            os.replace(temp_path, path)
+            self.segment_paths[self.segment] = path
+        self.segment.write(''.join(json.dumps(event) + '\n' for event in events))
+        self.segment.flush()
+        if self.fsync:
+            os.fsync(self.segment.fileno())
+
+    def flush(self):
+        """Store buffered events; on failure they stay buffered and spooled for the next attempt"""
+        with self.flush_lock:
+            with self.lock:
+                events, self.events, self.oldest = self.events, [], None
+                segments, self.sealed_segments = self.sealed_segments, []
+                if self.segment is not None:
+                    segments.append(self.segment)
+                    self.segment = None
+            if not events and not segments:
+                return 0
+
+            try:
+                stored = self.store(events)
+            except Exception as e:
+                print(f"Error storing activity logs: {e}")
+                with self.lock:
+                    self.events[:0] = events
+                    self.oldest = self.oldest or time.monotonic()
+                    self.sealed_segments[:0] = segments
+                return 0
+
+            for handle in segments:
+                self.segment_paths.pop(handle).unlink(missing_ok=True)
+                handle.close()
+            return stored
+
+    def store(self, events):
+        """Store events, moving the ones the database rejects to the dead-letter file
+
+        Returns how many were stored. Errors of the database itself propagate,
+        so the events are retried.
+        """
+        try:
+            store_events(events)
+            return len(events)
+        except REJECTED_EVENT_ERRORS:
+            pass
+
+        stored, rejected = 0, []
+        for event in events:
+            try:
+                store_events([event])
+                stored += 1
+            except REJECTED_EVENT_ERRORS as e:
+                rejected.append({'event': event, 'error': str(e)})
+        if rejected:
+            print(f"Error storing activity logs: {len(rejected)} event(s) moved to {DEAD_LETTER_NAME}")
+            with open(self.spool_dir / DEAD_LETTER_NAME, 'a', encoding='utf-8') as dead_letter:
+                dead_letter.write(''.join(json.dumps(item, default=str) + '\n' for item in rejected))
+        return stored
+
+    def start(self):
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.recover()
+        threading.Thread(target=self.run_flusher, name='activity-log-flusher', daemon=True).start()
+        atexit.register(self.flush)
+        self.started = True
+
+    def recover(self):
+        """Store the events of segments no live process holds"""
+        recovered = 0
+        for path in sorted(self.spool_dir.glob('activity-*.ndjson')):
+            try:
+                handle = open(path, 'r+', encoding='utf-8')
+            except FileNotFoundError:
+                continue  # Recovered by another process meanwhile
+            with handle:
+                if not _lock(handle):
+                    continue
+                events = _read_segment(handle)
+                try:
+                    stored = self.store(events)
+                except Exception as e:
+                    print(f"Error recovering activity logs from {path}: {e}")
+                    continue
+                os.remove(path)
+                recovered += stored
+        return recovered
+
+    def run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval / 2)
+            oldest = self.oldest
+            if oldest is not None and time.monotonic() - oldest >= self.flush_interval:
+                try:
+                    self.flush()
+                finally:
+                    connections.close_all()
+
+
+_buffers = {}
+
+
+def get_buffer():
+    """The current process's buffer (worker processes forked after import get their own)"""
+    pid = os.getpid()
+    if pid not in _buffers:
+        _buffers[pid] = ActivityLogBuffer(
+            getattr(settings, 'ACTIVITY_LOG_SPOOL_DIR', Path(settings.BASE_DIR) / 'activity_spool'),
+            flush_size=getattr(settings, 'ACTIVITY_LOG_FLUSH_SIZE', 200),
+            flush_interval=getattr(settings, 'ACTIVITY_LOG_FLUSH_INTERVAL', 2.0),
+            max_buffered=getattr(settings, 'ACTIVITY_LOG_MAX_BUFFERED', 10000),
+            fsync=getattr(settings, 'ACTIVITY_LOG_FSYNC', False),
+        )
+    return _buffers[pid]
+
+
+def log_activity(events, write_behind=None):
+    """Record activity events, write-behind unless ACTIVITY_LOG_WRITE_BEHIND is off
+
+    Returns the stored UserLog rows, or None when the events were buffered.
+    """
+    now = timezone.now().isoformat()
+    events = [{**event, 'created_at': event.get('created_at') or now} for event in events]
+    if write_behind is None:
+        write_behind = getattr(settings, 'ACTIVITY_LOG_WRITE_BEHIND', True)
+    if write_behind:
+        get_buffer().add(events)
+        return None
+    return store_events(events, with_ids=True)
@@ -0,0 +1,59 @@
+"""
+Daily activity rollups maintained from user log rows
+
+Each UserActivityRollup row counts one user's activities of one kind on one
+day (in the project time zone). New logs are added incrementally by
+``add_log_rollups``; ``manage.py backfill_activity_rollups`` rebuilds days
+from the raw table.
+"""
+import re
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import User, UserActivityRollup
+
+KIND_MAX_LENGTH = 64
+KIND_RE = re.compile(r'[a-z0-9_\-]+')
+
+
+def activity_kind(activity):
+    """Kind of a free-text activity: its first word, lowercased ('Updated news #3' -> 'updated')"""
+    match = KIND_RE.search((activity or '').lower())
+    return match.group(0)[:KIND_MAX_LENGTH] if match else 'other'
+
+
+def count_logs(logs, companies):
+    """Count logs per (user, company, day, kind); ``companies`` maps user ids to company ids"""
+    return Counter(
+        (log.user_id, companies.get(log.user_id), timezone.localdate(log.created_at), activity_kind(log.activity))
+        for log in logs
+    )
+
+
+def add_rollup_counts(counts):
+    """Add counts keyed by (user_id, company_id, day, kind) to the rollup table"""
+    with transaction.atomic():
+        for (user_id, company_id, day, kind), count in counts.items():
+            rows = UserActivityRollup.objects.filter(user_id=user_id, day=day, kind=kind)
+            if rows.update(count=F('count') + count, company_id=company_id):
+                continue
+            try:
+                with transaction.atomic():
+                    UserActivityRollup.objects.create(
+                        user_id=user_id, company_id=company_id, day=day, kind=kind, count=count
+                    )
+            except IntegrityError:
+                # Created concurrently by another writer
+                rows.update(count=F('count') + count, company_id=company_id)
+
+
+def add_log_rollups(logs):
+    """Add newly stored UserLog instances to the rollups"""
+    if not logs:
+        return
+    user_ids = {log.user_id for log in logs}
+    companies = dict(User.objects.filter(id__in=user_ids).values_list('id', 'company_id'))
+    add_rollup_counts(count_logs(logs, companies))
@@ -2,7 +2,8 @@ from django.contrib import admin
 from .models import (
     Company, User, TeamMember, UserLog, Category, HomeContent,
     AboutUs, Service, Contact, Project, ProjectGallery, 
-    Testimonial, Client, News, Media, SocialMedia, Setting, ContentHistory
+    Testimonial, Client, News, Media, MediaProcessingJob, SocialMedia, Setting, ContentHistory,
+    UserActivityRollup
 )
 
 
@@ -86,6 +87,14 @@ class UserLogAdmin(admin.ModelAdmin):
         return qs.filter(user__role='staff')
 
 
+@admin.register(UserActivityRollup)
+class UserActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('id', 'day', 'user', 'company', 'kind', 'count')
+    list_filter = ('day', 'kind', 'company')
+    search_fields = ('user__username', 'kind')
+    list_select_related = ('user', 'company')
+
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'slug', 'created_at')
@@ -171,12 +180,20 @@ class NewsAdmin(admin.ModelAdmin):
 
 @admin.register(Media)
 class MediaAdmin(admin.ModelAdmin):
-    list_display = ('id', 'file_name', 'file_type', 'company', 'uploaded_by', 'created_at')
-    list_filter = ('company', 'file_type', 'uploaded_by', 'created_at')
+    list_display = ('id', 'file_name', 'file_type', 'processing_status', 'company', 'uploaded_by', 'created_at')
+    list_filter = ('company', 'file_type', 'processing_status', 'uploaded_by', 'created_at')
     search_fields = ('file_name', 'file_path')
     readonly_fields = ('created_at', 'updated_at')
 
 
+@admin.register(MediaProcessingJob)
+class MediaProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'media', 'status', 'attempts', 'started_at', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('media__file_name', 'last_error')
+    readonly_fields = ('created_at', 'updated_at')
+
+
 @admin.register(SocialMedia)
 class SocialMediaAdmin(admin.ModelAdmin):
     list_display = ('id', 'platform', 'company', 'is_active', 'display_order', 'created_at')
@@ -0,0 +1,126 @@
+"""
+Cache for public site content responses
+
+Responses are stored under keys that embed a version per content section and
+company. Saving or deleting content bumps the versions it affects (see
+core.signals), so stale entries are never read again and simply expire.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpRequest
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+# Scope of responses that are not filtered by company
+ALL_COMPANIES = 'all'
+# Version shared by every scope of a section, bumped by changes that affect them all
+SECTION_WIDE = '*'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CONTENT_CACHE_ALIAS', 'default')]
+
+
+def _version_key(section, scope):
+    return f'content-version:{section}:{scope}'
+
+
+def get_versions(sections, scope):
+    """Return the section-wide and scope version of each section, creating missing ones"""
+    cache = get_cache()
+    keys = [key for section in sections
+            for key in (_version_key(section, SECTION_WIDE), _version_key(section, scope))]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # Start from the clock so a lost version never matches old entries
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def versions_token(sections, scope):
+    """Short token that changes whenever any of the sections changes for the scope"""
+    versions = '.'.join(str(version) for version in get_versions(sections, scope))
+    return hashlib.md5(versions.encode()).hexdigest()
+
+
+def bump_version(section, scope):
+    """Invalidate every cached response of a section for one scope"""
+    cache = get_cache()
+    key = _version_key(section, scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def invalidate(section, company_id=None):
+    """Invalidate a company's responses and the unfiltered ones of a section"""
+    if company_id is not None:
+        bump_version(section, company_id)
+    bump_version(section, ALL_COMPANIES)
+
+
+def invalidate_section(section):
+    bump_version(section, SECTION_WIDE)
+
+
+def build_cache_key(section, request):
+    company_id = request.GET.get('company_id')
+    # '05' shares the scope of 5, the one its invalidations bump
+    scope = str(int(company_id)) if company_id else ALL_COMPANIES
+    query = hashlib.md5(request.GET.urlencode().encode()).hexdigest()
+    return f'content:{section}:{scope}:{versions_token([section], scope)}:{request.path}:{query}'
+
+
+def cached_content(section):
+    """
+    Serve GET responses of a view from the content cache.
+
+    Works for function views and ViewSet actions; responses are cached per
+    ``?company_id=`` scope and query string, only when successful. A company_id
+    that is not an integer is answered with 400. ETag and
+    Last-Modified headers set by the view are cached along with the data and
+    answer conditional requests on cache hits.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(*args, **kwargs):
+            request = next((arg for arg in args if isinstance(arg, (Request, HttpRequest))), None)
+            if request is None:
+                return view_func(*args, **kwargs)
+            company_id = request.GET.get('company_id')
+            if company_id and not company_id.isdigit():
+                return Response({'error': 'company_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+            if request.method != 'GET':
+                return view_func(*args, **kwargs)
+
+            cache = get_cache()
+            key = build_cache_key(section, request)
+            cached = cache.get(key)
+            if cached is not None:
+                data, etag, last_modified = cached
+                response = get_conditional_response(
+                    request, etag=etag, last_modified=parse_http_date_safe(last_modified)
+                ) or Response(data)
+                if etag:
+                    response['ETag'] = etag
+                if last_modified:
+                    response['Last-Modified'] = last_modified
+                return response
+
+            response = view_func(*args, **kwargs)
+            if response.status_code == 200:
+                cached = (response.data, response.get('ETag'), response.get('Last-Modified'))
+                cache.set(key, cached, getattr(settings, 'CONTENT_CACHE_TIMEOUT', 60 * 60))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,66 @@
+"""
+Conditional GET validators derived from the database
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+# Column read as the modification time, in order of preference
+MODIFIED_FIELDS = ('updated_at', 'created_at')
+
+
+def _modified_field(model):
+    names = {field.name for field in model._meta.concrete_fields}
+    return next((name for name in MODIFIED_FIELDS if name in names), None)
+
+
+def _related_model(model, path):
+    for attr in path.split('__'):
+        model = model._meta.get_field(attr).related_model
+    return model
+
+
+def queryset_validators(queryset, related=(), key=''):
+    """
+    Return ``(etag, last_modified)`` for the rows of a queryset.
+
+    One aggregate query reads the latest modification time and the row count
+    of the rows and of the related rows named in ``related``, so any insert,
+    update or delete among them changes the ETag. ``key`` should identify the
+    representation, e.g. the request path with its query string.
+    """
+    aggregates = {}
+    for index, path in enumerate(['', *related]):
+        prefix = f'{path}__' if path else ''
+        field = _modified_field(_related_model(queryset.model, path) if path else queryset.model)
+        if field:
+            aggregates[f'modified_{index}'] = Max(prefix + field)
+        aggregates[f'count_{index}'] = Count(prefix + 'pk', distinct=True)
+
+    values = queryset.order_by().aggregate(**aggregates)
+    modified = [value for name, value in values.items() if name.startswith('modified_') and value]
+
+    fingerprint = '|'.join([key, *(f'{name}={values[name]}' for name in sorted(values))])
+    etag = f'"{hashlib.md5(fingerprint.encode()).hexdigest()}"'
+    return etag, max(modified) if modified else None
+
+
+def content_condition(get_queryset, related=()):
+    """
+    ``condition`` decorator for function views whose GET output is built from
+    ``get_queryset(request)``; both validators come from a single query.
+    """
+    def validators(request):
+        if request.method not in ('GET', 'HEAD'):
+            return None, None
+        if not hasattr(request, '_content_validators'):
+            request._content_validators = queryset_validators(
+                get_queryset(request), related, key=request.get_full_path()
+            )
+        return request._content_validators
+
+    return condition(
+        etag_func=lambda request, *args, **kwargs: validators(request)[0],
+        last_modified_func=lambda request, *args, **kwargs: validators(request)[1],
+    )
@@ -0,0 +1,202 @@
+"""
+Field-level change history of content records
+
+Saves and deletes of the tracked models (connected in core.signals) are
+recorded as ContentHistory entries whose ``changed_data`` maps each changed
+field to ``[old, new]``; creates and deletes carry every non-empty field. Changes
+committed while a batch is open (one per request, see
+core.middleware.ContentHistoryMiddleware) are written together when it
+closes. Changes to a record within CONTENT_HISTORY_COALESCE_SECONDS of the
+first change of its latest entry are merged into that entry instead of adding
+a new one, so the record's versions are kept at least that far apart.
+"""
+import json
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    AboutUs, Client, ContentHistory, Contact, Gallery, GalleryItem, HomeContent, News, Project,
+    ProjectGallery, Service, Setting, SocialMedia, Testimonial
+)
+
+TRACKED_MODELS = (
+    HomeContent, AboutUs, Service, Project, ProjectGallery, Testimonial, Client, News,
+    SocialMedia, Contact, Setting, Gallery, GalleryItem,
+)
+
+# Bookkeeping fields that change on every save
+IGNORED_FIELDS = {'id', 'created_at', 'updated_at'}
+
+_local = threading.local()
+
+
+def table_name(model):
+    return model._meta.model_name
+
+
+def get_tracked_model(name):
+    for model in TRACKED_MODELS:
+        if table_name(model) == name:
+            return model
+    return None
+
+
+def tracked_fields(model):
+    return [field for field in model._meta.concrete_fields if field.name not in IGNORED_FIELDS]
+
+
+def field_values(instance):
+    """JSON-ready values of an instance's tracked fields, keyed by attname (author_id, not author)"""
+    values = {}
+    for field in tracked_fields(type(instance)):
+        value = getattr(instance, field.attname)
+        if hasattr(value, 'name') and hasattr(value, 'storage'):  # File fields
+            value = value.name or None
+        values[field.attname] = value
+    return json.loads(json.dumps(values, cls=DjangoJSONEncoder))
+
+
+def stored_values(model, pk):
+    """Tracked values of the stored row, or None when there is none"""
+    attnames = [field.attname for field in tracked_fields(model)]
+    values = model.objects.filter(pk=pk).values(*attnames).first()
+    return values and json.loads(json.dumps(values, cls=DjangoJSONEncoder))
+
+
+def diff(before, after):
+    """{field: [old, new]} for the fields that differ; missing sides are None"""
+    before, after = before or {}, after or {}
+    return {
+        field: [before.get(field), after.get(field)]
+        for field in before.keys() | after.keys()
+        if before.get(field) != after.get(field)
+    }
+
+
+def merge(first, second):
+    """Combine two consecutive changes of one record into one, or None when they cancel out"""
+    if first['action'] == 'create' and second['action'] == 'delete':
+        return None
+    changes = dict(first['changed_data'] or {})
+    for field, (old, new) in (second['changed_data'] or {}).items():
+        changes[field] = [changes[field][0], new] if field in changes else [old, new]
+    action = 'create' if first['action'] == 'create' else second['action']
+    if action == 'update':
+        changes = {field: pair for field, pair in changes.items() if pair[0] != pair[1]}
+    return {**second, 'action': action, 'changed_data': changes}
+
+
+def record_change(instance, action, before=None):
+    """Queue a change of a tracked instance once the surrounding transaction commits"""
+    after = None if action == 'delete' else field_values(instance)
+    changes = diff(before, after)
+    if not changes and action == 'update':
+        return
+    entry = {
+        'table_name': table_name(type(instance)),
+        'record_id': instance.pk,
+        'action': action,
+        'changed_data': changes,
+        'created_at': timezone.now(),
+    }
+    transaction.on_commit(lambda: _queue(entry))
+
+
+def _queue(entry):
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        _store([entry])
+        return
+    key = (entry['table_name'], entry['record_id'])
+    previous = pending.get(key)
+    if previous is not None and previous['action'] == 'delete':
+        _store([previous])  # The id was reused; keep both lives of the record
+        previous = None
+    # A record created and deleted within the batch leaves no entry (None)
+    pending[key] = entry if previous is None else merge(previous, entry)
+
+
+def _store(entries):
+    try:
+        write_entries(entries)
+    except Exception as e:
+        print(f"Error writing content history: {e}")
+
+
+@contextmanager
+def capture_batch():
+    """Collect the changes committed inside the block and write them when it exits"""
+    if getattr(_local, 'pending', None) is not None:
+        yield  # Nested: the outer batch writes
+        return
+    _local.pending = {}
+    try:
+        yield
+    finally:
+        pending, _local.pending = _local.pending, None
+        _store([entry for entry in pending.values() if entry is not None])
+
+
+def write_entries(entries):
+    """Store entries, merging each into its record's latest entry when that began recently enough"""
+    if not entries:
+        return
+    window = timedelta(seconds=getattr(settings, 'CONTENT_HISTORY_COALESCE_SECONDS', 300))
+    since = min(entry['created_at'] for entry in entries) - window
+
+    latest = {}
+    if window:
+        record_ids = {}
+        for entry in entries:
+            record_ids.setdefault(entry['table_name'], set()).add(entry['record_id'])
+        for name, ids in record_ids.items():
+            recent = ContentHistory.objects.filter(
+                table_name=name, record_id__in=ids, created_at__gte=since
+            ).order_by('record_id', 'created_at', 'id')
+            for row in recent:
+                latest[name, row.record_id] = row  # Newest last
+
+    created, updated, removed = [], [], []
+    for entry in entries:
+        row = latest.get((entry['table_name'], entry['record_id']))
+        if (row is None or row.created_at < entry['created_at'] - window or row.user_id is not None
+                or row.action == 'delete' or entry['action'] == 'create'):
+            created.append(ContentHistory(**entry))
+            continue
+        merged = merge({'action': row.action, 'changed_data': row.changed_data}, entry)
+        if merged is None:
+            removed.append(row.pk)
+            continue
+        # created_at stays at the first merged change, so the window does not slide with each edit
+        row.action, row.changed_data = merged['action'], merged['changed_data']
+        if row.action == 'update' and not row.changed_data:
+            removed.append(row.pk)  # Edited back to where it started
+        else:
+            updated.append(row)
+
+    with transaction.atomic():
+        ContentHistory.objects.bulk_create(created, batch_size=500)
+        ContentHistory.objects.bulk_update(updated, ['action', 'changed_data'], batch_size=500)
+        if removed:
+            ContentHistory.objects.filter(pk__in=removed).delete()
+
+
+def rebuild_version(model, record_id, entries, version_id):
+    """Field values of a record right after the entry ``version_id``, or None if it did not exist then
+
+    ``entries`` are the record's entries, oldest first. Starting from the stored
+    row, the entries made after the version are undone newest first.
+    """
+    state = stored_values(model, record_id) or {}
+    for entry in reversed(entries):
+        if entry.id == version_id:
+            return None if entry.action == 'delete' else state
+        for field, (old, new) in (entry.changed_data or {}).items():
+            state[field] = old
+    return None
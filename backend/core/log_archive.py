@@ -0,0 +1,105 @@
+"""
+Monthly gzip NDJSON archives of old user logs
+
+``manage.py archive_user_logs`` moves rows older than the retention window
+into one file per month under USER_LOG_ARCHIVE_DIR. Each run appends a gzip
+member in (created_at, id) order, so a month can be archived in several runs.
+Rows written again by a run interrupted before its deletes sort at or before
+the last row already read, which is how readers skip them.
+"""
+import base64
+import gzip
+import json
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+ARCHIVE_NAME_RE = re.compile(r'^user_logs-(\d{4}-\d{2})\.ndjson\.gz$')
+MONTH_RE = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+
+def get_archive_dir():
+    return Path(getattr(settings, 'USER_LOG_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'log_archive'))
+
+
+def archive_path(month):
+    """Archive file of a month given as YYYY-MM"""
+    return get_archive_dir() / f'user_logs-{month}.ndjson.gz'
+
+
+def archived_months():
+    """Archived months, oldest first, with their file sizes"""
+    archive_dir = get_archive_dir()
+    if not archive_dir.is_dir():
+        return []
+    months = []
+    for path in sorted(archive_dir.iterdir()):
+        match = ARCHIVE_NAME_RE.match(path.name)
+        if match:
+            months.append({'month': match.group(1), 'size': path.stat().st_size})
+    return months
+
+
+def log_record(log, username=None):
+    return {
+        'id': log.id,
+        'user': log.user_id,
+        'username': username,
+        'activity': log.activity,
+        'ip_address': log.ip_address,
+        'user_agent': log.user_agent,
+        'created_at': log.created_at.isoformat(),
+    }
+
+
+def append_to_archive(month, records):
+    """Append records to a month's archive as one gzip member, returning how many were written"""
+    path = archive_path(month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+    with gzip.open(path, 'at', encoding='utf-8') as archive:
+        for record in records:
+            archive.write(json.dumps(record) + '\n')
+            written += 1
+    return written
+
+
+def record_key(record):
+    """The (created_at, id) key archives are ordered by"""
+    return parse_datetime(record['created_at']), record['id']
+
+
+def encode_cursor(record):
+    """Opaque cursor pointing just past a record"""
+    return base64.urlsafe_b64encode(json.dumps([record['created_at'], record['id']]).encode()).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """The key of a cursor from encode_cursor; raises ValueError when it is malformed"""
+    try:
+        created_at, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        key = parse_datetime(created_at), int(record_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if key[0] is None:
+        raise ValueError('Invalid cursor')
+    return key
+
+
+def read_archive(month, user_id=None, after=None):
+    """Yield the archived records of a month, optionally for one user and only past the key ``after``"""
+    path = archive_path(month)
+    if not path.exists():
+        return
+    last = after
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            record = json.loads(line)
+            key = record_key(record)
+            if last is not None and key <= last:
+                continue  # Archived again by an interrupted run, or before the cursor
+            last = key
+            if user_id is None or record['user'] == user_id:
+                yield record
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from core.log_archive import append_to_archive, archive_path, log_record
+from core.models import UserLog
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(moment):
+    return month_start(month_start(moment) + timedelta(days=32))
+
+
+class Command(BaseCommand):
+    help = 'Move user logs older than the retention window into monthly gzip NDJSON archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int,
+                            default=getattr(settings, 'USER_LOG_RETENTION_DAYS', 90),
+                            help='Keep logs newer than this many days in the database')
+        parser.add_argument('--before', help='Archive logs created before this date (YYYY-MM-DD) instead')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows fetched per database round trip while writing archives')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows deleted per DELETE statement')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be archived without writing or deleting anything')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                day = datetime.strptime(options['before'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('--before must be a date in YYYY-MM-DD format')
+            cutoff = timezone.make_aware(day)
+        else:
+            cutoff = timezone.now() - timedelta(days=options['retention_days'])
+
+        # Rows logged while the command runs are left for the next run
+        bounds = UserLog.objects.filter(created_at__lt=cutoff).aggregate(oldest=Min('created_at'), last_id=Max('id'))
+        if bounds['oldest'] is None:
+            self.stdout.write('No user logs to archive')
+            return
+
+        total = 0
+        start = month_start(timezone.localtime(bounds['oldest']))
+        while start < cutoff:
+            end = min(next_month(start), cutoff)
+            rows = UserLog.objects.filter(created_at__gte=start, created_at__lt=end, id__lte=bounds['last_id'])
+            month = start.strftime('%Y-%m')
+            start = next_month(start)
+            if not rows.exists():
+                continue
+
+            if options['dry_run']:
+                count = rows.count()
+                self.stdout.write(f'{month}: would archive {count} log(s) to {archive_path(month)}')
+            else:
+                count = self.archive_month(month, rows, options['chunk_size'], options['batch_size'])
+                self.stdout.write(f'{month}: archived {count} log(s) to {archive_path(month)}')
+            total += count
+
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} user log(s) created before {cutoff:%Y-%m-%d %H:%M}'))
+
+    def month_records(self, rows, chunk_size):
+        """Archive records of the rows in (created_at, id) order, fetched in keyset chunks"""
+        logs = rows.select_related('user').only(
+            'id', 'user_id', 'user__username', 'activity', 'ip_address', 'user_agent', 'created_at'
+        ).order_by('created_at', 'id')
+        chunk = list(logs[:chunk_size])
+        while chunk:
+            for log in chunk:
+                yield log_record(log, log.user.username)
+            last = chunk[-1]
+            chunk = list(logs.filter(
+                Q(created_at__gt=last.created_at) | Q(created_at=last.created_at, id__gt=last.id)
+            )[:chunk_size])
+
+    def archive_month(self, month, rows, chunk_size, batch_size):
+        """Write a month's rows to its archive, then delete them from the table"""
+        written = append_to_archive(month, self.month_records(rows, chunk_size))
+
+        # Deleted only once the whole month is on disk; a rerun after a crash
+        # archives the remaining rows again and readers skip the duplicates
+        deleted = 0
+        while True:
+            ids = list(rows.order_by().values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted += UserLog.objects.filter(id__in=ids).delete()[0]
+        if deleted != written:
+            self.stderr.write(f'{month}: wrote {written} log(s) but deleted {deleted}')
+        return written
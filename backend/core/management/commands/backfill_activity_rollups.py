@@ -0,0 +1,98 @@
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from core.activity_rollups import activity_kind
+from core.log_archive import archived_months, read_archive
+from core.models import UserActivityRollup, UserLog
+
+
+def parse_day(value, option):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'{option} must be a date in YYYY-MM-DD format')
+
+
+class Command(BaseCommand):
+    help = 'Rebuild daily activity rollups from the user log table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild (YYYY-MM-DD, default: oldest log)')
+        parser.add_argument('--until', help='Last day to rebuild (YYYY-MM-DD, default: yesterday)')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Grouped rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        # Today's rollups are still being added to by new logs
+        until = (parse_day(options['until'], '--until') if options['until']
+                 else timezone.localdate() - timedelta(days=1))
+        if options['since']:
+            since = parse_day(options['since'], '--since')
+        else:
+            oldest = UserLog.objects.aggregate(oldest=Min('created_at'))['oldest']
+            if oldest is None:
+                self.stdout.write('No user logs to roll up')
+                return
+            since = timezone.localdate(oldest)
+        if since > until:
+            raise CommandError('--since must not be after --until')
+
+        # Days with logs moved to the archive keep their rollups; the table
+        # only holds part of them, if any
+        archived = self.archived_days(since, until)
+        total = skipped = 0
+        day = since
+        while day <= until:
+            if day in archived:
+                skipped += 1
+                if options['verbosity'] >= 2:
+                    self.stdout.write(f'{day}: skipped, logs are archived')
+            else:
+                total += self.rebuild_day(day, options['chunk_size'], options['verbosity'])
+            day += timedelta(days=1)
+        if skipped:
+            self.stdout.write(f'Skipped {skipped} day(s) with archived logs')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups of {total} log(s) from {since} to {until}'))
+
+    def archived_days(self, since, until):
+        """Local days between since and until with at least one archived log"""
+        days = set()
+        for item in archived_months():
+            if not since.strftime('%Y-%m') <= item['month'] <= until.strftime('%Y-%m'):
+                continue
+            for record in read_archive(item['month']):
+                days.add(timezone.localdate(datetime.fromisoformat(record['created_at'])))
+        return days
+
+    def rebuild_day(self, day, chunk_size, verbosity):
+        """Replace one day's rollups with counts grouped in the database"""
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        logs = UserLog.objects.filter(created_at__gte=start, created_at__lt=start + timedelta(days=1))
+
+        with transaction.atomic():
+            # Deleting first locks the day's rollups, so logs stored while the
+            # counts are read either are counted here or wait to add their own
+            UserActivityRollup.objects.filter(day=day).delete()
+
+            # Activities are grouped by their text in SQL and folded into kinds here
+            counts = Counter()
+            grouped = logs.values('user_id', 'user__company_id', 'activity').annotate(count=Count('id')).order_by()
+            for row in grouped.iterator(chunk_size=chunk_size):
+                counts[row['user_id'], row['user__company_id'], activity_kind(row['activity'])] += row['count']
+            if not counts:
+                transaction.set_rollback(True)  # Nothing in the table; keep the day's rollups
+                return 0
+
+            UserActivityRollup.objects.bulk_create([
+                UserActivityRollup(user_id=user_id, company_id=company_id, day=day, kind=kind, count=count)
+                for (user_id, company_id, kind), count in counts.items()
+            ], batch_size=1000)
+        total = sum(counts.values())
+        if verbosity >= 2:
+            self.stdout.write(f'{day}: {total} log(s) in {len(counts)} rollup row(s)')
+        return total
@@ -0,0 +1,237 @@
+import random
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client as TestClient
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from core.models import (
+    Company, User, TeamMember, UserLog, Category, HomeContent, AboutUs, Service,
+    Contact, Project, ProjectGallery, Testimonial, Client, News, Media, SocialMedia,
+    Setting, ContentHistory, Gallery, GalleryItem
+)
+from core.urls import router
+
+# Filtered list requests the frontend makes, per router prefix
+ROUTE_QUERIES = {
+    'media': ['company_id={company}', 'company_id={company}&file_type=image'],
+    'galleries': ['company_id={company}'],
+    'user-logs': ['user_id={user}'],
+    'content-history': ['user_id={user}'],
+}
+
+SQLITE_TABLE_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+FROM_TABLE_RE = re.compile(r'\bFROM [`"]?(\w+)[`"]?')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Run every API list route against seeded data and flag queries whose plans scan or sort'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=5, help='Companies to seed')
+        parser.add_argument('--rows', type=int, default=200,
+                            help='Rows seeded per company for each content table')
+        parser.add_argument('--route', action='append', dest='routes',
+                            help='Only exercise router prefixes containing this text (repeatable)')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Refresh planner statistics after seeding (cost-based planners need it)')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        findings = {}
+
+        # Everything happens inside a transaction that is always rolled back, and
+        # without caches: responses built from the seeded rows must not outlive it
+        dummy_caches = {
+            alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'} for alias in settings.CACHES
+        }
+        try:
+            with transaction.atomic(), override_settings(ALLOWED_HOSTS=['*'], DEBUG=False, CACHES=dummy_caches):
+                context = self.seed(options['companies'], options['rows'])
+                if options['analyze']:
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE')
+
+                client = TestClient()
+                for url in self.build_urls(context, options['routes']):
+                    self.explain_url(client, url, findings)
+                raise Rollback()
+        except Rollback:
+            pass
+
+        self.report(findings)
+
+    # Seeding
+
+    def seed(self, company_count, rows):
+        """Create realistic volumes of every content type and return ids for filters"""
+        now = timezone.now()
+        categories = Category.objects.bulk_create([Category(name=f'Category {i}') for i in range(10)])
+        context = {}
+
+        for c in range(company_count):
+            company = Company.objects.create(name=f'Explain Company {c}')
+            users = User.objects.bulk_create([
+                User(username=f'explain_{c}_{i}', email=f'explain_{c}_{i}@example.com', password_hash='x',
+                     role='admin' if i % 10 == 0 else 'staff', company=company)
+                for i in range(max(rows // 10, 2))
+            ])
+            context.setdefault('company', company.pk)
+            context.setdefault('user', users[0].pk)
+
+            TeamMember.objects.bulk_create([
+                TeamMember(company=company, name=f'Member {i}', position='Engineer',
+                           is_management=i % 8 == 0, display_order=i)
+                for i in range(rows)
+            ])
+            UserLog.objects.bulk_create([
+                UserLog(user=random.choice(users), activity=f'Activity {i}')
+                for i in range(rows * 5)
+            ])
+            HomeContent.objects.create(company=company, title='Home')
+            AboutUs.objects.create(company=company, description='About')
+            Contact.objects.create(company=company, email=f'contact{c}@example.com')
+            Service.objects.bulk_create([
+                Service(company=company, category=random.choice(categories), title=f'Service {c}-{i}')
+                for i in range(rows)
+            ])
+            projects = Project.objects.bulk_create([
+                Project(company=company, title=f'Project {i}', featured=i % 10 == 0)
+                for i in range(rows)
+            ])
+            ProjectGallery.objects.bulk_create([
+                ProjectGallery(project=project, image_path=f'/media/p{project.pk}.jpg')
+                for project in projects
+            ])
+            Testimonial.objects.bulk_create([
+                Testimonial(company=company, client_name=f'Client {i}', testimonial_text='Great',
+                            is_featured=i % 10 == 0)
+                for i in range(rows)
+            ])
+            Client.objects.bulk_create([
+                Client(company=company, name=f'Client {i}', is_featured=i % 10 == 0, display_order=i)
+                for i in range(rows)
+            ])
+            News.objects.bulk_create([
+                News(company=company, author=random.choice(users), title=f'News {i}',
+                     status='published' if i % 3 else 'draft', published_at=now - timedelta(hours=i))
+                for i in range(rows)
+            ])
+            media = Media.objects.bulk_create([
+                Media(company=company, file_name=f'{i}.jpg', file_type='image' if i % 4 else 'document',
+                      uploaded_by=random.choice(users))
+                for i in range(rows)
+            ])
+            SocialMedia.objects.bulk_create([
+                SocialMedia(company=company, platform=f'platform{i}', url='https://example.com',
+                            is_active=i % 2 == 0, display_order=i)
+                for i in range(20)
+            ])
+            Setting.objects.bulk_create([
+                Setting(company=company, setting_key=f'key{i}', setting_value=str(i)) for i in range(20)
+            ])
+            ContentHistory.objects.bulk_create([
+                ContentHistory(user=random.choice(users), table_name='news', record_id=i, action='update')
+                for i in range(rows)
+            ])
+            galleries = Gallery.objects.bulk_create([Gallery(company=company, name=f'Gallery {i}') for i in range(10)])
+            GalleryItem.objects.bulk_create([
+                GalleryItem(gallery=gallery, media=random.choice(media), ordering=i)
+                for gallery in galleries for i in range(10)
+            ])
+
+        return context
+
+    # Exercising routes
+
+    def build_urls(self, context, route_filters):
+        urls = []
+        for prefix, viewset, _basename in router.registry:
+            if route_filters and not any(text in prefix for text in route_filters):
+                continue
+            base = f'/api/{prefix}/'
+            urls.append(base)
+            urls.extend(f'{base}?{query.format(**context)}' for query in ROUTE_QUERIES.get(prefix, []))
+
+            # Collection actions such as featured/active/published
+            for extra_action in viewset.get_extra_actions():
+                if not extra_action.detail and 'get' in extra_action.mapping:
+                    urls.append(f'{base}{extra_action.url_path}/')
+        return urls
+
+    def explain_url(self, client, url, findings):
+        with CaptureQueriesContext(connection) as captured:
+            response = client.get(url)
+
+        selects = [query['sql'] for query in captured.captured_queries
+                   if query['sql'].lstrip().upper().startswith('SELECT')]
+        if self.verbosity >= 1:
+            self.stdout.write(f'{response.status_code} {url} ({len(selects)} queries)')
+
+        for sql in selects:
+            for issue in self.check_plan(self.explain(sql), sql):
+                findings.setdefault(issue, []).append((url, sql))
+                if self.verbosity >= 2:
+                    self.stdout.write(f'    {issue[1]} on {issue[0]}: {sql[:200]}')
+
+    def explain(self, sql):
+        """Return the query plan as a list of row tuples"""
+        vendor = connection.vendor
+        prefix = 'EXPLAIN QUERY PLAN ' if vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            if vendor == 'mysql':
+                cursor.execute(prefix + sql)
+                columns = [column[0] for column in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.execute(prefix + sql)
+            return cursor.fetchall()
+
+    def check_plan(self, plan, sql):
+        """Yield (table, issue) pairs for full scans and temporary sorts"""
+        vendor = connection.vendor
+        match = FROM_TABLE_RE.search(sql)
+        main_table = match.group(1) if match else '-'
+        for row in plan:
+            if vendor == 'sqlite':
+                detail = row[-1]
+                match = SQLITE_TABLE_SCAN_RE.match(detail)
+                if match:
+                    yield match.group(1), 'full scan'
+                elif 'USE TEMP B-TREE' in detail:
+                    yield main_table, f'temp sort ({detail.split("FOR ")[-1]})'
+            elif vendor == 'mysql':
+                if row.get('type') == 'ALL':
+                    yield row.get('table'), 'full scan'
+                extra = row.get('Extra') or ''
+                if 'Using filesort' in extra or 'Using temporary' in extra:
+                    yield row.get('table'), 'temp sort'
+            else:
+                line = row[0]
+                match = re.search(r'Seq Scan on (\w+)', line)
+                if match:
+                    yield match.group(1), 'full scan'
+                elif re.search(r'(^|->\s*)Sort\b', line.strip()):
+                    yield main_table, 'sort'
+
+    # Reporting
+
+    def report(self, findings):
+        if not findings:
+            self.stdout.write(self.style.SUCCESS('No full scans or temporary sorts found'))
+            return
+
+        self.stdout.write(self.style.WARNING(f'{len(findings)} plan issue(s):'))
+        for (table, issue), occurrences in sorted(findings.items(), key=lambda item: -len(item[1])):
+            urls = sorted({url for url, _sql in occurrences})
+            self.stdout.write(f'  {issue} on {table}: {len(occurrences)} quer(ies) from {", ".join(urls[:5])}'
+                              + (' ...' if len(urls) > 5 else ''))
+            if self.verbosity >= 2:
+                self.stdout.write(f'      e.g. {occurrences[0][1][:300]}')
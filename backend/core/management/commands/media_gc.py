@@ -0,0 +1,275 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import (
+    Company, User, TeamMember, HomeContent, Service, Project, ProjectGallery,
+    Testimonial, Client, News, Media, UploadSession
+)
+from core.utils import MEDIA_FILE_FIELDS, THUMBNAIL_SIZES, upload_session_path
+
+
+# Free-form path columns that may point at uploaded files. They are never
+# reported as missing, but protect the files they name from deletion.
+PATH_REFERENCE_FIELDS = [
+    (Media, 'file_path'),
+    (Company, 'logo_path'),
+    (User, 'profile_image'),
+    (TeamMember, 'image_path'),
+    (HomeContent, 'image_path'),
+    (Service, 'image_path'),
+    (Project, 'thumbnail_path'),
+    (ProjectGallery, 'image_path'),
+    (Testimonial, 'image_path'),
+    (Client, 'logo_path'),
+    (News, 'featured_image'),
+]
+
+
+class TimeBudgetExceeded(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Find and clean up orphaned media files and media rows pointing at missing files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help='Delete files in storage that no database row references')
+        parser.add_argument('--clear-missing', action='store_true',
+                            help='Clear thumbnail fields that point at missing files so they can be regenerated')
+        parser.add_argument('--expire-uploads', action='store_true',
+                            help='Remove chunked upload sessions that expired before being finalized')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be deleted or cleared without changing anything')
+        parser.add_argument('--min-age', type=int, default=60,
+                            help='Only treat files older than this many minutes as orphans (default: 60)')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Threads scanning storage directory shards in parallel')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Rows fetched per database round trip')
+        parser.add_argument('--time-budget', type=float, default=None,
+                            help='Stop after this many seconds, reporting partial results')
+
+    def handle(self, *args, **options):
+        self.started = time.monotonic()
+        self.time_budget = options['time_budget']
+        self.batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.media_root = str(settings.MEDIA_ROOT)
+
+        try:
+            stored = self.scan_storage(options['workers'])
+            referenced, missing = self.scan_database(stored)
+
+            min_age_cutoff = time.time() - options['min_age'] * 60
+            orphans = sorted(
+                name for name in set(stored) - referenced
+                if stored[name] < min_age_cutoff
+            )
+
+            self.report(stored, orphans, missing)
+
+            if options['delete_orphans']:
+                self.delete_orphans(orphans, dry_run)
+            if options['clear_missing']:
+                self.clear_missing(missing, dry_run)
+            if options['expire_uploads']:
+                self.expire_upload_sessions(dry_run)
+
+        except TimeBudgetExceeded:
+            self.stdout.write(self.style.WARNING(
+                f'Time budget of {self.time_budget}s exhausted, results are partial'
+            ))
+
+    def check_budget(self):
+        if self.time_budget is not None and time.monotonic() - self.started > self.time_budget:
+            raise TimeBudgetExceeded()
+
+    # Storage side
+
+    def managed_prefixes(self):
+        """Top-level storage directories the Media file fields upload into"""
+        return sorted({
+            Media._meta.get_field(field_name).upload_to.split('/')[0]
+            for field_name in MEDIA_FILE_FIELDS
+        })
+
+    def list_shards(self):
+        """Split the managed directories into independently scannable shards"""
+        shards = []
+        for prefix in self.managed_prefixes():
+            root = os.path.join(self.media_root, prefix)
+            if not os.path.isdir(root):
+                continue
+            shards.append((prefix, False))  # Files directly in the prefix directory
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        shards.append((f'{prefix}/{entry.name}', True))
+        return shards
+
+    def scan_shard(self, shard):
+        """Map storage names in one shard to their modification time"""
+        relative_root, recursive = shard
+        root = os.path.join(self.media_root, relative_root)
+        found = {}
+
+        if recursive:
+            for dirpath, _dirnames, filenames in os.walk(root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(path, self.media_root).replace(os.sep, '/')
+                    try:
+                        found[name] = os.stat(path).st_mtime
+                    except FileNotFoundError:
+                        pass
+        else:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        found[f'{relative_root}/{entry.name}'] = entry.stat().st_mtime
+        return found
+
+    def scan_storage(self, workers):
+        """Scan all shards in parallel and map every stored name to its modification time"""
+        shards = self.list_shards()
+        stored = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [pool.submit(self.scan_shard, shard) for shard in shards]
+            try:
+                for future in futures:
+                    self.check_budget()
+                    stored.update(future.result())
+            except TimeBudgetExceeded:
+                # An incomplete scan cannot tell orphans apart, so nothing is changed
+                for future in futures:
+                    future.cancel()
+                raise
+
+        self.stdout.write(f'Scanned {len(stored)} file(s) in {len(shards)} shard(s)')
+        return stored
+
+    # Database side
+
+    def normalize_path_reference(self, value):
+        """Turn a stored URL or path into a storage name, or None"""
+        if not value:
+            return None
+        path = urlparse(value).path
+        media_url = settings.MEDIA_URL
+        if path.startswith(media_url):
+            path = path[len(media_url):]
+        return path.lstrip('/') or None
+
+    def scan_database(self, stored):
+        """Stream references out of the database and diff them against storage"""
+        referenced = set()
+        missing = []
+        prefixes = set(self.managed_prefixes())
+
+        rows = Media.objects.values_list('pk', *MEDIA_FILE_FIELDS).order_by('pk').iterator(chunk_size=self.batch_size)
+        for count, row in enumerate(rows, start=1):
+            if count % self.batch_size == 0:
+                self.check_budget()
+
+            pk = row[0]
+            for field_name, name in zip(MEDIA_FILE_FIELDS, row[1:]):
+                if not name:
+                    continue
+                referenced.add(name)
+                if name in stored:
+                    continue
+                # Names outside the scanned directories are checked one by one
+                if name.split('/')[0] in prefixes or not default_storage.exists(name):
+                    missing.append((pk, field_name, name))
+
+        for model, field_name in PATH_REFERENCE_FIELDS:
+            self.check_budget()
+            values = (
+                model.objects.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''})
+                .values_list(field_name, flat=True).iterator(chunk_size=self.batch_size)
+            )
+            referenced.update(filter(None, map(self.normalize_path_reference, values)))
+
+        return referenced, missing
+
+    # Reporting and cleanup
+
+    def report(self, stored, orphans, missing):
+        orphan_bytes = 0
+        for name in orphans:
+            try:
+                orphan_bytes += os.path.getsize(os.path.join(self.media_root, name))
+            except FileNotFoundError:
+                pass
+
+        self.stdout.write(f'Orphaned files: {len(orphans)} ({orphan_bytes / (1024 * 1024):.1f}MB)')
+        self.stdout.write(f'Missing files referenced by media: {len(missing)}')
+
+        if self.verbosity >= 2:
+            for name in orphans:
+                self.stdout.write(f'  orphan  {name}')
+            for pk, field_name, name in missing:
+                self.stdout.write(f'  missing media #{pk} {field_name}: {name}')
+
+    def delete_orphans(self, orphans, dry_run):
+        deleted = 0
+        for name in orphans:
+            self.check_budget()
+            if not dry_run:
+                try:
+                    default_storage.delete(name)
+                except Exception as e:
+                    self.stderr.write(f'Error deleting file {name}: {e}')
+                    continue
+            deleted += 1
+
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} orphaned file(s)'))
+
+    def clear_missing(self, missing, dry_run):
+        """Clear thumbnail references to missing files; missing originals are only reported"""
+        thumbnail_fields = {f'thumbnail_{size}' for size in THUMBNAIL_SIZES}
+        cleared = 0
+        for pk, field_name, name in missing:
+            if field_name not in thumbnail_fields:
+                continue
+            self.check_budget()
+            # Files written after the storage scan are not missing
+            if default_storage.exists(name):
+                continue
+            if not dry_run:
+                # Unless the row was re-thumbnailed meanwhile
+                cleared += Media.objects.filter(pk=pk, **{field_name: name}).update(**{field_name: None})
+            else:
+                cleared += 1
+
+        verb = 'Would clear' if dry_run else 'Cleared'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {cleared} missing thumbnail reference(s)'))
+
+    def expire_upload_sessions(self, dry_run):
+        """Drop chunked upload sessions that expired before being finalized"""
+        expired = UploadSession.objects.filter(
+            status=UploadSession.STATUS_ACTIVE, expires_at__lt=timezone.now()
+        )
+        count = 0
+        for session in expired.iterator(chunk_size=self.batch_size):
+            self.check_budget()
+            if not dry_run:
+                path = upload_session_path(session)
+                if os.path.exists(path):
+                    os.remove(path)
+                session.delete()
+            count += 1
+
+        verb = 'Would remove' if dry_run else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {count} expired upload session(s)'))
@@ -0,0 +1,159 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+from io import BytesIO
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import Media, MediaProcessingJob
+from core.utils import apply_rendered_image, render_thumbnails
+
+
+def render_source(data):
+    """Render thumbnails from raw file bytes (runs in a worker process)"""
+    return render_thumbnails(BytesIO(data))
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnails for media uploaded in async processing mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Number of worker processes rendering thumbnails')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Jobs claimed per poll (default: twice the worker count)')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--max-attempts', type=int, default=3,
+                            help='Give up on a job after this many attempts')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Requeue running jobs older than this many seconds')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue and exit instead of polling forever')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        batch_size = options['batch_size'] or workers * 2
+        self.max_attempts = options['max_attempts']
+
+        requeued = self.requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale job(s)')
+
+        self.stdout.write(f'Media worker started with {workers} process(es)')
+        processed = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                jobs = self.claim_jobs(batch_size)
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                futures = {}
+                for job in jobs:
+                    try:
+                        with job.media.file.open('rb') as source:
+                            data = source.read()
+                    except Exception as e:
+                        self.fail_job(job, f'Cannot read source file: {e}', retry=False)
+                        continue
+                    futures[pool.submit(render_source, data)] = job
+
+                for future in as_completed(futures):
+                    job = futures[future]
+                    try:
+                        rendered = future.result()
+                    except Exception as e:
+                        self.fail_job(job, str(e))
+                        continue
+
+                    if rendered is None:
+                        self.fail_job(job, 'Image could not be decoded', retry=False)
+                    elif self.complete_job(job, rendered):
+                        processed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} media file(s)'))
+
+    def requeue_stale_jobs(self, stale_after):
+        """Return jobs left running by a worker that died back to the queue"""
+        cutoff = timezone.now() - timedelta(seconds=stale_after)
+        return MediaProcessingJob.objects.filter(
+            status=MediaProcessingJob.STATUS_RUNNING, started_at__lt=cutoff
+        ).update(status=MediaProcessingJob.STATUS_PENDING)
+
+    def claim_jobs(self, limit):
+        """Atomically move up to ``limit`` pending jobs to running"""
+        with transaction.atomic():
+            job_ids = list(
+                MediaProcessingJob.objects.select_for_update(skip_locked=True)
+                .filter(status=MediaProcessingJob.STATUS_PENDING)
+                .order_by('created_at')
+                .values_list('pk', flat=True)[:limit]
+            )
+            if not job_ids:
+                return []
+            MediaProcessingJob.objects.filter(pk__in=job_ids).update(
+                status=MediaProcessingJob.STATUS_RUNNING,
+                started_at=timezone.now(),
+                attempts=F('attempts') + 1,
+            )
+            Media.objects.filter(processing_jobs__in=job_ids).update(
+                processing_status=Media.STATUS_PROCESSING
+            )
+
+        return list(MediaProcessingJob.objects.filter(pk__in=job_ids).select_related('media'))
+
+    def complete_job(self, job, rendered):
+        """Store the rendered thumbnails and drop the finished job; False if the media is gone"""
+        media = job.media
+        thumbnail_fields = ('thumbnail_small', 'thumbnail_medium', 'thumbnail_large')
+        previous_names = {name: getattr(media, name).name for name in thumbnail_fields}
+        original_name = media.file_name or os.path.basename(media.file.name)
+        apply_rendered_image(media, original_name, rendered)
+        media.processing_status = Media.STATUS_READY
+        try:
+            with transaction.atomic():
+                media.save(update_fields=[
+                    'width', 'height', 'placeholder', 'dominant_color',
+                    'thumbnail_small', 'thumbnail_medium', 'thumbnail_large',
+                    'processing_status', 'updated_at',
+                ])
+                job.delete()
+        except (DatabaseError, ObjectDoesNotExist) as e:
+            # The media was deleted while its job ran; nothing references the new files
+            self.stderr.write(f'Job #{job.pk} (media #{job.media_id}) dropped: {e}')
+            for name in thumbnail_fields:
+                field_file = getattr(media, name)
+                if field_file.name and field_file.name != previous_names[name]:
+                    try:
+                        field_file.storage.delete(field_file.name)
+                    except Exception as e:
+                        print(f"Error deleting file {field_file.name}: {e}")
+            return False
+        return True
+
+    def fail_job(self, job, error, retry=True):
+        """Retry the job later, or mark it and its media as failed"""
+        self.stderr.write(f'Job #{job.pk} (media #{job.media_id}) failed: {error}')
+        if retry and job.attempts < self.max_attempts:
+            job.status = MediaProcessingJob.STATUS_PENDING
+            media_status = Media.STATUS_PENDING
+        else:
+            job.status = MediaProcessingJob.STATUS_FAILED
+            media_status = Media.STATUS_FAILED
+
+        job.last_error = error
+        try:
+            with transaction.atomic():
+                job.save(update_fields=['status', 'last_error', 'updated_at'])
+                Media.objects.filter(pk=job.media_id).update(processing_status=media_status)
+        except (DatabaseError, ObjectDoesNotExist) as e:
+            # Deleted along with its media
+            self.stderr.write(f'Job #{job.pk} (media #{job.media_id}) dropped: {e}')
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import mimetypes
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import Media
+from core.utils import (
+    THUMBNAIL_SIZES, apply_rendered_image, get_file_type_from_extension, render_thumbnails
+)
+
+THUMBNAIL_FIELDS = [f'thumbnail_{size}' for size in THUMBNAIL_SIZES]
+UPDATE_FIELDS = [
+    'file', 'file_type', 'file_size', 'mime_type', 'sha256', 'width', 'height',
+    'placeholder', 'dominant_color', *THUMBNAIL_FIELDS, 'processing_status', 'updated_at',
+]
+
+
+def process_source(path, name):
+    """Hash a stored file and render its thumbnails (runs in a worker process)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(64 * 1024), b''):
+            digest.update(block)
+
+    rendered = None
+    if get_file_type_from_extension(name) == 'image':
+        rendered = render_thumbnails(path)
+    return {'sha256': digest.hexdigest(), 'size': os.path.getsize(path), 'rendered': rendered}
+
+
+def lower_priority(increment):
+    """Worker initializer; os.nice is not available on Windows"""
+    if increment and hasattr(os, 'nice'):
+        os.nice(increment)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild thumbnails and backfill file metadata for existing media'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='companies',
+                            help='Only media of this company id (repeatable)')
+        parser.add_argument('--type', dest='file_type', default=Media.TYPE_IMAGE,
+                            help="File type to process, or 'all' (default: image)")
+        parser.add_argument('--since', help='Only media created on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Only media created before this date (YYYY-MM-DD)')
+        parser.add_argument('--missing-only', action='store_true',
+                            help='Skip media that already have dimensions and every thumbnail')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Worker processes rendering thumbnails')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Media rows per batch and bulk_update')
+        parser.add_argument('--checkpoint', help='File recording progress so an interrupted run can resume')
+        parser.add_argument('--resume', action='store_true', help='Continue after the id stored in --checkpoint')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches to limit load on a live site')
+        parser.add_argument('--nice', type=int, default=10,
+                            help='Scheduling niceness added to worker processes (ignored on Windows)')
+
+    def handle(self, *args, **options):
+        if options['resume'] and not options['checkpoint']:
+            raise CommandError('--resume requires --checkpoint')
+
+        queryset = self.build_queryset(options)
+        last_pk = 0
+        processed = 0
+        if options['resume'] and os.path.exists(options['checkpoint']):
+            with open(options['checkpoint']) as f:
+                state = json.load(f)
+            last_pk, processed = state['last_pk'], state['processed']
+            self.stdout.write(f'Resuming after media #{last_pk}')
+
+        total = processed + queryset.filter(pk__gt=last_pk).count()
+        self.stdout.write(f'{total} media to process with {options["workers"]} worker(s)')
+
+        self.done_groups = set()
+        self.errors = 0
+        started = time.monotonic()
+        done_this_run = 0
+
+        with ProcessPoolExecutor(max_workers=max(1, options['workers']),
+                                 initializer=lower_priority, initargs=(options['nice'],)) as pool:
+            while True:
+                batch = list(queryset.filter(pk__gt=last_pk)[:options['batch_size']])
+                if not batch:
+                    break
+
+                self.process_batch(pool, batch)
+                last_pk = batch[-1].pk
+                processed += len(batch)
+                done_this_run += len(batch)
+
+                if options['checkpoint']:
+                    self.write_checkpoint(options['checkpoint'], last_pk, processed)
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{processed}/{total} processed, {done_this_run / elapsed:.1f} media/s, '
+                    f'{self.errors} error(s), last id {last_pk}'
+                )
+                if options['pause']:
+                    time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Finished: {processed} media processed, {self.errors} error(s) '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
+
+    def build_queryset(self, options):
+        queryset = Media.objects.order_by('pk')
+        if options['companies']:
+            queryset = queryset.filter(company_id__in=options['companies'])
+        if options['file_type'] != 'all':
+            # Rows without a type are included; their type is backfilled from the extension
+            queryset = queryset.filter(
+                Q(file_type=options['file_type']) | Q(file_type__isnull=True) | Q(file_type='')
+            )
+        for option, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lt')):
+            if options[option]:
+                try:
+                    day = datetime.strptime(options[option], '%Y-%m-%d')
+                except ValueError:
+                    raise CommandError(f'--{option} must be a date in YYYY-MM-DD format')
+                queryset = queryset.filter(**{lookup: timezone.make_aware(day)})
+        if options['missing_only']:
+            incomplete = Media.objects.none()
+            for field_name in ['width', 'height', 'placeholder', *THUMBNAIL_FIELDS]:
+                incomplete = incomplete | queryset.filter(**{f'{field_name}__isnull': True})
+            for field_name in THUMBNAIL_FIELDS:
+                incomplete = incomplete | queryset.filter(**{field_name: ''})
+            queryset = incomplete.order_by('pk')
+        return queryset
+
+    def source_name(self, media):
+        """Storage name of the original file, falling back to the legacy file_path"""
+        if media.file:
+            return media.file.name
+        if media.file_path:
+            path = urlparse(media.file_path).path
+            if path.startswith(settings.MEDIA_URL):
+                path = path[len(settings.MEDIA_URL):]
+            return path.lstrip('/') or None
+        return None
+
+    def group_key(self, media):
+        """Deduplicated media sharing stored files are regenerated together"""
+        if media.sha256:
+            return (media.company_id, media.sha256)
+        return ('pk', media.pk)
+
+    def process_batch(self, pool, batch):
+        futures = {}
+        for media in batch:
+            key = self.group_key(media)
+            if key in self.done_groups:
+                continue
+            self.done_groups.add(key)
+
+            name = self.source_name(media)
+            try:
+                path = default_storage.path(name) if name else None
+            except NotImplementedError:
+                raise CommandError('regenerate_thumbnails needs a storage backend with local paths')
+            if not path or not os.path.exists(path):
+                self.stderr.write(f'Media #{media.pk}: source file not found ({name})')
+                self.errors += 1
+                continue
+            futures[key] = (media, name, pool.submit(process_source, path, name))
+
+        # Members of deduplicated groups outside this batch are updated as well
+        hashes = {key[1] for key in futures if key[0] != 'pk'}
+        members = {}
+        if hashes:
+            for member in Media.objects.filter(sha256__in=hashes):
+                members.setdefault((member.company_id, member.sha256), []).append(member)
+
+        to_update = []
+        replaced_names = set()
+        for key, (media, name, future) in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                self.stderr.write(f'Media #{media.pk}: {e}')
+                self.errors += 1
+                continue
+            if result['rendered'] is None and get_file_type_from_extension(name) == 'image':
+                # Metadata is still backfilled; the existing thumbnails are kept
+                self.stderr.write(f'Media #{media.pk}: image could not be decoded')
+                self.errors += 1
+
+            old_names = {getattr(media, field_name).name for field_name in THUMBNAIL_FIELDS}
+            self.apply_result(media, name, result)
+            if result['rendered']:
+                replaced_names |= old_names
+            to_update.append(media)
+
+            for member in members.get(key, []):
+                if member.pk == media.pk:
+                    continue
+                self.copy_files(media, member)
+                to_update.append(member)
+
+        with transaction.atomic():
+            Media.objects.bulk_update(to_update, UPDATE_FIELDS)
+
+        # Every row of a group now points at the new thumbnails
+        current_names = {getattr(m, field_name).name for m in to_update for field_name in THUMBNAIL_FIELDS}
+        for old_name in replaced_names - current_names:
+            if old_name:
+                try:
+                    default_storage.delete(old_name)
+                except Exception as e:
+                    self.stderr.write(f'Error deleting file {old_name}: {e}')
+
+    def apply_result(self, media, name, result):
+        if not media.file:
+            media.file = name
+        media.sha256 = result['sha256']
+        media.file_size = result['size']
+        media.mime_type = media.mime_type or mimetypes.guess_type(name)[0]
+        media.file_type = media.file_type or get_file_type_from_extension(name)
+        if result['rendered']:
+            apply_rendered_image(media, media.file_name or os.path.basename(name), result['rendered'])
+            media.processing_status = Media.STATUS_READY
+        media.updated_at = timezone.now()
+
+    def copy_files(self, source, target):
+        target.file = source.file.name
+        for attr in ('sha256', 'file_size', 'mime_type', 'file_type', 'width', 'height',
+                     'placeholder', 'dominant_color', 'processing_status'):
+            setattr(target, attr, getattr(source, attr))
+        for field_name in THUMBNAIL_FIELDS:
+            setattr(target, field_name, getattr(source, field_name).name or None)
+        target.updated_at = source.updated_at
+
+    def write_checkpoint(self, path, last_pk, processed):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'last_pk': last_pk, 'processed': processed}, f)
+        os.replace(temp_path, path)
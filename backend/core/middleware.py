@@ -0,0 +1,167 @@
+"""
+Request instrumentation: query counts, DB and serializer time per request;
+batched content history writes
+"""
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from .content_history import capture_batch
+
+logger = logging.getLogger('core.performance')
+
+
+def query_budget(max_queries):
+    """Set the query budget of a function view"""
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+class RequestMetrics:
+    """Timings collected while one request is handled"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.slowest_query = None
+        self.slowest_query_time = 0.0
+        self.spans = {}
+        self._span_depth = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.query_count += 1
+            self.db_time += duration
+            if duration >= self.slowest_query_time:
+                self.slowest_query = sql
+                self.slowest_query_time = duration
+
+    @contextmanager
+    def span(self, name):
+        """Add the time spent in the block to a named span; nested blocks count once"""
+        depth = self._span_depth.get(name, 0)
+        self._span_depth[name] = depth + 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._span_depth[name] = depth
+            if depth == 0:
+                self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - started
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+
+@contextmanager
+def measure(request, name):
+    """Time a block as a span of the request, if the request is instrumented"""
+    metrics = getattr(request, 'instrumentation', None)
+    if metrics is None:
+        yield
+        return
+    with metrics.span(name):
+        yield
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Record queries, DB time, serializer time and the slowest SQL statement of
+    each request.
+
+    The figures are sent back as a ``Server-Timing`` header, requests slower
+    than REQUEST_SLOW_THRESHOLD_MS are logged to ``core.performance`` and a
+    warning is logged when a view runs more queries than its budget. ViewSets
+    set the budget with a ``query_budget`` attribute, function views with the
+    ``query_budget`` decorator; REQUEST_QUERY_BUDGET is the default.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'REQUEST_INSTRUMENTATION', True)
+        self.server_timing = getattr(settings, 'REQUEST_SERVER_TIMING', True)
+        self.slow_threshold = getattr(settings, 'REQUEST_SLOW_THRESHOLD_MS', 500) / 1000
+        self.default_budget = getattr(settings, 'REQUEST_QUERY_BUDGET', None)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        request.instrumentation = metrics
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+
+        total_time = metrics.total_time
+        if self.server_timing:
+            response['Server-Timing'] = self.server_timing_header(metrics, total_time)
+
+        view_name = getattr(request, 'instrumented_view', None) or request.path
+        budget = getattr(request, 'query_budget', self.default_budget)
+        record = None
+        if budget is not None and metrics.query_count > budget:
+            record = self.build_record(request, response, metrics, total_time, view_name)
+            logger.warning('Query budget exceeded: %s', json.dumps({**record, 'query_budget': budget}))
+        if total_time >= self.slow_threshold:
+            record = record or self.build_record(request, response, metrics, total_time, view_name)
+            logger.warning('Slow request: %s', json.dumps(record))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # DRF views expose their class, function views the function itself
+        view = getattr(view_func, 'cls', view_func)
+        request.instrumented_view = f'{view.__module__}.{view.__qualname__}'
+        budget = getattr(view, 'query_budget', None)
+        if budget is not None:
+            request.query_budget = budget
+        return None
+
+    def server_timing_header(self, metrics, total_time):
+        entries = [
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.query_count} queries"',
+            f'db-slowest;dur={metrics.slowest_query_time * 1000:.1f}',
+        ]
+        for name, duration in sorted(metrics.spans.items()):
+            entries.append(f'{name};dur={duration * 1000:.1f}')
+        entries.append(f'total;dur={total_time * 1000:.1f}')
+        return ', '.join(entries)
+
+    def build_record(self, request, response, metrics, total_time, view_name):
+        return {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': view_name,
+            'status': response.status_code,
+            'total_ms': round(total_time * 1000, 1),
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'queries': metrics.query_count,
+            **{f'{name}_ms': round(duration * 1000, 1) for name, duration in metrics.spans.items()},
+            'slowest_query_ms': round(metrics.slowest_query_time * 1000, 1),
+            'slowest_query': metrics.slowest_query,
+        }
+
+
+class ContentHistoryMiddleware:
+    """Write the content history of each request in one batch once the view is done"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with capture_batch():
+            return self.get_response(request)
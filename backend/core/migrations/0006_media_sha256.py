@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_media_processing_status_mediaprocessingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='sha256',
+            field=models.CharField(blank=True, help_text='Content hash used to deduplicate uploads', max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['company', 'sha256'], name='media_company_sha256_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='dominant_color',
+            field=models.CharField(blank=True, help_text='Hex colour, e.g. #a1b2c3', max_length=7, null=True),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='placeholder',
+            field=models.TextField(blank=True, help_text='Tiny blurred preview as a data URI', null=True),
+        ),
+    ]
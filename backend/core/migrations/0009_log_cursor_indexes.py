@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_media_placeholder'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='contenthistory',
+            options={'ordering': ['-created_at', '-id'], 'verbose_name_plural': 'Content Histories'},
+        ),
+        migrations.AlterModelOptions(
+            name='userlog',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='contenthistory',
+            index=models.Index(fields=['created_at', 'id'], name='history_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contenthistory',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='history_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlog',
+            index=models.Index(fields=['created_at', 'id'], name='userlog_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlog',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='userlog_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_log_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['is_featured', 'display_order', 'name'], name='client_featured_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['company', 'file_type', '-created_at'], name='media_company_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='news',
+            index=models.Index(fields=['status', '-published_at', '-created_at'], name='news_status_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['featured', '-created_at'], name='project_featured_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='socialmedia',
+            index=models.Index(fields=['is_active', 'display_order', 'platform'], name='social_active_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(fields=['company', 'is_management'], name='team_company_mgmt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testimonial',
+            index=models.Index(fields=['is_featured', '-created_at'], name='testimonial_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['role', 'username'], name='user_role_username_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_userlog_event_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('kind', models.CharField(max_length=64)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.company')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.user')),
+            ],
+            options={
+                'ordering': ['day', 'user', 'kind'],
+                'indexes': [models.Index(fields=['day', 'user'], name='rollup_day_user_idx'), models.Index(fields=['company', 'day'], name='rollup_company_day_idx')],
+                'unique_together': {('user', 'day', 'kind')},
+            },
+        ),
+    ]
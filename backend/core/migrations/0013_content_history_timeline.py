@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_user_activity_rollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contenthistory',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='contenthistory',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.user'),
+        ),
+        migrations.AddIndex(
+            model_name='contenthistory',
+            index=models.Index(fields=['table_name', 'record_id', 'created_at'], name='history_record_created_idx'),
+        ),
+    ]
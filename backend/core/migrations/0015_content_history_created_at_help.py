@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:53
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_upload_session_finalizing'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contenthistory',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, help_text="Time of the entry's first change; changes coalesced into it keep this time"),
+        ),
+    ]
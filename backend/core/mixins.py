@@ -0,0 +1,629 @@
+"""
+Reusable ViewSet mixins
+"""
+from datetime import datetime, time, timedelta
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+
+from .conditional import queryset_validators
+from .content_history import field_values
+from .signals import bulk_create_with_signals, send_post_save
+
+
+def _lookup_name(lookup):
+    """Relation path of a prefetch lookup given as a string or Prefetch object"""
+    return lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup
+
+
+def collect_related_lookups(fields, model, prefix=''):
+    """
+    Walk a serializer's fields (its ``fields`` mapping) and return the
+    ``(select_related, prefetch_related)`` lookups needed to render ``model``
+    instances without extra queries.
+
+    Dotted ``source`` paths through foreign keys (e.g. ``company.name``) become
+    select_related lookups, nested serializers are followed recursively and
+    to-many relations are prefetched. Fields that only need the foreign key
+    value, such as the default primary key fields, add nothing.
+    """
+    select_related = set()
+    prefetch_related = set()
+
+    for field in fields.values():
+        if field.write_only or field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+            continue
+
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        current_model = model
+        path = []
+
+        for position, attr in enumerate(field.source_attrs):
+            try:
+                model_field = current_model._meta.get_field(attr)
+            except Exception:
+                break  # Properties and methods cannot be optimized
+            if not model_field.is_relation:
+                break
+
+            path.append(attr)
+            lookup = prefix + '__'.join(path)
+            is_last = position == len(field.source_attrs) - 1
+
+            if model_field.many_to_many or model_field.one_to_many:
+                prefetch_related.add(lookup)
+                if is_last and isinstance(nested, serializers.BaseSerializer):
+                    child_select, child_prefetch = collect_related_lookups(
+                        nested.fields, model_field.related_model, prefix=lookup + '__'
+                    )
+                    # Related objects of prefetched rows are prefetched as well
+                    prefetch_related |= child_select | child_prefetch
+                break
+
+            # Forward foreign keys and one-to-one relations
+            if is_last:
+                if isinstance(field, (PrimaryKeyRelatedField, ManyRelatedField)):
+                    break  # Only the stored key is needed
+                select_related.add(lookup)
+                if isinstance(nested, serializers.BaseSerializer):
+                    child_select, child_prefetch = collect_related_lookups(
+                        nested.fields, model_field.related_model, prefix=lookup + '__'
+                    )
+                    select_related |= child_select
+                    prefetch_related |= child_prefetch
+            else:
+                select_related.add(lookup)
+            current_model = model_field.related_model
+
+    return select_related, prefetch_related
+
+
+class SerializerFieldsMixin:
+    """
+    Fields of unbound serializers, built once per request and shared by the
+    queryset optimizations below. ViewSets are instantiated per request, so
+    the fields are cached on the instance.
+    """
+
+    def get_serializer_fields(self, serializer_class):
+        cache = self.__dict__.setdefault('_serializer_fields', {})
+        if serializer_class not in cache:
+            cache[serializer_class] = serializer_class().fields
+        return cache[serializer_class]
+
+
+class QuerysetOptimizerMixin(SerializerFieldsMixin):
+    """
+    Apply select_related/prefetch_related derived from the ViewSet's serializer.
+
+    Relations only reached from SerializerMethodFields cannot be detected and
+    are listed in ``extra_select_related``/``extra_prefetch_related`` instead.
+    A ``Prefetch`` object in the extras replaces the derived lookup of the same
+    relation, e.g. to filter or limit the prefetched rows.
+    """
+    extra_select_related = ()
+    extra_prefetch_related = ()
+
+    # Serializer class -> (select_related, prefetch_related)
+    _related_lookups_cache = {}
+
+    def get_queryset(self):
+        return self.optimize_queryset(super().get_queryset())
+
+    def get_related_lookups(self, serializer_class, model):
+        key = (serializer_class, model)
+        cache = QuerysetOptimizerMixin._related_lookups_cache
+        if key not in cache:
+            fields = self.get_serializer_fields(serializer_class)
+            select_related, prefetch_related = collect_related_lookups(fields, model)
+            cache[key] = (sorted(select_related), sorted(prefetch_related))
+        return cache[key]
+
+    def get_extra_prefetch_related(self):
+        return self.extra_prefetch_related
+
+    def filter_extra_prefetch_related(self, lookups):
+        return lookups
+
+    def optimize_queryset(self, queryset):
+        serializer_class = self.get_serializer_class()
+        if not issubclass(serializer_class, serializers.ModelSerializer):
+            return queryset
+
+        select_related, prefetch_related = self.get_related_lookups(serializer_class, queryset.model)
+        select_related = [*select_related, *self.extra_select_related]
+
+        # Lookups of the same relation are merged, the extras taking precedence
+        prefetch_lookups = {lookup: lookup for lookup in prefetch_related}
+        for lookup in self.filter_extra_prefetch_related(self.get_extra_prefetch_related()):
+            prefetch_lookups[_lookup_name(lookup)] = lookup
+
+        if select_related and queryset.query.select_related is not True:
+            queryset = queryset.select_related(*select_related)
+
+        existing = {_lookup_name(lookup) for lookup in queryset._prefetch_related_lookups}
+        missing = [lookup for name, lookup in sorted(prefetch_lookups.items()) if name not in existing]
+        if missing:
+            queryset = queryset.prefetch_related(*missing)
+        return queryset
+
+
+class ConditionalGetMixin:
+    """
+    Answer ``If-None-Match``/``If-Modified-Since`` on list and detail routes.
+
+    The ETag and Last-Modified validators come from one aggregate query over
+    the requested rows and the relations their serializer reads (see
+    ``queryset_validators``), so a 304 is returned before anything is
+    serialized. Paginated lists aggregate over the rows of the requested page
+    only. Combine with QuerysetOptimizerMixin to cover related rows.
+    """
+
+    def get_validator_relations(self):
+        if not hasattr(self, 'get_related_lookups'):
+            return ()
+        select_related, prefetch_related = self.get_related_lookups(
+            self.get_serializer_class(), self.queryset.model
+        )
+        extras = [_lookup_name(lookup) for lookup in
+                  self.filter_extra_prefetch_related(self.get_extra_prefetch_related())]
+        return sorted({*select_related, *prefetch_related, *self.extra_select_related, *extras})
+
+    def conditional_response(self, queryset, handler, request, *args, key=None, **kwargs):
+        etag, last_modified = queryset_validators(
+            queryset, self.get_validator_relations(), key=key or request.get_full_path()
+        )
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def page_state(self, page):
+        """What a page response shows besides its rows: their order, the total and the links"""
+        state = [obj.pk for obj in page]
+        paginator = getattr(getattr(self.paginator, 'page', None), 'paginator', None)
+        if paginator is not None:
+            state.append(paginator.count)
+        state += [getattr(self.paginator, flag) for flag in ('has_next', 'has_previous')
+                  if hasattr(self.paginator, flag)]
+        return state
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        # Related rows are prefetched only once the response is known to be needed
+        prefetch_lookups = queryset._prefetch_related_lookups
+        page = self.paginate_queryset(queryset.prefetch_related(None))
+        if page is None:
+            return self.conditional_response(queryset, super().list, request, *args, **kwargs)
+
+        # Validators cover the rows of this page only, so large tables are not
+        # aggregated on every page fetch
+        rows = queryset.model._default_manager.filter(pk__in=[obj.pk for obj in page])
+
+        def render_page(request, *args, **kwargs):
+            prefetch_related_objects(page, *prefetch_lookups)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+        key = f'{request.get_full_path()}|{self.page_state(page)}'
+        return self.conditional_response(rows, render_page, request, *args, key=key, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        except (TypeError, ValueError, DjangoValidationError):
+            raise Http404
+        return self.conditional_response(queryset, super().retrieve, request, *args, **kwargs)
+
+
+class SerializerTimingMixin:
+    """Report the time spent serializing response data as the request's ``serialize`` span"""
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        metrics = getattr(self.request, 'instrumentation', None)
+        if metrics is None:
+            return serializer
+
+        to_representation = serializer.to_representation
+
+        def timed_to_representation(instance):
+            with metrics.span('serialize'):
+                return to_representation(instance)
+
+        serializer.to_representation = timed_to_representation
+        return serializer
+
+
+class SparseFieldsetMixin(SerializerFieldsMixin):
+    """
+    Support ``?fields=a,b`` and ``?exclude=c`` on read requests.
+
+    The serializer output is trimmed to the selected fields and, where every
+    selected field maps onto model columns, the queryset is restricted with
+    ``only()`` so unused columns are not read. SerializerMethodFields and other
+    computed fields name the columns they read in ``field_dependencies``;
+    without an entry the queryset is left undeferred rather than risking a
+    query per row. Combine with QuerysetOptimizerMixin, listed after this mixin,
+    so that joins and prefetches follow the trimmed field set.
+    """
+    field_dependencies = {}
+
+    def _parse_field_list(self, param):
+        value = self.request.query_params.get(param) if self.request else None
+        if not value:
+            return None
+        return {name.strip() for name in value.split(',') if name.strip()}
+
+    def get_sparse_field_names(self, available):
+        """Names of the serializer fields to keep, or None to keep them all"""
+        if self.request is None or self.request.method not in ('GET', 'HEAD'):
+            return None
+        fields = self._parse_field_list('fields')
+        exclude = self._parse_field_list('exclude')
+        if fields is None and exclude is None:
+            return None
+
+        kept = set(available) if fields is None else set(available) & fields
+        return kept - (exclude or set())
+
+    def trim_fields(self, serializer):
+        """Drop deselected fields from a serializer (or its list child) in place"""
+        target = serializer.child if isinstance(serializer, serializers.ListSerializer) else serializer
+        kept = self.get_sparse_field_names(target.fields)
+        if kept is not None:
+            for name in list(target.fields):
+                if name not in kept:
+                    target.fields.pop(name)
+        return serializer
+
+    def get_serializer(self, *args, **kwargs):
+        return self.trim_fields(super().get_serializer(*args, **kwargs))
+
+    def get_selected_fields(self, serializer_class):
+        """The serializer fields kept by ?fields=/?exclude=, or None when all are kept"""
+        fields = self.get_serializer_fields(serializer_class)
+        kept = self.get_sparse_field_names(fields)
+        if kept is None:
+            return None
+        return {name: field for name, field in fields.items() if name in kept}
+
+    def get_related_lookups(self, serializer_class, model):
+        selected = self.get_selected_fields(serializer_class)
+        if selected is None:
+            return super().get_related_lookups(serializer_class, model)
+        select_related, prefetch_related = collect_related_lookups(selected, model)
+        return sorted(select_related), sorted(prefetch_related)
+
+    def filter_extra_prefetch_related(self, lookups):
+        """Skip extra prefetches rooted at a relation no selected field reads"""
+        lookups = super().filter_extra_prefetch_related(lookups)
+        fields = self.get_serializer_fields(self.get_serializer_class())
+        kept = self.get_sparse_field_names(fields)
+        if kept is None:
+            return lookups
+
+        removed_roots = {field.source_attrs[0] for name, field in fields.items()
+                         if name not in kept and field.source != '*'}
+        kept_roots = {field.source_attrs[0] for name, field in fields.items()
+                      if name in kept and field.source != '*'}
+        return tuple(
+            lookup for lookup in lookups
+            if _lookup_name(lookup).split('__')[0] not in removed_roots - kept_roots
+        )
+
+    def get_queryset(self):
+        return self.defer_unused_columns(super().get_queryset())
+
+    def get_required_columns(self, fields, model):
+        """Model columns the given serializer fields read, or None if unknown"""
+        columns = {model._meta.pk.name}
+        for name, field in fields.items():
+            if name in self.field_dependencies:
+                columns.update(self.field_dependencies[name])
+                continue
+            if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+                return None
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except Exception:
+                return None  # A model property or method with unknown dependencies
+            if model_field.concrete:
+                columns.add(model_field.name)
+                if model_field.many_to_one or model_field.one_to_one:
+                    columns.update(self._related_columns(model_field, field.source_attrs[1:]))
+            # Reverse relations are loaded by prefetch and only need the primary key
+        return columns
+
+    def _related_columns(self, relation, attrs):
+        """Columns of a joined model read by a dotted source such as company.name"""
+        if not attrs or isinstance(attrs, str):
+            return ()
+        path = relation.name
+        model = relation.related_model
+        for attr in attrs:
+            try:
+                model_field = model._meta.get_field(attr)
+            except Exception:
+                return ()  # The whole related row stays loaded
+            path = f'{path}__{model_field.name}'
+            if not (model_field.many_to_one or model_field.one_to_one):
+                return (path,) if model_field.concrete else ()
+            model = model_field.related_model
+        return ()
+
+    def defer_unused_columns(self, queryset):
+        serializer_class = self.get_serializer_class()
+        if not issubclass(serializer_class, serializers.ModelSerializer):
+            return queryset
+        selected = self.get_selected_fields(serializer_class)
+        if selected is None:
+            return queryset
+
+        columns = self.get_required_columns(selected, queryset.model)
+        if columns is None:
+            return queryset
+
+        # Relations joined with select_related must stay loaded
+        if isinstance(queryset.query.select_related, dict):
+            columns.update(queryset.query.select_related)
+        # Cursor pagination reads the ordering fields of the page's edge rows
+        ordering = getattr(self.paginator, 'ordering', None) or ()
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        columns.update(field.lstrip('-') for field in ordering)
+        return queryset.only(*columns)
+
+
+class CreatedRangeFilterMixin:
+    """
+    Filter on ``?user_id=``, ``?created_after=`` and ``?created_before=``.
+
+    The bounds accept ISO 8601 datetimes or dates and are inclusive; a date as
+    upper bound includes that whole day.
+    """
+
+    def parse_bound(self, param):
+        """Return the bound as an aware datetime and whether it was a plain date"""
+        value = self.request.query_params.get(param)
+        if not value:
+            return None, False
+
+        try:
+            day = parse_date(value)
+            parsed = None if day else parse_datetime(value)
+        except ValueError:
+            day = parsed = None
+        if day:
+            return timezone.make_aware(datetime.combine(day, time.min)), True
+        if parsed is None:
+            raise ValidationError({param: 'Use an ISO 8601 date or datetime.'})
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed, False
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        user_id = self.request.query_params.get('user_id')
+        if user_id:
+            try:
+                user_id = int(user_id)
+            except ValueError:
+                raise ValidationError({'user_id': 'Use an integer user id.'})
+            queryset = queryset.filter(user_id=user_id)
+
+        created_after, _is_date = self.parse_bound('created_after')
+        if created_after:
+            queryset = queryset.filter(created_at__gte=created_after)
+
+        created_before, is_date = self.parse_bound('created_before')
+        if created_before and is_date:
+            queryset = queryset.filter(created_at__lt=created_before + timedelta(days=1))
+        elif created_before:
+            queryset = queryset.filter(created_at__lte=created_before)
+        return queryset
+
+
+class PrefetchedRows:
+    """Stands in for a related field's queryset with the rows fetched once for a whole batch"""
+
+    def __init__(self, model, rows):
+        self.model = model
+        self.rows = {str(row.pk): row for row in rows}
+
+    def get(self, pk):
+        try:
+            return self.rows[str(pk)]
+        except KeyError:
+            raise self.model.DoesNotExist
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """List serializer validating each item against its own row (``instances`` maps ids to rows)"""
+
+    def __init__(self, *args, instances=None, **kwargs):
+        self.instances = instances or {}
+        super().__init__(*args, **kwargs)
+
+    def run_child_validation(self, data):
+        # Unique validators must not count the row being updated as a conflict
+        self.child.instance = self.instances.get(str(data.get('id'))) if isinstance(data, dict) else None
+        self.child.initial_data = data
+        return super().run_child_validation(data)
+
+
+class BulkModelMixin:
+    """
+    List-level ``bulk`` action applying many rows in one transaction.
+
+    ``POST`` creates the items of an array, ``PATCH`` partially updates the
+    items of an array (each with its ``id``) and ``DELETE`` deletes
+    ``{"ids": [...]}``. The whole array is validated first; if any item fails,
+    nothing is written and the errors are returned per item index. Rows are
+    written with ``bulk_create``/``bulk_update``, which skip model signals, so
+    ``post_save`` is sent for each row afterwards to keep cache invalidation
+    and content history working. Where the database cannot return the ids of
+    a bulk insert, created rows are saved one by one instead. For models
+    without many-to-many fields.
+    """
+    bulk_max_items = 500
+
+    def bulk_items(self, request, key=None):
+        """The request's array of items, or a 400 response"""
+        items = request.data.get(key) if key and isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            where = f' as {key}' if key else ''
+            return None, Response({'error': f'Send a non-empty array{where}'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.bulk_max_items:
+            return None, Response({'error': f'At most {self.bulk_max_items} items per request'},
+                                  status=status.HTTP_400_BAD_REQUEST)
+        return items, None
+
+    def bulk_rows(self, ids):
+        """Rows with the given ids keyed by str(id), with every column loaded"""
+        try:
+            rows = self.filter_queryset(self.get_queryset()).filter(pk__in=ids).defer(None)
+            return {str(row.pk): row for row in rows}
+        except (TypeError, ValueError):
+            raise ValidationError({'id': 'Ids must be integers.'})
+
+    def bulk_errors(self, errors):
+        return Response({'errors': [{'index': index, 'errors': item_errors} for index, item_errors in errors]},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    def prefetch_related_fields(self, child, items):
+        """Look up the rows referenced by the items' primary key fields in one query per field"""
+        for name, field in child.fields.items():
+            if field.read_only or not isinstance(field, PrimaryKeyRelatedField):
+                continue
+            queryset = field.get_queryset()
+            try:
+                keys = {item[name] for item in items if isinstance(item, dict)
+                        and item.get(name) not in (None, '') and not isinstance(item[name], bool)}
+                rows = list(queryset.filter(pk__in=keys)) if keys else []
+            except (TypeError, ValueError):
+                continue  # Left to the field, which reports the invalid value
+            field.queryset = PrefetchedRows(queryset.model, rows)
+
+    def bulk_validate(self, items, instances=None):
+        """Validated data of every item, or a 400 response with the errors of the failing ones"""
+        partial = instances is not None
+        child = self.get_serializer(partial=partial)
+        self.prefetch_related_fields(child, items)
+        serializer = BulkListSerializer(
+            child=child, data=items, instances=instances, partial=partial,
+            context=self.get_serializer_context(),
+        )
+        if serializer.is_valid():
+            return serializer.validated_data, None
+        # Partial list serializers report errors keyed by item index instead of as a list
+        errors = serializer.errors
+        errors = sorted(errors.items()) if isinstance(errors, dict) else enumerate(errors)
+        return None, self.bulk_errors((index, item) for index, item in errors if item)
+
+    @action(detail=False, methods=['post', 'patch', 'delete'])
+    def bulk(self, request):
+        """Create, update or delete many rows in one request"""
+        if request.method == 'DELETE':
+            return self.bulk_delete(request)
+        if request.method == 'PATCH':
+            return self.bulk_update(request)
+        return self.bulk_create(request)
+
+    def bulk_create(self, request):
+        items, error_response = self.bulk_items(request)
+        if error_response:
+            return error_response
+        validated, error_response = self.bulk_validate(items)
+        if error_response:
+            return error_response
+
+        model = self.get_queryset().model
+        rows = [model(**attrs) for attrs in validated]
+        try:
+            with transaction.atomic():
+                bulk_create_with_signals(model, rows)
+        except IntegrityError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(rows, many=True).data, status=status.HTTP_201_CREATED)
+
+    def bulk_update(self, request):
+        items, error_response = self.bulk_items(request)
+        if error_response:
+            return error_response
+        ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+        instances = self.bulk_rows([pk for pk in ids if pk is not None])
+
+        seen, missing = set(), []
+        for index, pk in enumerate(ids):
+            if pk is None:
+                missing.append((index, {'id': ['This field is required.']}))
+            elif str(pk) not in instances or str(pk) in seen:
+                missing.append((index, {'id': ['Not found.' if str(pk) not in instances else 'Duplicate id.']}))
+            seen.add(str(pk))
+        if missing:
+            return self.bulk_errors(missing)
+
+        validated, error_response = self.bulk_validate(items, instances)
+        if error_response:
+            return error_response
+
+        model = self.get_queryset().model
+        rows, fields = [], set()
+        for pk, attrs in zip(ids, validated):
+            row = instances[str(pk)]
+            # Read by the post_save receivers of core.signals in place of a pre_save lookup
+            row._previous_values = field_values(row)
+            for name, value in attrs.items():
+                setattr(row, name, value)
+            rows.append(row)
+            fields.update(attrs)
+        # bulk_update does not apply auto_now
+        now = timezone.now()
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False):
+                fields.add(field.name)
+                for row in rows:
+                    setattr(row, field.attname, now)
+
+        try:
+            with transaction.atomic():
+                if fields:
+                    model.objects.bulk_update(rows, sorted(fields), batch_size=self.bulk_max_items)
+                send_post_save(model, rows, created=False)
+        except IntegrityError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(rows, many=True).data)
+
+    def bulk_delete(self, request):
+        ids, error_response = self.bulk_items(request, 'ids')
+        if error_response:
+            return error_response
+        found = self.bulk_rows(ids)
+        missing = [(index, {'id': ['Not found.']}) for index, pk in enumerate(ids) if str(pk) not in found]
+        if missing:
+            return self.bulk_errors(missing)
+
+        # A filtered delete; Django still sends post_delete per row to the receivers
+        with transaction.atomic():
+            self.get_queryset().model.objects.filter(pk__in=[row.pk for row in found.values()]).delete()
+        return Response({'deleted': len(found)})
@@ -1,4 +1,8 @@
+import math
+import uuid
+
 from django.db import models
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -80,6 +84,9 @@ class User(models.Model):
 
     class Meta:
         ordering = ['username']
+        indexes = [
+            models.Index(fields=['role', 'username'], name='user_role_username_idx'),
+        ]
 
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
@@ -106,6 +113,9 @@ class TeamMember(models.Model):
 
     class Meta:
         ordering = ['display_order', 'name']
+        indexes = [
+            models.Index(fields=['company', 'is_management'], name='team_company_mgmt_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.position}"
@@ -117,15 +127,40 @@ class UserLog(models.Model):
     activity = models.TextField()
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Event time, kept when logs are written in batches after the request
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='userlog_created_id_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='userlog_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.activity[:50]}..."
 
 
+class UserActivityRollup(models.Model):
+    """Daily count of a user's logged activities of one kind, maintained from UserLog rows"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True)
+    day = models.DateField()
+    kind = models.CharField(max_length=64)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['user', 'day', 'kind']
+        ordering = ['day', 'user', 'kind']
+        indexes = [
+            models.Index(fields=['day', 'user'], name='rollup_day_user_idx'),
+            models.Index(fields=['company', 'day'], name='rollup_company_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.day} {self.kind}: {self.count}"
+
+
 class Category(models.Model):
     """Category model matching the categories table from the SQL schema"""
     name = models.CharField(max_length=255)
@@ -239,6 +274,9 @@ class Project(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['featured', '-created_at'], name='project_featured_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -276,6 +314,9 @@ class Testimonial(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_featured', '-created_at'], name='testimonial_featured_idx'),
+        ]
 
     def __str__(self):
         return f"{self.client_name} - {self.client_company or 'Testimonial'}"
@@ -295,6 +336,9 @@ class Client(models.Model):
 
     class Meta:
         ordering = ['display_order', 'name']
+        indexes = [
+            models.Index(fields=['is_featured', 'display_order', 'name'], name='client_featured_order_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -325,6 +369,9 @@ class News(models.Model):
     class Meta:
         verbose_name_plural = "News"
         ordering = ['-published_at', '-created_at']
+        indexes = [
+            models.Index(fields=['status', '-published_at', '-created_at'], name='news_status_published_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -345,6 +392,18 @@ class Media(models.Model):
         (TYPE_AUDIO, 'Audio'),
     ]
     
+    # Thumbnail processing status
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    PROCESSING_STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
     company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True)
     
     # Original file information
@@ -354,6 +413,7 @@ class Media(models.Model):
     file_type = models.CharField(max_length=50, choices=TYPE_CHOICES, blank=True, null=True)
     file_size = models.BigIntegerField(null=True, blank=True)  # Size in bytes
     mime_type = models.CharField(max_length=100, blank=True, null=True)
+    sha256 = models.CharField(max_length=64, blank=True, null=True, help_text="Content hash used to deduplicate uploads")
     
     # Metadata
     title = models.CharField(max_length=255, blank=True, null=True)
@@ -363,11 +423,14 @@ class Media(models.Model):
     # Image-specific fields
     width = models.PositiveIntegerField(null=True, blank=True)
     height = models.PositiveIntegerField(null=True, blank=True)
+    placeholder = models.TextField(blank=True, null=True, help_text="Tiny blurred preview as a data URI")
+    dominant_color = models.CharField(max_length=7, blank=True, null=True, help_text="Hex colour, e.g. #a1b2c3")
     
     # Thumbnails (for images)
     thumbnail_small = models.FileField(upload_to='thumbnails/small/%Y/%m/', blank=True, null=True)
     thumbnail_medium = models.FileField(upload_to='thumbnails/medium/%Y/%m/', blank=True, null=True)
     thumbnail_large = models.FileField(upload_to='thumbnails/large/%Y/%m/', blank=True, null=True)
+    processing_status = models.CharField(max_length=20, choices=PROCESSING_STATUS_CHOICES, default=STATUS_READY)
     
     # Metadata
     uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -377,21 +440,25 @@ class Media(models.Model):
     class Meta:
         verbose_name_plural = "Media"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['company', 'sha256'], name='media_company_sha256_idx'),
+            models.Index(fields=['company', 'file_type', '-created_at'], name='media_company_type_idx'),
+        ]
 
     def __str__(self):
         return self.title or self.file_name or f"Media {self.id}"
     
     def get_file_url(self):
-        """Get the URL for the main file"""
+        """Get the URL for the main file, served by core.views.serve_media"""
         if self.file:
-            return self.file.url
+            return reverse('serve_media', args=[self.pk])
         return self.file_path  # Fallback for legacy entries
     
     def get_thumbnail_url(self, size='medium'):
         """Get thumbnail URL for specified size"""
         thumbnail_field = getattr(self, f'thumbnail_{size}', None)
         if thumbnail_field and thumbnail_field.name:
-            return thumbnail_field.url
+            return reverse('serve_media_variant', args=[self.pk, size])
         return self.get_file_url()  # Fallback to original file
     
     def is_image(self):
@@ -403,6 +470,86 @@ class Media(models.Model):
         return self.title or self.file_name or f"Untitled Media {self.id}"
 
 
+class MediaProcessingJob(models.Model):
+    """Queued thumbnail generation for a media upload, consumed by the media_worker command"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    media = models.ForeignKey(Media, on_delete=models.CASCADE, related_name='processing_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='media_job_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job #{self.id} - {self.media} ({self.status})"
+
+
+class UploadSession(models.Model):
+    """Chunked, resumable upload of a large file that becomes a Media row once finalized"""
+    STATUS_ACTIVE = 'active'
+    STATUS_FINALIZING = 'finalizing'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, 'Active'),
+        (STATUS_FINALIZING, 'Finalizing'),
+        (STATUS_COMPLETE, 'Complete'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True)
+    file_name = models.CharField(max_length=255)
+    file_size = models.BigIntegerField()  # Total size in bytes
+    chunk_size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True, null=True, help_text="Expected hash of the complete file")
+    title = models.CharField(max_length=255, blank=True, null=True)
+    alt_text = models.CharField(max_length=255, blank=True, null=True)
+    description = models.TextField(blank=True, null=True)
+    received_chunks = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
+    media = models.ForeignKey(Media, on_delete=models.SET_NULL, null=True, blank=True)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Upload {self.id} - {self.file_name} ({self.status})"
+
+    @property
+    def total_chunks(self):
+        return max(1, math.ceil(self.file_size / self.chunk_size))
+
+    def expected_chunk_length(self, index):
+        """Number of bytes chunk ``index`` must contain"""
+        if index == self.total_chunks - 1:
+            return self.file_size - index * self.chunk_size
+        return self.chunk_size
+
+    def missing_chunks(self):
+        received = set(self.received_chunks)
+        return [index for index in range(self.total_chunks) if index not in received]
+
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+
 class SocialMedia(models.Model):
     """Social media model matching the social_media table from the SQL schema"""
     company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True)
@@ -417,6 +564,9 @@ class SocialMedia(models.Model):
     class Meta:
         verbose_name_plural = "Social Media"
         ordering = ['display_order', 'platform']
+        indexes = [
+            models.Index(fields=['is_active', 'display_order', 'platform'], name='social_active_order_idx'),
+        ]
 
     def __str__(self):
         return f"{self.platform} - {self.company.name if self.company else 'No Company'}"
@@ -479,16 +629,26 @@ class ContentHistory(models.Model):
         ('delete', 'Delete'),
     ]
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Empty for changes captured from model signals (see core.content_history)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     table_name = models.CharField(max_length=100)
     record_id = models.PositiveIntegerField()
     action = models.CharField(max_length=10, choices=ACTION_CHOICES)
     changed_data = models.JSONField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(
+        default=timezone.now, editable=False,
+        help_text="Time of the entry's first change; changes coalesced into it keep this time",
+    )
 
     class Meta:
         verbose_name_plural = "Content Histories"
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='history_created_id_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='history_user_created_idx'),
+            models.Index(fields=['table_name', 'record_id', 'created_at'], name='history_record_created_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - {self.action} {self.table_name}#{self.record_id}"
+        username = self.user.username if self.user_id else 'system'
+        return f"{username} - {self.action} {self.table_name}#{self.record_id}"
@@ -0,0 +1,18 @@
+"""
+Pagination classes for the REST API
+"""
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination for append-only tables, newest first.
+
+    Pages are fetched with ``WHERE created_at < <cursor>`` on an index instead
+    of ``COUNT(*)`` plus ``OFFSET``, so deep pages cost the same as the first.
+    The cursor holds only a ``created_at`` position; rows sharing that instant
+    are skipped with a small offset, ordered by id so the skip is stable.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 200
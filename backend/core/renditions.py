@@ -0,0 +1,184 @@
+"""
+On-demand image renditions backed by a size-bounded disk cache
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .utils import EXIF_ORIENTATION_TAG, THUMBNAIL_QUALITY, flatten_to_rgb
+
+
+# Edge lengths a client may request; anything else is rejected so the cache
+# cannot be filled with arbitrary sizes
+RENDITION_SIZES = (64, 96, 128, 150, 192, 256, 300, 384, 480, 600, 768, 960, 1200, 1600, 1920)
+RENDITION_FITS = ('contain', 'cover')
+MAX_SOURCE_EDGE = 100000
+
+# fmt parameter -> (PIL format, content type, file extension)
+RENDITION_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'png': ('PNG', 'image/png', 'png'),
+}
+
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512MB
+
+
+def negotiate_format(fmt, accept_header):
+    """Resolve the requested output format, picking WebP for 'auto' when accepted"""
+    if fmt and fmt != 'auto':
+        return fmt if fmt in RENDITION_FORMATS else None
+    if 'image/webp' in (accept_header or ''):
+        return 'webp'
+    return 'jpeg'
+
+
+def source_key(media):
+    """Identify the source content a rendition is derived from"""
+    if media.sha256:
+        return media.sha256
+    # Legacy rows without a content hash fall back to the stored file identity
+    return hashlib.sha256(f"{media.file.name}:{media.file_size}".encode()).hexdigest()
+
+
+def rendition_key(media, width, height, fit, fmt):
+    """Cache key combining the source identity and the rendition parameters"""
+    params = f"{source_key(media)}:{width or 0}x{height or 0}:{fit}:{fmt}"
+    return hashlib.sha256(params.encode()).hexdigest()
+
+
+def render_rendition(image_file, width=None, height=None, fit='contain', fmt='jpeg'):
+    """
+    Render an image into the requested box and encode it.
+
+    ``contain`` scales the image down to fit inside the box (either edge may be
+    omitted); ``cover`` fills a ``width`` x ``height`` box and crops the overflow.
+    """
+    pil_format = RENDITION_FORMATS[fmt][0]
+    if fit == 'cover':
+        box = (width, height)
+    else:
+        box = (width or MAX_SOURCE_EDGE, height or MAX_SOURCE_EDGE)
+
+    with Image.open(image_file) as img:
+        # draft works on the stored pixels, which EXIF orientations 5-8 rotate by 90 degrees
+        rotated = img.getexif().get(EXIF_ORIENTATION_TAG) in (5, 6, 7, 8)
+        img.draft('RGB', box[::-1] if rotated else box)
+        img = ImageOps.exif_transpose(img)
+
+        if pil_format == 'JPEG':
+            img = flatten_to_rgb(img)
+        elif img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA')
+
+        if fit == 'cover':
+            img = ImageOps.fit(img, box, Image.Resampling.LANCZOS)
+        else:
+            img.thumbnail(box, Image.Resampling.LANCZOS)
+
+        output = BytesIO()
+        if pil_format == 'JPEG':
+            img.save(output, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+        elif pil_format == 'WEBP':
+            img.save(output, format='WEBP', quality=THUMBNAIL_QUALITY - 5, method=4)
+        else:
+            img.save(output, format='PNG', optimize=True)
+        return output.getvalue()
+
+
+class RenditionCache:
+    """
+    Disk cache of rendered files, evicting least recently used entries once the
+    total size exceeds ``max_bytes``.
+
+    Recency is tracked through file modification times, which are refreshed on
+    every hit, so the cache can be shared by several server processes.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def path_for(self, key, ext):
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}.{ext}")
+
+    def get(self, key, ext):
+        """Return the cached file path for a key, or None on a miss"""
+        path = self.path_for(key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, ext, data):
+        """Store rendered bytes atomically and return the cached file path"""
+        path = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_total()
+            else:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+        return path
+
+    def _entries(self):
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _scan_total(self):
+        return sum(size for _path, size, _mtime in self._entries())
+
+    def _evict(self):
+        """Delete the least recently used files down to 90% of the limit"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _path, size, _mtime in entries)
+        target = self.max_bytes * 0.9
+
+        for path, size, _mtime in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        self._total_bytes = total
+
+
+_cache = None
+
+
+def get_rendition_cache():
+    """Process-wide rendition cache configured from settings"""
+    global _cache
+    if _cache is None:
+        _cache = RenditionCache(
+            getattr(settings, 'MEDIA_RENDITION_CACHE_DIR', os.path.join(settings.BASE_DIR, 'rendition_cache')),
+            getattr(settings, 'MEDIA_RENDITION_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES),
+        )
+    return _cache
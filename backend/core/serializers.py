@@ -1,11 +1,22 @@
+import os
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
 from .models import (
     Company, User, TeamMember, UserLog, Category, HomeContent, 
     AboutUs, Service, Contact, Project, ProjectGallery, Testimonial, 
-    Client, News, Media, SocialMedia, Setting, ContentHistory, Gallery, GalleryItem
+    Client, News, Media, UploadSession, SocialMedia, Setting, ContentHistory, Gallery, GalleryItem
 )
 
 
+def absolute_media_url(url, request=None):
+    """Absolute form of a site-relative media URL when a request is available"""
+    if url and request is not None and url.startswith('/'):
+        return request.build_absolute_uri(url)
+    return url
+
+
 class CompanySerializer(serializers.ModelSerializer):
     class Meta:
         model = Company
@@ -133,40 +144,30 @@ class MediaSerializer(serializers.ModelSerializer):
         model = Media
         fields = [
             'id', 'company', 'company_name', 'file', 'file_name', 'file_path',
-            'file_type', 'file_size', 'mime_type', 'title', 'alt_text', 'description',
-            'width', 'height', 'thumbnail_small', 'thumbnail_medium', 'thumbnail_large',
-            'uploaded_by', 'uploaded_by_name', 'created_at', 'updated_at',
+            'file_type', 'file_size', 'mime_type', 'sha256', 'title', 'alt_text', 'description',
+            'width', 'height', 'placeholder', 'dominant_color',
+            'thumbnail_small', 'thumbnail_medium', 'thumbnail_large',
+            'processing_status', 'uploaded_by', 'uploaded_by_name', 'created_at', 'updated_at',
             'file_url', 'thumbnail_urls', 'display_name'
         ]
-        read_only_fields = ['file_size', 'mime_type', 'width', 'height', 'created_at', 'updated_at']
+        read_only_fields = [
+            'file_size', 'mime_type', 'sha256', 'width', 'height', 'placeholder', 'dominant_color',
+            'processing_status', 'created_at', 'updated_at'
+        ]
     
     def get_file_url(self, obj):
         """Get the URL for the main file"""
-        request = self.context.get('request')
-        if obj.file and hasattr(obj.file, 'url'):
-            if request:
-                return request.build_absolute_uri(obj.file.url)
-            return obj.file.url
-        return obj.file_path  # Fallback for legacy entries
+        return absolute_media_url(obj.get_file_url(), self.context.get('request'))
     
     def get_thumbnail_urls(self, obj):
-        """Get URLs for all thumbnail sizes"""
+        """Get URLs for all thumbnail sizes, falling back to the main file"""
         request = self.context.get('request')
-        thumbnails = {}
-        
-        if obj.is_image():
-            for size in ['small', 'medium', 'large']:
-                thumbnail_field = getattr(obj, f'thumbnail_{size}')
-                if thumbnail_field and hasattr(thumbnail_field, 'url'):
-                    url = thumbnail_field.url
-                    if request:
-                        url = request.build_absolute_uri(url)
-                    thumbnails[size] = url
-                else:
-                    # Fallback to main file
-                    thumbnails[size] = self.get_file_url(obj)
-        
-        return thumbnails
+        if not obj.is_image():
+            return {}
+        return {
+            size: absolute_media_url(obj.get_thumbnail_url(size), request)
+            for size in ['small', 'medium', 'large']
+        }
     
     def get_display_name(self, obj):
         """Get display name for the media"""
@@ -192,20 +193,75 @@ class MediaUploadSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         """Create media instance with file processing"""
-        from .utils import process_media_file
+        from .utils import ingest_upload
         
         uploaded_file = validated_data['file']
         
         # Create media instance
         media = Media(**validated_data)
         
-        # Process the file and create thumbnails
-        media = process_media_file(media, uploaded_file)
+        # Deduplicate, process and save; thumbnails may be left to the worker
+        defer_thumbnails = getattr(settings, 'MEDIA_ASYNC_PROCESSING', False)
+        return ingest_upload(media, uploaded_file, defer_thumbnails=defer_thumbnails)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for chunked upload sessions"""
+    chunk_size = serializers.IntegerField(required=False)
+    total_chunks = serializers.IntegerField(read_only=True)
+    missing_chunks = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'company', 'file_name', 'file_size', 'chunk_size', 'sha256',
+            'title', 'alt_text', 'description', 'status', 'total_chunks',
+            'received_chunks', 'missing_chunks', 'media', 'expires_at', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['status', 'received_chunks', 'media', 'expires_at', 'created_at', 'updated_at']
+    
+    def get_missing_chunks(self, obj):
+        """Chunk indexes still to be uploaded"""
+        return obj.missing_chunks()
+    
+    def validate_chunk_size(self, value):
+        from .utils import MIN_CHUNK_SIZE, MAX_CHUNK_SIZE
         
-        # Save the instance
-        media.save()
+        if not MIN_CHUNK_SIZE <= value <= MAX_CHUNK_SIZE:
+            raise serializers.ValidationError(
+                f"Chunk size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE} bytes"
+            )
+        return value
+    
+    def validate_sha256(self, value):
+        if value and (len(value) != 64 or any(c not in '0123456789abcdefABCDEF' for c in value)):
+            raise serializers.ValidationError("Must be a hex encoded SHA-256 digest")
+        return value.lower() if value else value
+    
+    def validate(self, attrs):
+        from .utils import validate_file_metadata, MAX_CHUNKED_UPLOAD_SIZE
         
-        return media
+        if attrs['file_size'] <= 0:
+            raise serializers.ValidationError({'file_size': "File size must be positive"})
+        errors = validate_file_metadata(attrs['file_name'], attrs['file_size'], max_size=MAX_CHUNKED_UPLOAD_SIZE)
+        if errors:
+            raise serializers.ValidationError({'file_name': errors})
+        return attrs
+    
+    def create(self, validated_data):
+        """Create the session and the sparse file its chunks are written into"""
+        from .utils import DEFAULT_CHUNK_SIZE, UPLOAD_SESSION_TTL, upload_session_path
+        
+        validated_data.setdefault('chunk_size', DEFAULT_CHUNK_SIZE)
+        validated_data['expires_at'] = timezone.now() + UPLOAD_SESSION_TTL
+        session = UploadSession.objects.create(**validated_data)
+        
+        path = upload_session_path(session)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as part_file:
+            part_file.truncate(session.file_size)
+        
+        return session
 
 
 class SocialMediaSerializer(serializers.ModelSerializer):
@@ -225,7 +281,7 @@ class SettingSerializer(serializers.ModelSerializer):
 
 
 class ContentHistorySerializer(serializers.ModelSerializer):
-    username = serializers.CharField(source='user.username', read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True, allow_null=True)
     
     class Meta:
         model = ContentHistory
@@ -241,12 +297,17 @@ class GalleryItemSerializer(serializers.ModelSerializer):
     
     def get_media_info(self, obj):
         """Include basic media information"""
+        request = self.context.get('request')
         if obj.media:
             return {
                 'id': obj.media.id,
                 'file_name': obj.media.file_name,
-                'file_url': obj.media.get_file_url(),
-                'thumbnail_url': obj.media.get_thumbnail_url(),
+                'file_url': absolute_media_url(obj.media.get_file_url(), request),
+                'thumbnail_url': absolute_media_url(obj.media.get_thumbnail_url(), request),
+                'width': obj.media.width,
+                'height': obj.media.height,
+                'placeholder': obj.media.placeholder,
+                'dominant_color': obj.media.dominant_color,
                 'title': obj.media.title,
                 'alt_text': obj.media.alt_text
             }
@@ -264,6 +325,9 @@ class GallerySerializer(serializers.ModelSerializer):
     
     def get_items_count(self, obj):
         """Get count of items in this gallery"""
+        # Annotated by GalleryViewSet; the nested items may be capped by items_limit
+        if hasattr(obj, 'items_count'):
+            return obj.items_count
         return obj.items.count()
 
 
@@ -0,0 +1,145 @@
+"""
+Signal receivers that invalidate cached site content and record content history
+"""
+from django.db import transaction
+from django.db import connection
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .activity_log import forget_active_staff_ids
+from .activity_rollups import add_log_rollups
+from .cache import invalidate, invalidate_section
+from .content_history import TRACKED_MODELS, field_values, record_change, stored_values
+from .models import (
+    AboutUs, Category, Client, Company, Contact, HomeContent, Project, ProjectGallery, Service,
+    Setting, SocialMedia, Testimonial, User, UserLog
+)
+
+# Content models and the cached section each one feeds
+CONTENT_SECTIONS = {
+    HomeContent: 'banner',
+    AboutUs: 'about',
+    Service: 'services',
+    Project: 'projects',
+    Testimonial: 'testimonials',
+    Client: 'clients',
+    SocialMedia: 'social',
+    Contact: 'contacts',
+    Setting: 'settings',
+}
+
+
+def _on_commit_invalidate(section, company_ids):
+    # Bumping before commit would let a concurrent request cache the old rows
+    def bump():
+        for company_id in company_ids or {None}:
+            invalidate(section, company_id)
+    transaction.on_commit(bump)
+
+
+def remember_previous_values(sender, instance, raw=False, **kwargs):
+    """Keep the stored values of an edited row for its history entry and, when it
+    moves to another company, to invalidate both companies"""
+    if raw or instance._state.adding or instance.pk is None:
+        instance._previous_values = None
+        return
+    instance._previous_values = stored_values(sender, instance.pk)
+
+
+def content_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_values', None) or {}
+    company_ids = {instance.company_id, previous.get('company_id', instance.company_id)}
+    _on_commit_invalidate(CONTENT_SECTIONS[sender], company_ids - {None})
+
+
+def history_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_values', None)
+    record_change(instance, 'create' if created or previous is None else 'update', previous)
+
+
+def history_deleted(sender, instance, **kwargs):
+    record_change(instance, 'delete', field_values(instance))
+
+
+def project_gallery_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    company_id = Project.objects.filter(pk=instance.project_id).values_list('company_id', flat=True).first()
+    _on_commit_invalidate('projects', {company_id} - {None})
+
+
+def category_changed(sender, instance, raw=False, **kwargs):
+    # Category names appear in the services of every company
+    if not raw:
+        transaction.on_commit(lambda: invalidate_section('services'))
+
+
+def company_changed(sender, instance, raw=False, **kwargs):
+    # Company names appear in every section
+    if raw:
+        return
+    for section in CONTENT_SECTIONS.values():
+        _on_commit_invalidate(section, {instance.pk})
+
+
+def user_changed(sender, instance, raw=False, **kwargs):
+    # The activity log checks user ids against the cached set of active staff
+    if not raw:
+        transaction.on_commit(forget_active_staff_ids)
+
+
+def user_log_created(sender, instance, created, raw=False, **kwargs):
+    # Logs stored by core.activity_log are added to the rollups there, in one
+    # batch per flush; other saves are added once their transaction commits,
+    # so the insert does not wait on the rollup row
+    if created and not raw and not getattr(instance, '_rolled_up', False):
+        transaction.on_commit(lambda: add_log_rollups([instance]))
+
+
+def send_post_save(model, rows, created):
+    """Send post_save for rows written with bulk_create/bulk_update, which send no signals
+
+    Updated rows carry their stored values in ``_previous_values`` for the
+    history receivers; created rows have none.
+    """
+    for row in rows:
+        if created:
+            row._previous_values = None
+        post_save.send(sender=model, instance=row, created=created, update_fields=None, raw=False,
+                       using=row._state.db)
+
+
+def bulk_create_with_signals(model, rows):
+    """Insert rows in one query and send post_save for each, saving one by one
+    where the database cannot return the primary keys of a bulk insert"""
+    if connection.features.can_return_rows_from_bulk_insert:
+        model.objects.bulk_create(rows)
+        send_post_save(model, rows, created=True)
+    else:
+        for row in rows:
+            row.save()
+    return rows
+
+
+def connect_signals():
+    for model in TRACKED_MODELS:
+        pre_save.connect(remember_previous_values, sender=model, dispatch_uid=f'content-history-pre-{model.__name__}')
+        post_save.connect(history_saved, sender=model, dispatch_uid=f'content-history-save-{model.__name__}')
+        post_delete.connect(history_deleted, sender=model, dispatch_uid=f'content-history-delete-{model.__name__}')
+
+    for model in CONTENT_SECTIONS:
+        post_save.connect(content_changed, sender=model, dispatch_uid=f'content-cache-save-{model.__name__}')
+        post_delete.connect(content_changed, sender=model, dispatch_uid=f'content-cache-delete-{model.__name__}')
+
+    post_save.connect(project_gallery_changed, sender=ProjectGallery, dispatch_uid='content-cache-save-gallery')
+    post_delete.connect(project_gallery_changed, sender=ProjectGallery, dispatch_uid='content-cache-delete-gallery')
+    post_save.connect(category_changed, sender=Category, dispatch_uid='content-cache-save-category')
+    post_delete.connect(category_changed, sender=Category, dispatch_uid='content-cache-delete-category')
+    post_save.connect(company_changed, sender=Company, dispatch_uid='content-cache-save-company')
+    post_delete.connect(company_changed, sender=Company, dispatch_uid='content-cache-delete-company')
+    post_save.connect(user_changed, sender=User, dispatch_uid='activity-log-save-user')
+    post_delete.connect(user_changed, sender=User, dispatch_uid='activity-log-delete-user')
+    post_save.connect(user_log_created, sender=UserLog, dispatch_uid='activity-rollup-save-log')
@@ -0,0 +1,73 @@
+"""
+Aggregated public site document (/api/site/)
+
+Everything the public frontend needs on first load, built in one query per
+content type, rendered once and cached until any of its sections changes.
+"""
+import hashlib
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+from .cache import ALL_COMPANIES, get_cache, versions_token
+from .models import (
+    AboutUs, Client, Contact, HomeContent, Project, Service, Setting, SocialMedia,
+    Testimonial
+)
+from .serializers import (
+    AboutUsSerializer, ClientSerializer, CompanySerializer, ContactSerializer,
+    HomeContentSerializer, ProjectSerializer, ServiceSerializer, SettingSerializer,
+    SocialMediaSerializer, TestimonialSerializer
+)
+
+# Cached content sections the document is built from
+SITE_SECTIONS = (
+    'banner', 'about', 'services', 'projects', 'testimonials', 'clients', 'social',
+    'contacts', 'settings',
+)
+
+
+def build_site_document(company=None):
+    """Collect the public content of one company, or of all companies"""
+    def scoped(queryset):
+        queryset = queryset.select_related('company')
+        return queryset.filter(company=company) if company else queryset
+
+    home_content = scoped(HomeContent.objects.all()).first()
+    about_us = scoped(AboutUs.objects.all()).first()
+
+    return {
+        'company': CompanySerializer(company).data if company else None,
+        'home_content': HomeContentSerializer(home_content).data if home_content else None,
+        'about_us': AboutUsSerializer(about_us).data if about_us else None,
+        'services': ServiceSerializer(
+            scoped(Service.objects.select_related('category')), many=True
+        ).data,
+        'projects': ProjectSerializer(
+            scoped(Project.objects.filter(featured=True).prefetch_related('gallery_images')), many=True
+        ).data,
+        'testimonials': TestimonialSerializer(
+            scoped(Testimonial.objects.filter(is_featured=True)), many=True
+        ).data,
+        'clients': ClientSerializer(scoped(Client.objects.filter(is_featured=True)), many=True).data,
+        'social_media': SocialMediaSerializer(
+            scoped(SocialMedia.objects.filter(is_active=True).order_by('display_order')), many=True
+        ).data,
+        'contacts': ContactSerializer(scoped(Contact.objects.all()), many=True).data,
+        'settings': SettingSerializer(scoped(Setting.objects.all()), many=True).data,
+    }
+
+
+def get_site_document(company=None):
+    """Return the rendered document and its strong ETag, from the cache when current"""
+    scope = company.pk if company else ALL_COMPANIES
+    cache = get_cache()
+    key = f'site:{scope}:{versions_token(SITE_SECTIONS, scope)}'
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    content = JSONRenderer().render(build_site_document(company))
+    etag = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+    cache.set(key, (content, etag), getattr(settings, 'CONTENT_CACHE_TIMEOUT', 60 * 60))
+    return content, etag
@@ -0,0 +1,133 @@
+"""
+Company settings service
+
+A company's settings are loaded in one query into an immutable snapshot kept
+in process memory. Each snapshot remembers the cache version of the company's
+settings (bumped by core.signals on every change), so a stale snapshot is
+reloaded on the next access in every process.
+"""
+import json
+from types import MappingProxyType
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .cache import ALL_COMPANIES, versions_token
+from .content_history import field_values
+from .models import Setting
+from .signals import bulk_create_with_signals, send_post_save
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'off', ''}
+
+# company id (None for global settings) -> SettingsSnapshot
+_snapshots = {}
+
+
+class SettingsSnapshot:
+    """Read-only view of one company's settings with typed getters"""
+
+    def __init__(self, company_id, values, version):
+        self.company_id = company_id
+        self.version = version
+        self._values = MappingProxyType(dict(values))
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __len__(self):
+        return len(self._values)
+
+    def as_dict(self):
+        return dict(self._values)
+
+    def get(self, key, default=None):
+        value = self._values.get(key)
+        return default if value is None else value
+
+    def get_int(self, key, default=None):
+        try:
+            return int(self._values[key])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    def get_bool(self, key, default=None):
+        value = self._values.get(key)
+        if value is None:
+            return default
+        value = value.strip().lower()
+        if value in TRUE_VALUES:
+            return True
+        if value in FALSE_VALUES:
+            return False
+        return default
+
+    def get_json(self, key, default=None):
+        try:
+            return json.loads(self._values[key])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+
+def get_settings(company_id=None):
+    """Return the current settings snapshot of a company, or of the global settings"""
+    version = versions_token(['settings'], company_id or ALL_COMPANIES)
+    snapshot = _snapshots.get(company_id)
+    if snapshot is None or snapshot.version != version:
+        values = Setting.objects.filter(company_id=company_id).values_list('setting_key', 'setting_value')
+        snapshot = _snapshots[company_id] = SettingsSnapshot(company_id, values, version)
+    return snapshot
+
+
+def to_setting_value(value):
+    """Stored text of a value: strings as they are, anything else as JSON"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def bulk_upsert_settings(company_id, values):
+    """
+    Create or update many settings of a company in one transaction.
+
+    Returns the created and updated keys. post_save is sent for every written
+    row, so the settings version is bumped and the changes reach the content
+    history as with single saves. Raises IntegrityError when concurrent writes
+    keep inserting the same new keys.
+    """
+    values = {key: to_setting_value(value) for key, value in values.items()}
+    try:
+        created, changed = _upsert_settings(company_id, values)
+    except IntegrityError:
+        # Another upsert inserted one of the new keys first; it is updated this time
+        created, changed = _upsert_settings(company_id, values)
+    return sorted(setting.setting_key for setting in created), sorted(setting.setting_key for setting in changed)
+
+
+def _upsert_settings(company_id, values):
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {
+            setting.setting_key: setting
+            for setting in Setting.objects.select_for_update().filter(
+                company_id=company_id, setting_key__in=list(values)
+            )
+        }
+        changed = []
+        for key, setting in existing.items():
+            if setting.setting_value != values[key]:
+                setting._previous_values = field_values(setting)
+                setting.setting_value = values[key]
+                setting.updated_at = now
+                changed.append(setting)
+        Setting.objects.bulk_update(changed, ['setting_value', 'updated_at'])
+        send_post_save(Setting, changed, created=False)
+
+        created = bulk_create_with_signals(Setting, [
+            Setting(company_id=company_id, setting_key=key, setting_value=value)
+            for key, value in values.items() if key not in existing
+        ])
+    return created, changed
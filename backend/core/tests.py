@@ -1,3 +1,1170 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import renditions
+from .models import (
+    Company, User, TeamMember, UserLog, Category, HomeContent, AboutUs, Service,
+    Contact, Project, ProjectGallery, Testimonial, Client, News, Media, SocialMedia,
+    Setting, ContentHistory, Gallery, GalleryItem, UserActivityRollup, UploadSession,
+    MediaProcessingJob
+)
+from .activity_log import ActivityLogBuffer, get_active_staff_ids
+from .content_history import capture_batch
+from .log_archive import append_to_archive, read_archive
+from .management.commands.media_worker import Command as MediaWorkerCommand, render_source
+from .serializers import NewsSerializer
+from .serving import parse_range
+from .site_settings import get_settings
+from .urls import router
+from .utils import render_thumbnails, upload_session_path
+
+
+def create_rows(index):
+    """Create one row per API resource, each with its own related objects"""
+    company = Company.objects.create(name=f'Company {index}')
+    user = User.objects.create(
+        username=f'user{index}', email=f'user{index}@example.com', password_hash='x',
+        role='staff', company=company,
+    )
+    category = Category.objects.create(name=f'Category {index}')
+
+    TeamMember.objects.create(company=company, name=f'Member {index}', position='Engineer')
+    UserLog.objects.create(user=user, activity='login')
+    HomeContent.objects.create(company=company, title=f'Home {index}')
+    AboutUs.objects.create(company=company, description='About')
+    Service.objects.create(company=company, category=category, title=f'Service {index}')
+    Contact.objects.create(company=company, email=f'contact{index}@example.com')
+    project = Project.objects.create(company=company, title=f'Project {index}', featured=True)
+    ProjectGallery.objects.create(project=project, image_path=f'/media/p{index}.jpg')
+    Testimonial.objects.create(company=company, client_name='Client', testimonial_text='Great', is_featured=True)
+    Client.objects.create(company=company, name=f'Client {index}', is_featured=True)
+    News.objects.create(company=company, author=user, title=f'News {index}', status='published')
+    media = Media.objects.create(company=company, uploaded_by=user, file_name=f'{index}.jpg', file_type='image')
+    SocialMedia.objects.create(company=company, platform='x', url='https://example.com')
+    Setting.objects.create(company=company, setting_key=f'key{index}', setting_value='1')
+    ContentHistory.objects.create(user=user, table_name='news', record_id=index, action='create')
+    gallery = Gallery.objects.create(company=company, name=f'Gallery {index}')
+    GalleryItem.objects.create(gallery=gallery, media=media)
+    GalleryItem.objects.create(gallery=gallery, media=media)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class ListQueryCountTests(TestCase):
+    """List endpoints must not issue extra queries per row"""
+
+    endpoints = [
+        '/api/companies/', '/api/users/', '/api/users/staff/', '/api/team-members/',
+        '/api/user-logs/', '/api/categories/', '/api/home-content/', '/api/about-us/',
+        '/api/services/', '/api/contacts/', '/api/projects/', '/api/projects/featured/',
+        '/api/testimonials/', '/api/testimonials/featured/', '/api/clients/',
+        '/api/clients/featured/', '/api/news/', '/api/news/published/', '/api/media/',
+        '/api/social-media/', '/api/social-media/active/', '/api/settings/',
+        '/api/content-history/', '/api/galleries/', '/api/galleries/?items_limit=1',
+    ]
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(context.captured_queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for index in range(2):
+            create_rows(index)
+        small = {url: self.count_queries(url) for url in self.endpoints}
+
+        for index in range(2, 6):
+            create_rows(index)
+        for url in self.endpoints:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), small[url])
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        create_rows(0)
+
+    def test_fields_trim_output_and_columns(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/news/?fields=id,title,company_name')
+        self.assertEqual(sorted(response.json()['results'][0]), ['company_name', 'id', 'title'])
+        self.assertNotIn('"core_news"."content"', context.captured_queries[-1]['sql'])
+
+    def test_exclude_skips_nested_prefetch(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/galleries/?exclude=items')
+        self.assertNotIn('items', response.json()['results'][0])
+        self.assertFalse(any('core_galleryitem"."media_id' in q['sql'] for q in context.captured_queries))
+
+    def test_serializer_fields_are_built_once_per_request(self):
+        built = []
+        original_init = NewsSerializer.__init__
+
+        def init(serializer, *args, **kwargs):
+            built.append(serializer)
+            original_init(serializer, *args, **kwargs)
+
+        with mock.patch.object(NewsSerializer, '__init__', init):
+            response = self.client.get('/api/news/?fields=id,title')
+        self.assertEqual(response.status_code, 200)
+        # One unbound serializer for the queryset optimizations, one rendering the page
+        self.assertEqual(len(built), 2)
+
+
+class CreatedAtPaginationTests(TestCase):
+    url = '/api/user-logs/'
+
+    def setUp(self):
+        create_rows(0)
+        self.user = User.objects.get(username='user0')
+        UserLog.objects.all().delete()
+        # Three logs share each instant so pages have to break ties
+        UserLog.objects.bulk_create([
+            UserLog(user=self.user, activity=f'{day}-{index}',
+                    created_at=datetime(2024, 1, day, 12, tzinfo=dt_timezone.utc))
+            for day in (1, 2, 3) for index in range(3)
+        ])
+
+    def activities(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [log['activity'] for log in response.json()['results']], response.json()['next']
+
+    def test_pages_cover_every_row_once_newest_first(self):
+        seen, url = [], f'{self.url}?page_size=2'
+        while url:
+            page, url = self.activities(url)
+            seen.extend(page)
+        expected = UserLog.objects.order_by('-created_at', '-id').values_list('activity', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_created_range_and_user_filters(self):
+        page, _next = self.activities(f'{self.url}?created_after=2024-01-02&created_before=2024-01-02')
+        self.assertEqual(sorted(page), ['2-0', '2-1', '2-2'])
+        page, _next = self.activities(f'{self.url}?created_after=2024-01-02T12:00:00Z&user_id={self.user.pk}')
+        self.assertEqual(len(page), 6)
+        page, _next = self.activities(f'{self.url}?user_id={self.user.pk + 1}')
+        self.assertEqual(page, [])
+
+    def test_bad_params_are_rejected(self):
+        for url in (f'{self.url}?user_id=abc', '/api/content-history/?user_id=x',
+                    f'{self.url}?created_after=yesterday', f'{self.url}?created_before=2024-13-01'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400, url)
+
+
+class ContentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_rows(0)
+        create_rows(1)
+        self.project = Project.objects.get(title='Project 0')
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response.json(), len(context.captured_queries)
+
+    def test_repeated_reads_are_served_from_cache(self):
+        for url in ['/api/projects/featured/', '/api/content/banner/', '/api/content/services/']:
+            with self.subTest(url=url):
+                first, _queries = self.get(url)
+                cached, queries = self.get(url)
+                self.assertEqual(queries, 0)
+                self.assertEqual(cached, first)
+
+    def test_save_invalidates_only_the_affected_company(self):
+        own_url = f'/api/projects/featured/?company_id={self.project.company_id}'
+        other_url = f'/api/projects/featured/?company_id={Company.objects.get(name="Company 1").pk}'
+        for url in [own_url, other_url, '/api/projects/featured/']:
+            self.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.title = 'Renamed'
+            self.project.save()
+
+        data, queries = self.get(own_url)
+        self.assertEqual(data[0]['title'], 'Renamed')
+        self.assertGreater(queries, 0)
+        data, _queries = self.get('/api/projects/featured/')
+        self.assertIn('Renamed', [project['title'] for project in data])
+        _data, queries = self.get(other_url)
+        self.assertEqual(queries, 0)
+
+    def test_padded_company_id_is_invalidated_with_the_company(self):
+        padded_url = f'/api/projects/featured/?company_id=0{self.project.company_id}'
+        self.get(padded_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.title = 'Renamed'
+            self.project.save()
+        data, _queries = self.get(padded_url)
+        self.assertEqual(data[0]['title'], 'Renamed')
+
+    def test_related_changes_invalidate(self):
+        self.get('/api/projects/featured/')
+        with self.captureOnCommitCallbacks(execute=True):
+            ProjectGallery.objects.create(project=self.project, image_path='/media/new.jpg')
+        data, _queries = self.get('/api/projects/featured/')
+        paths = [image['image_path'] for project in data for image in project['gallery_images']]
+        self.assertIn('/media/new.jpg', paths)
+
+        self.get('/api/content/services/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.update(name='Renamed')  # Queryset updates send no signals
+            Category.objects.first().save()
+        data, _queries = self.get('/api/content/services/')
+        self.assertEqual(data[0]['category_name'], 'Renamed')
+
+    def test_malformed_company_id_is_rejected(self):
+        for url in ['/api/projects/featured/', '/api/social-media/active/', '/api/content/banner/']:
+            with self.subTest(url=url):
+                response = self.client.get(f'{url}?company_id=abc')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'company_id must be an integer'})
+
+
+class ExplainEndpointsTests(TestCase):
+    def test_every_route_is_explained_and_scans_are_flagged(self):
+        cache.clear()
+        output = io.StringIO()
+        call_command('explain_endpoints', '--companies', '1', '--rows', '10', stdout=output)
+        lines = output.getvalue().splitlines()
+        for prefix, _viewset, _basename in router.registry:
+            self.assertTrue(any(re.match(rf'\d{{3}} /api/{prefix}/ \(\d+ queries\)$', line) for line in lines), prefix)
+        self.assertTrue(any(line.startswith('  full scan on core_category:') for line in lines), output.getvalue())
+        # The seeded rows are rolled back
+        self.assertFalse(Company.objects.exists())
+
+    def test_seeded_responses_are_not_cached(self):
+        cache.clear()
+        cache.set('sentinel', 1)
+        call_command('explain_endpoints', '--companies', '1', '--rows', '10', '--route', 'clients',
+                     stdout=io.StringIO())
+        self.assertEqual(cache.get('sentinel'), 1)
+        self.assertEqual(self.client.get('/api/clients/featured/').json(), [])
+
+
+class SiteDocumentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_rows(0)
+        create_rows(1)
+        self.company = Company.objects.get(name='Company 0')
+        self.url = f'/api/site/?company_id={self.company.pk}'
+
+    def test_document_contains_company_content(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        data = response.json()
+        self.assertLessEqual(len(context.captured_queries), 12)
+        self.assertEqual(data['company']['name'], 'Company 0')
+        self.assertEqual(data['home_content']['title'], 'Home 0')
+        self.assertEqual([project['title'] for project in data['projects']], ['Project 0'])
+        self.assertEqual(len(data['projects'][0]['gallery_images']), 1)
+        for key in ['about_us', 'services', 'testimonials', 'clients', 'social_media', 'contacts', 'settings']:
+            self.assertTrue(data[key], key)
+
+    def test_etag_revalidation_and_invalidation(self):
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(context.captured_queries), 1)  # Only the company lookup
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Setting.objects.filter(company=self.company).first().save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_unknown_company(self):
+        self.assertEqual(self.client.get('/api/site/?company_id=999').status_code, 404)
+        self.assertEqual(self.client.get('/api/site/?company_id=x').status_code, 400)
+
+    @override_settings(SITE_DOCUMENT_INLINE=True)
+    def test_index_inlines_document(self):
+        self.assertContains(self.client.get('/'), '<script id="site-document" type="application/json">')
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_rows(0)
+        create_rows(1)
+        self.project = Project.objects.get(title='Project 0')
+
+    def assertNotModified(self, url, etag):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304, url)
+        return len(context.captured_queries)
+
+    def test_list_and_detail_return_304(self):
+        # Detail: one aggregate; page-number lists: count, page and an aggregate over
+        # the page's rows; cursor lists: page and aggregate
+        cases = [('/api/projects/', 3), (f'/api/projects/{self.project.pk}/', 1), ('/api/user-logs/', 2),
+                 ('/api/galleries/', 3)]
+        for url, queries in cases:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertTrue(response.has_header('Last-Modified'))
+                self.assertEqual(self.assertNotModified(url, response['ETag']), queries)
+
+    def test_list_validators_read_the_page_only(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/api/user-logs/?page_size=1')
+        aggregate = next(query['sql'] for query in context.captured_queries if 'MAX(' in query['sql'])
+        self.assertIn(' IN (', aggregate)
+
+    def test_malformed_detail_id_is_404(self):
+        for url in ['/api/news/abc/', '/api/users/abc/']:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_changes_produce_a_new_etag(self):
+        url = '/api/projects/'
+        etags = {self.client.get(url)['ETag']}
+        Company.objects.filter(pk=self.project.company_id).update(name='Renamed', updated_at=timezone.now())
+        etags.add(self.client.get(url)['ETag'])
+        ProjectGallery.objects.filter(project=self.project).delete()
+        etags.add(self.client.get(url)['ETag'])
+        self.project.delete()
+        etags.add(self.client.get(url)['ETag'])
+        self.assertEqual(len(etags), 4)
+        self.assertNotEqual(self.client.get('/api/projects/?fields=id')['ETag'], self.client.get(url)['ETag'])
+
+    def test_cached_content_api_returns_304_without_queries(self):
+        url = '/api/content/services/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.assertNotModified(url, etag), 0)
+
+
+class SiteSettingsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_rows(0)
+        self.company = Company.objects.get(name='Company 0')
+
+    def test_snapshot_is_loaded_once_and_typed(self):
+        Setting.objects.create(company=self.company, setting_key='flags', setting_value='{"beta": true}')
+        Setting.objects.create(company=self.company, setting_key='enabled', setting_value='yes')
+        get_settings(self.company.pk)
+        with self.assertNumQueries(0):
+            snapshot = get_settings(self.company.pk)
+        self.assertEqual(snapshot.get_int('key0'), 1)
+        self.assertIs(snapshot.get_bool('enabled'), True)
+        self.assertEqual(snapshot.get_json('flags'), {'beta': True})
+        self.assertEqual(snapshot.get_int('missing', 5), 5)
+        with self.assertRaises(TypeError):
+            snapshot._values['key0'] = '2'
+
+    def test_bulk_upsert_replaces_keys_and_invalidates(self):
+        self.assertEqual(get_settings(self.company.pk).get('key0'), '1')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/settings/bulk-upsert/', {
+                'company_id': self.company.pk, 'settings': {'key0': 2, 'theme': {'dark': True}},
+            }, content_type='application/json')
+        self.assertEqual(response.json(), {'company_id': self.company.pk, 'created': ['theme'], 'updated': ['key0']})
+
+        snapshot = self.client.get(f'/api/settings/snapshot/?company_id={self.company.pk}').json()['settings']
+        self.assertEqual(snapshot, {'key0': '2', 'theme': '{"dark": true}'})
+        self.assertEqual(get_settings(self.company.pk).get_int('key0'), 2)
+
+        response = self.client.post('/api/settings/bulk-upsert/', {'company_id': 999, 'settings': {'a': 1}},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_upsert_retries_keys_inserted_concurrently(self):
+        Setting.objects.create(company=self.company, setting_key='theme', setting_value='light')
+        real_select = Setting.objects.select_for_update
+        reads = []
+
+        def select_for_update():
+            # The first read runs before another writer's insert of 'theme' commits
+            reads.append(1)
+            return real_select().exclude(setting_key='theme') if len(reads) == 1 else real_select()
+
+        with mock.patch.object(Setting.objects, 'select_for_update', side_effect=select_for_update):
+            response = self.client.post('/api/settings/bulk-upsert/', {
+                'company_id': self.company.pk, 'settings': {'key0': 1, 'theme': 'dark'},
+            }, content_type='application/json')
+        self.assertEqual(response.json(), {'company_id': self.company.pk, 'created': [], 'updated': ['theme']})
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(Setting.objects.get(company=self.company, setting_key='theme').setting_value, 'dark')
+
+
+class RequestInstrumentationTests(TestCase):
+    def setUp(self):
+        create_rows(0)
+
+    def test_server_timing_header(self):
+        for url in ['/api/news/', '/api/staff/', '/api/team-members-legacy/']:
+            with self.subTest(url=url), self.assertNoLogs('core.performance', 'WARNING'):
+                timing = self.client.get(url)['Server-Timing']
+            self.assertIn('db;dur=', timing)
+            self.assertIn('serialize;dur=', timing)
+            self.assertIn('total;dur=', timing)
+
+    @override_settings(REQUEST_QUERY_BUDGET=1)
+    def test_query_budget_exceeded_is_logged(self):
+        with self.assertLogs('core.performance', 'WARNING') as logs:
+            self.client.get('/api/news/')
+        self.assertIn('Query budget exceeded', logs.output[0])
+        self.assertIn('core.views.NewsViewSet', logs.output[0])
+
+
+@override_settings(ACTIVITY_LOG_WRITE_BEHIND=False)
+class ActivityLogTests(TestCase):
+    url = '/api/staff/log-activity/'
+
+    def setUp(self):
+        cache.clear()
+        create_rows(0)
+        self.user = User.objects.get(username='user0')
+
+    def post(self, data):
+        return self.client.post(self.url, data, content_type='application/json')
+
+    def test_single_and_batched_events(self):
+        response = self.post({'user_id': self.user.pk, 'activity': 'login'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UserLog.objects.get(pk=response.json()['log_id']).activity, 'login')
+        self.assertEqual(self.post({'user_id': 999, 'activity': 'login'}).status_code, 404)
+        self.assertEqual(self.post({'user_id': self.user.pk}).status_code, 400)
+
+        # Staff ids come from the cache; one query inserts the logs and the rest
+        # look up companies and upsert one rollup row per new kind, in savepoints
+        with self.assertNumQueries(14):
+            response = self.post([
+                {'user_id': self.user.pk, 'activity': 'view'},
+                {'user_id': 999, 'activity': 'view'},
+                {'user_id': self.user.pk, 'activity': 'logout'},
+            ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['accepted'], 2)
+        self.assertEqual([item['index'] for item in response.json()['rejected']], [1])
+        self.assertEqual(len(response.json()['log_ids']), 2)
+        self.assertEqual(UserLog.objects.filter(user=self.user).count(), 4)
+        # Staff ids are looked up once, not per request
+        with self.assertNumQueries(0):
+            get_active_staff_ids()
+
+    @override_settings(ACTIVITY_LOG_WRITE_BEHIND=True)
+    def test_events_are_written_behind_unless_the_id_is_asked_for(self):
+        with mock.patch('core.activity_log.get_buffer') as get_buffer:
+            event = {'user_id': self.user.pk, 'activity': 'view'}
+            for data in ([event], event):
+                response = self.post(data)
+                self.assertEqual(response.status_code, 202)
+                self.assertEqual((response.json()['accepted'], response.json()['rejected']), (1, []))
+                self.assertNotIn('log_id', response.json())
+            response = self.client.post(f'{self.url}?return_id=true', {'user_id': self.user.pk, 'activity': 'login'},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(UserLog.objects.get(pk=response.json()['log_id']).activity, 'login')
+        self.assertEqual(get_buffer.return_value.add.call_count, 2)
+
+    def test_single_event_gets_its_id_without_bulk_insert_ids(self):
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert',
+                               new_callable=mock.PropertyMock, return_value=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post({'user_id': self.user.pk, 'activity': 'login'})
+        self.assertIsNotNone(response.json()['log_id'])
+        # Rolled up with its batch, not again by the post_save receiver
+        self.assertEqual(UserActivityRollup.objects.get(user=self.user, kind='login').count, 1)
+
+    def test_spooled_events_survive_a_lost_buffer(self):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            buffer = ActivityLogBuffer(spool_dir, flush_size=100, flush_interval=3600)
+            buffer.add([{'user_id': self.user.pk, 'activity': 'first', 'created_at': '2024-01-01T00:00:00+00:00'}])
+            self.assertEqual(UserLog.objects.filter(activity='first').count(), 0)
+
+            # A second process recovers the segment once the first one is gone
+            buffer.segment.close()
+            buffer.events.clear()
+            replacement = ActivityLogBuffer(spool_dir, flush_size=100, flush_interval=3600)
+            self.assertEqual(replacement.recover(), 1)
+            self.assertEqual(UserLog.objects.get(activity='first').created_at.year, 2024)
+            self.assertEqual(os.listdir(spool_dir), [])
+
+            replacement.add([{'user_id': self.user.pk, 'activity': 'second', 'created_at': '2024-01-02T00:00:00+00:00'}])
+            self.assertEqual(replacement.flush(), 1)
+            self.assertEqual(os.listdir(spool_dir), [])
+
+    def test_rejected_events_do_not_block_the_buffer(self):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            buffer = ActivityLogBuffer(spool_dir, flush_size=100, flush_interval=3600)
+            buffer.add([
+                {'user_id': self.user.pk, 'activity': 'before', 'created_at': '2024-01-01T00:00:00+00:00'},
+                {'user_id': self.user.pk, 'activity': None, 'created_at': '2024-01-01T00:00:00+00:00'},
+                {'user_id': self.user.pk, 'activity': 'after', 'created_at': '2024-01-01T00:00:00+00:00'},
+            ])
+            self.assertEqual(buffer.flush(), 2)
+            self.assertEqual(UserLog.objects.filter(activity__in=['before', 'after']).count(), 2)
+            self.assertEqual(os.listdir(spool_dir), ['dead-letter.ndjson'])
+            with open(os.path.join(spool_dir, 'dead-letter.ndjson')) as dead_letter:
+                self.assertIsNone(json.loads(dead_letter.readline())['event']['activity'])
+
+    def test_invalid_forwarded_ip_is_dropped(self):
+        response = self.client.post(self.url, {'user_id': self.user.pk, 'activity': 'login'},
+                                    content_type='application/json', HTTP_X_FORWARDED_FOR='x' * 100)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(UserLog.objects.filter(user=self.user).latest('id').ip_address)
+
+
+class ActivityRollupTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_rows(0)
+        self.user = User.objects.get(username='user0')
+
+    def test_rollups_follow_new_logs_and_backfill(self):
+        day = timezone.localdate()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            UserLog.objects.create(user=self.user, activity='Updated news #3')
+            # Added once the log's transaction commits
+            self.assertFalse(UserActivityRollup.objects.filter(kind='updated').exists())
+        self.assertEqual(len(callbacks), 1)
+        UserLog.objects.bulk_create([UserLog(user=self.user, activity='updated banner')] * 2)
+        rollups = dict(UserActivityRollup.objects.filter(user=self.user).values_list('kind', 'count'))
+        # Rows written with bulk_create outside core.activity_log are left to the backfill
+        self.assertEqual(rollups, {'login': 1, 'updated': 1})
+
+        UserActivityRollup.objects.update(count=0)
+        call_command('backfill_activity_rollups', '--since', day.isoformat(), '--until', day.isoformat(),
+                     stdout=io.StringIO())
+        rollups = dict(UserActivityRollup.objects.filter(user=self.user).values_list('kind', 'count'))
+        self.assertEqual(rollups, {'login': 1, 'updated': 3})
+
+        with self.assertNumQueries(1):
+            data = self.client.get(f'/api/user-logs/stats/?group=company&kind=updated&since={day}').json()
+        self.assertEqual(data['results'], [{
+            'company_id': self.user.company_id, 'total': 3, 'days': [{'day': day.isoformat(), 'count': 3}]
+        }])
+        self.assertEqual(self.client.get('/api/user-logs/stats/?group=team').status_code, 400)
+
+    def test_backfill_skips_archived_days(self):
+        UserLog.objects.bulk_create([
+            UserLog(user=self.user, activity='view', created_at=datetime(2024, 1, day, 12, tzinfo=dt_timezone.utc))
+            for day in (10, 10, 11)
+        ])
+        UserActivityRollup.objects.create(user=self.user, day='2024-01-10', kind='view', count=5)
+        with tempfile.TemporaryDirectory() as archive_dir, override_settings(USER_LOG_ARCHIVE_DIR=archive_dir):
+            # Part of the 10th was archived; the rows left in the table are not the whole day
+            append_to_archive('2024-01', [{'id': 0, 'user': self.user.pk, 'created_at': '2024-01-10T08:00:00+00:00'}])
+            output = io.StringIO()
+            call_command('backfill_activity_rollups', '--since', '2024-01-10', '--until', '2024-01-11', stdout=output)
+        self.assertIn('Skipped 1 day(s)', output.getvalue())
+        rollups = UserActivityRollup.objects.filter(user=self.user, kind='view').order_by('day')
+        self.assertEqual([(str(row.day), row.count) for row in rollups], [('2024-01-10', 5), ('2024-01-11', 1)])
+
+
+class UserLogArchiveTests(TestCase):
+    def setUp(self):
+        create_rows(0)
+        self.user = User.objects.get(username='user0')
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+        for month, count in [(1, 3), (2, 2)]:
+            UserLog.objects.bulk_create([
+                UserLog(user=self.user, activity=f'old {month}-{index}',
+                        created_at=datetime(2024, month, 10 + index, tzinfo=dt_timezone.utc))
+                for index in range(count)
+            ])
+
+    def test_old_logs_move_to_monthly_archives(self):
+        with override_settings(USER_LOG_ARCHIVE_DIR=self.archive_dir.name):
+            call_command('archive_user_logs', '--before', '2024-02-11', '--chunk-size', '2', '--batch-size', '1',
+                         stdout=io.StringIO())
+            self.assertEqual(
+                sorted(UserLog.objects.values_list('activity', flat=True)), ['login', 'old 2-1']
+            )
+
+            months = self.client.get('/api/user-logs/archive/').json()['months']
+            self.assertEqual([item['month'] for item in months], ['2024-01', '2024-02'])
+
+            data = self.client.get(f'/api/user-logs/archive/?month=2024-01&user_id={self.user.pk}&limit=2').json()
+            self.assertEqual([record['activity'] for record in data['results']], ['old 1-0', 'old 1-1'])
+            self.assertTrue(data['has_more'])
+            self.assertEqual(data['results'][0]['username'], 'user0')
+            data = self.client.get(data['next']).json()
+            self.assertEqual([record['activity'] for record in data['results']], ['old 1-2'])
+            self.assertEqual((data['has_more'], data['next']), (False, None))
+            response = self.client.get('/api/user-logs/archive/?month=2024-01&cursor=nope')
+            self.assertEqual(response.status_code, 400)
+
+            # Rows archived twice by a run interrupted before its deletes are read once
+            append_to_archive('2024-01', [next(read_archive('2024-01'))])
+            self.assertEqual(len(list(read_archive('2024-01'))), 3)
+
+
+class ContentHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_rows(0)
+
+    def request(self, method, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(url, data, content_type='application/json')
+
+    def test_changes_are_coalesced_and_versions_rebuilt(self):
+        news_id = self.request('post', '/api/news/', {'title': 'First'}).json()['id']
+        self.request('patch', f'/api/news/{news_id}/', {'title': 'Second'})
+        entries = ContentHistory.objects.filter(table_name='news', record_id=news_id)
+        self.assertEqual([entry.action for entry in entries], ['create'])
+        self.assertEqual(entries[0].changed_data['title'], [None, 'Second'])
+
+        with override_settings(CONTENT_HISTORY_COALESCE_SECONDS=0):
+            self.request('patch', f'/api/news/{news_id}/', {'title': 'Third', 'status': 'published'})
+            self.request('delete', f'/api/news/{news_id}/')
+
+        url = f'/api/content-history/timeline/?table=news&record_id={news_id}'
+        data = self.client.get(url).json()
+        self.assertEqual([entry['action'] for entry in data['entries']], ['create', 'update', 'delete'])
+        self.assertEqual(data['entries'][1]['changes'], {'title': ['Second', 'Third'], 'status': ['draft', 'published']})
+
+        created, updated, deleted = [entry['id'] for entry in data['entries']]
+        values = self.client.get(f'{url}&version={created}').json()['values']
+        self.assertEqual((values['title'], values['status']), ('Second', 'draft'))
+        self.assertEqual(self.client.get(f'{url}&version={updated}').json()['values']['title'], 'Third')
+        self.assertIsNone(self.client.get(f'{url}&version={deleted}').json()['values'])
+        self.assertEqual(self.client.get('/api/content-history/timeline/?table=user&record_id=1').status_code, 400)
+
+    def test_coalescing_window_does_not_slide(self):
+        start = timezone.now()
+        with mock.patch('core.content_history.timezone.now', return_value=start):
+            news_id = self.request('post', '/api/news/', {'title': 'First'}).json()['id']
+        # Each edit is within the window of the one before, the last one not of the first
+        for minutes, title in [(4, 'Second'), (8, 'Third')]:
+            with mock.patch('core.content_history.timezone.now', return_value=start + timedelta(minutes=minutes)):
+                self.request('patch', f'/api/news/{news_id}/', {'title': title})
+        entries = ContentHistory.objects.filter(table_name='news', record_id=news_id).order_by('id')
+        self.assertEqual([entry.action for entry in entries], ['create', 'update'])
+        self.assertEqual(entries[0].changed_data['title'], [None, 'Second'])
+        self.assertEqual(entries[1].changed_data['title'], ['Second', 'Third'])
+
+    def test_bulk_setting_writes_are_recorded(self):
+        company = Company.objects.get(name='Company 0')
+        self.request('post', '/api/settings/bulk-upsert/',
+                     {'company_id': company.pk, 'settings': {'key0': 2, 'theme': 'dark'}})
+        entries = ContentHistory.objects.filter(table_name='setting').order_by('id')
+        self.assertEqual(
+            [(entry.action, entry.changed_data['setting_value']) for entry in entries],
+            [('update', ['1', '2']), ('create', [None, 'dark'])],
+        )
+
+    def test_batch_drops_records_created_and_deleted_in_it(self):
+        with capture_batch(), self.captureOnCommitCallbacks(execute=True):
+            news = News.objects.create(title='Draft')
+            news.title = 'Renamed'
+            news.save()
+            News.objects.create(title='Kept')
+            news.delete()
+        captured = ContentHistory.objects.filter(table_name='news', user=None)
+        self.assertEqual([entry.changed_data['title'] for entry in captured], [[None, 'Kept']])
+
+
+class BulkEndpointTests(TestCase):
+    url = '/api/social-media/bulk/'
+
+    def setUp(self):
+        cache.clear()
+        create_rows(0)
+        self.company = Company.objects.get(name='Company 0')
+
+    def request(self, method, data):
+        # Commit callbacks run inside the request's history batch, as they do outside tests
+        with capture_batch(), self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(self.url, data, content_type='application/json')
+
+    def test_bulk_create_reorder_and_delete(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.request('post', [
+                {'company': self.company.pk, 'platform': f'p{index}', 'url': f'https://example.com/{index}'}
+                for index in range(20)
+            ])
+        self.assertEqual(response.status_code, 201)
+        self.assertLess(len(queries), 12)
+        ids = [item['id'] for item in response.json()]
+        self.assertEqual(response.json()[0]['company_name'], 'Company 0')
+
+        # The cached active links are refreshed after a bulk write
+        active_url = f'/api/social-media/active/?company_id={self.company.pk}'
+        self.assertEqual(len(self.client.get(active_url).json()), 21)
+
+        reorder = [{'id': pk, 'display_order': 20 - index} for index, pk in enumerate(ids)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.request('patch', reorder)
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(queries), 12)
+        self.assertEqual(SocialMedia.objects.get(pk=ids[0]).display_order, 20)
+        self.assertEqual(self.client.get(active_url).json()[1]['id'], ids[-1])
+        # Created and reordered within the coalescing window: one history entry
+        entry = ContentHistory.objects.get(table_name='socialmedia', record_id=ids[0])
+        self.assertEqual((entry.action, entry.changed_data['display_order']), ('create', [None, 20]))
+
+        # Nothing is written when one item fails
+        response = self.request('patch', [{'id': ids[0], 'platform': 'ok'}, {'id': ids[1], 'url': 'not a url'},
+                                          {'id': 999999}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [2])
+        response = self.request('patch', [{'id': ids[0], 'platform': 'ok'}, {'id': ids[1], 'url': 'not a url'}])
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1])
+        self.assertEqual(SocialMedia.objects.get(pk=ids[0]).platform, 'p0')
+
+        response = self.request('delete', {'ids': ids[:5]})
+        self.assertEqual(response.json(), {'deleted': 5})
+        self.assertEqual(len(self.client.get(active_url).json()), 16)
+
+    def test_bulk_create_without_returned_ids(self):
+        # As on MySQL, where a bulk insert does not return the new primary keys
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert',
+                               new_callable=mock.PropertyMock, return_value=False):
+            response = self.request('post', [
+                {'company': self.company.pk, 'platform': f'p{index}', 'url': f'https://example.com/{index}'}
+                for index in range(3)
+            ])
+        self.assertEqual(response.status_code, 201)
+        ids = [item['id'] for item in response.json()]
+        self.assertNotIn(None, ids)
+        self.assertEqual(ContentHistory.objects.filter(table_name='socialmedia', record_id__in=ids,
+                                                       action='create').count(), 3)
+
+    def test_malformed_ids_are_rejected(self):
+        for method, data in (('patch', [{'id': 'abc', 'platform': 'x'}]), ('patch', [{'id': {'pk': 1}}]),
+                             ('delete', {'ids': ['abc']}), ('delete', {'ids': [{'pk': 1}]})):
+            response = self.request(method, data)
+            self.assertEqual(response.status_code, 400, (method, data))
+            self.assertIn('id', response.json())
+
+
+class ThumbnailRenderingTests(TestCase):
+    def encode(self, img, image_format):
+        output = io.BytesIO()
+        img.save(output, image_format)
+        output.seek(0)
+        return output
+
+    def sizes(self, rendered):
+        return {key: Image.open(io.BytesIO(data)).size for key, data in rendered['thumbnails'].items()}
+
+    def test_sizes_keep_the_aspect_ratio_from_one_decode(self):
+        source = self.encode(Image.new('RGB', (1200, 800), (10, 120, 200)), 'JPEG')
+        with mock.patch('core.utils.Image.open', wraps=Image.open) as image_open:
+            rendered = render_thumbnails(source)
+        self.assertEqual(image_open.call_count, 1)
+        self.assertEqual((rendered['width'], rendered['height']), (1200, 800))
+        self.assertEqual(self.sizes(rendered), {'small': (150, 100), 'medium': (300, 200), 'large': (600, 400)})
+
+    def test_exif_orientation_is_applied(self):
+        output = io.BytesIO()
+        exif = Image.Exif()
+        exif[renditions.EXIF_ORIENTATION_TAG] = 6  # Stored 1200x800, displayed 800x1200
+        Image.new('RGB', (1200, 800), (10, 120, 200)).save(output, 'JPEG', exif=exif)
+        output.seek(0)
+
+        rendered = render_thumbnails(output)
+        self.assertEqual((rendered['width'], rendered['height']), (800, 1200))
+        self.assertEqual(self.sizes(rendered), {'small': (100, 150), 'medium': (200, 300), 'large': (400, 600)})
+
+    def test_small_sources_are_not_upscaled(self):
+        rendered = render_thumbnails(self.encode(Image.new('RGB', (200, 50)), 'PNG'))
+        self.assertEqual(self.sizes(rendered), {'small': (150, 38), 'medium': (200, 50), 'large': (200, 50)})
+
+    def test_transparent_and_palette_sources_become_rgb_jpegs(self):
+        transparent = Image.new('RGBA', (400, 400), (0, 0, 0, 0))
+        palette = Image.new('RGB', (400, 400), (0, 200, 0)).convert('P')
+        for source, color in ((self.encode(transparent, 'PNG'), (255, 255, 255)),
+                              (self.encode(palette, 'GIF'), (0, 200, 0))):
+            rendered = render_thumbnails(source)
+            for data in rendered['thumbnails'].values():
+                thumbnail = Image.open(io.BytesIO(data))
+                self.assertEqual((thumbnail.format, thumbnail.mode), ('JPEG', 'RGB'))
+                # Transparency is composited onto white
+                self.assertTrue(all(abs(a - b) < 8 for a, b in zip(thumbnail.getpixel((0, 0)), color)))
+
+
+class MediaStorageTestCase(TestCase):
+    """Stores media files in a temporary MEDIA_ROOT"""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root.name, MEDIA_UPLOAD_SESSION_DIR=os.path.join(media_root.name, 'sessions')
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def image_bytes(self, size=(400, 300), image_format='PNG'):
+        output = io.BytesIO()
+        Image.new('RGB', size, (200, 40, 40)).save(output, image_format)
+        return output.getvalue()
+
+    def stored_files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.media_root)
+                      for root, _dirs, names in os.walk(self.media_root) for name in names)
+
+
+class MediaPlaceholderTests(MediaStorageTestCase):
+    def upload(self, data, name):
+        response = self.client.post('/api/media/upload/', {'file': ContentFile(data, name=name)})
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_images_get_a_placeholder_and_dominant_color(self):
+        data = self.upload(self.image_bytes(), 'red.png')
+        self.assertRegex(data['placeholder'], r'^data:image/(webp|png);base64,')
+        self.assertLess(len(data['placeholder']), 1000)
+        self.assertRegex(data['dominant_color'], r'^#[0-9a-f]{6}$')
+        red, green, blue = (int(data['dominant_color'][i:i + 2], 16) for i in (1, 3, 5))
+        self.assertGreater(red, 150)
+        self.assertLess(max(green, blue), 90)
+
+        gallery = Gallery.objects.create(name='Photos')
+        GalleryItem.objects.create(gallery=gallery, media_id=data['id'])
+        media_info = self.client.get(f'/api/galleries/{gallery.pk}/').json()['items'][0]['media_info']
+        self.assertEqual((media_info['placeholder'], media_info['dominant_color']),
+                         (data['placeholder'], data['dominant_color']))
+
+    def test_other_files_have_none(self):
+        data = self.upload(b'plain text', 'notes.txt')
+        self.assertEqual((data['placeholder'], data['dominant_color']), (None, None))
+
+
+class MediaDeduplicationTests(MediaStorageTestCase):
+    def upload(self, data):
+        response = self.client.post('/api/media/bulk-upload/', {'files': [ContentFile(data, name='photo.png')]})
+        self.assertEqual(response.status_code, 201)
+        return Media.objects.get(pk=response.json()['results'][0]['media']['id'])
+
+    def test_shared_files_are_deleted_with_their_last_media(self):
+        first = self.upload(self.image_bytes())
+        second = self.upload(self.image_bytes())
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(second.thumbnail_small.name, first.thumbnail_small.name)
+        stored = self.stored_files()
+        self.assertEqual(len(stored), 4)  # One original and three thumbnails
+
+        self.assertEqual(self.client.delete(f'/api/media/{first.pk}/').status_code, 204)
+        self.assertEqual(self.stored_files(), stored)
+        self.assertEqual(self.client.delete(f'/api/media/{second.pk}/').status_code, 204)
+        self.assertEqual(self.stored_files(), [])
+
+
+class MediaGcTests(MediaStorageTestCase):
+    def test_clear_missing_keeps_files_written_after_the_scan(self):
+        response = self.client.post('/api/media/upload/', {'file': ContentFile(self.image_bytes(), name='new.png')})
+        fresh = Media.objects.get(pk=response.json()['id'])
+        gone = Media.objects.create(file_name='gone.jpg', file_type='image',
+                                    thumbnail_small='thumbnails/small/gone.jpg')
+
+        # Both rows look missing to a storage scan that ran before the upload
+        with mock.patch('core.management.commands.media_gc.Command.scan_storage', return_value={}):
+            call_command('media_gc', '--clear-missing', stdout=io.StringIO())
+        fresh_thumbnail = fresh.thumbnail_small.name
+        fresh.refresh_from_db()
+        gone.refresh_from_db()
+        self.assertEqual(fresh.thumbnail_small.name, fresh_thumbnail)
+        self.assertFalse(gone.thumbnail_small)
+
+
+class BulkUploadTests(MediaStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        create_rows(0)
+        self.project = Project.objects.get(title='Project 0')
+
+    def bulk_upload(self, files, **data):
+        return self.client.post('/api/media/bulk-upload/', {'files': files, **data})
+
+    def test_upload_into_a_project_invalidates_cached_projects(self):
+        url = f'/api/projects/featured/?company_id={self.project.company_id}'
+        self.assertEqual(len(self.client.get(url).json()[0]['gallery_images']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.bulk_upload([ContentFile(self.image_bytes(), name='new.png')], project=self.project.pk)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.client.get(url).json()[0]['gallery_images']), 2)
+
+    def test_one_invalid_file_rejects_the_batch(self):
+        media_count = Media.objects.count()
+        response = self.bulk_upload([ContentFile(self.image_bytes(), name='ok.png'),
+                                     ContentFile(b'MZ', name='tool.exe')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([bool(result['errors']) for result in response.json()['results']], [False, True])
+        self.assertEqual(Media.objects.count(), media_count)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_files_are_attached_in_upload_order(self):
+        gallery = Gallery.objects.get(name='Gallery 0')
+        GalleryItem.objects.filter(gallery=gallery).update(ordering=4)
+        ProjectGallery.objects.filter(project=self.project).update(display_order=7)
+        names = ['c.png', 'a.png', 'b.png']
+        files = [ContentFile(self.image_bytes(size=(100 + index, 80)), name=name) for index, name in enumerate(names)]
+
+        response = self.bulk_upload(files, gallery=gallery.pk, project=self.project.pk)
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([result['file_name'] for result in results], names)
+        self.assertEqual([result['media']['file_name'] for result in results], names)
+
+        ids = [result['media']['id'] for result in results]
+        items = GalleryItem.objects.filter(gallery=gallery, media_id__in=ids).order_by('ordering')
+        self.assertEqual([(item.media_id, item.ordering) for item in items], list(zip(ids, [5, 6, 7])))
+        images = ProjectGallery.objects.filter(project=self.project, display_order__gt=7).order_by('display_order')
+        self.assertEqual([image.display_order for image in images], [8, 9, 10])
+        self.assertEqual([image.image_path for image in images], [f'/media-files/{pk}/' for pk in ids])
+
+    def test_media_rows_send_post_save(self):
+        saved = []
+
+        def receiver(sender, instance, created, **kwargs):
+            saved.append((instance.pk, created))
+
+        post_save.connect(receiver, sender=Media, weak=False)
+        self.addCleanup(post_save.disconnect, receiver, sender=Media)
+
+        response = self.bulk_upload([ContentFile(self.image_bytes(), name='a.png'),
+                                     ContentFile(self.image_bytes(size=(90, 90)), name='b.png')])
+        ids = [result['media']['id'] for result in response.json()['results']]
+        self.assertEqual(saved, [(pk, True) for pk in ids])
+
+    def test_gallery_items_are_recorded_in_history(self):
+        gallery = Gallery.objects.get(name='Gallery 0')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bulk_upload([ContentFile(self.image_bytes(), name='new.png')], gallery=gallery.pk)
+        item = GalleryItem.objects.filter(gallery=gallery).latest('id')
+        entry = ContentHistory.objects.get(table_name='galleryitem', record_id=item.pk)
+        self.assertEqual((entry.action, entry.changed_data['media_id']), ('create', [None, item.media_id]))
+
+
+class MediaServingTests(MediaStorageTestCase):
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+        self.assertEqual(parse_range('bytes=50-500', 100), (50, 99))
+        for header in (None, 'items=0-9', 'bytes=0-1,5-6', 'bytes=-'):
+            self.assertIsNone(parse_range(header, 100))
+        for header, size in (('bytes=100-', 100), ('bytes=9-5', 100), ('bytes=-0', 100), ('bytes=-10', 0),
+                             ('bytes=0-', 0)):
+            with self.subTest(header=header, size=size), self.assertRaises(ValueError):
+                parse_range(header, size)
+
+    def test_ranges_and_conditional_requests(self):
+        data = bytes(range(256)) * 4
+        media = Media.objects.create(file=ContentFile(data, name='data.bin'), file_name='data.bin',
+                                     mime_type='application/octet-stream')
+        url = f'/media-files/{media.pk}/'
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {len(data) - 10}-{len(data) - 1}/{len(data)}')
+        self.assertEqual(b''.join(response.streaming_content), data[-10:])
+
+        response = self.client.get(url, HTTP_RANGE=f'bytes={len(data)}-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(data)}'))
+
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # A stale If-Range validator gets the whole file
+        response = self.client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), data)
+        self.assertEqual(self.client.get(f'/media-files/{media.pk}/huge/').status_code, 404)
+
+    def test_api_links_to_the_serving_view(self):
+        media = Media.objects.create(file=ContentFile(self.image_bytes(), name='photo.png'), file_name='photo.png',
+                                     file_type='image')
+        data = self.client.get(f'/api/media/{media.pk}/').json()
+        self.assertEqual(data['file_url'], f'http://testserver/media-files/{media.pk}/')
+        # Without thumbnails every size falls back to the original
+        self.assertEqual(set(data['thumbnail_urls'].values()), {data['file_url']})
+
+        media.thumbnail_small = 'thumbnails/small/photo.jpg'
+        media.save()
+        gallery = Gallery.objects.create(name='Photos')
+        GalleryItem.objects.create(gallery=gallery, media=media)
+        item = self.client.get(f'/api/galleries/{gallery.pk}/').json()['items'][0]['media_info']
+        self.assertEqual(item['file_url'], f'http://testserver/media-files/{media.pk}/')
+        self.assertEqual(media.get_thumbnail_url('small'), f'/media-files/{media.pk}/small/')
+
+
+class UploadSessionTests(MediaStorageTestCase):
+    chunk_size = 256 * 1024
+
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(self.chunk_size + 10)
+
+    def start(self):
+        response = self.client.post('/api/media-uploads/', {
+            'file_name': 'notes.txt', 'file_size': len(self.data), 'chunk_size': self.chunk_size,
+            'sha256': hashlib.sha256(self.data).hexdigest(),
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def put_chunk(self, session_id, index, body=None):
+        body = self.data[index * self.chunk_size:(index + 1) * self.chunk_size] if body is None else body
+        return self.client.put(f'/api/media-uploads/{session_id}/chunks/{index}/', body,
+                               content_type='application/octet-stream',
+                               HTTP_X_CHUNK_CHECKSUM=hashlib.sha256(body).hexdigest())
+
+    def test_chunks_are_verified_and_finalized_once(self):
+        session_id = self.start()
+        self.assertEqual(self.put_chunk(session_id, 1, b'short').status_code, 400)
+        self.assertEqual(self.put_chunk(session_id, 1).json()['missing_chunks'], [0])
+
+        url = f'/api/media-uploads/{session_id}/finalize/'
+        self.assertEqual(self.client.post(url).status_code, 409)
+        self.put_chunk(session_id, 0)
+
+        # A finalize already in progress elsewhere holds the session
+        UploadSession.objects.filter(pk=session_id).update(status=UploadSession.STATUS_FINALIZING)
+        self.assertEqual(self.client.post(url).status_code, 409)
+        UploadSession.objects.filter(pk=session_id).update(status=UploadSession.STATUS_ACTIVE)
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        media = Media.objects.get(pk=response.json()['id'])
+        with media.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.data)
+        self.assertEqual(self.client.post(url).status_code, 409)
+        self.assertEqual(self.put_chunk(session_id, 0).status_code, 409)
+        self.assertEqual(Media.objects.filter(sha256=media.sha256).count(), 1)
+
+    def test_missing_part_file_is_a_conflict(self):
+        session_id = self.start()
+        self.put_chunk(session_id, 0)
+        self.put_chunk(session_id, 1)
+        session = UploadSession.objects.get(pk=session_id)
+        os.remove(upload_session_path(session))
+
+        self.assertEqual(self.put_chunk(session_id, 0).status_code, 409)
+        self.assertEqual(self.client.post(f'/api/media-uploads/{session_id}/finalize/').status_code, 409)
+        session.refresh_from_db()
+        self.assertEqual((session.status, session.received_chunks), (UploadSession.STATUS_ACTIVE, []))
+
+    def test_expired_sessions_are_removed_only_when_asked(self):
+        session_id = self.start()
+        self.put_chunk(session_id, 0)
+        UploadSession.objects.filter(pk=session_id).update(expires_at=timezone.now())
+
+        call_command('media_gc', stdout=io.StringIO())
+        self.assertTrue(UploadSession.objects.filter(pk=session_id).exists())
+        call_command('media_gc', '--expire-uploads', stdout=io.StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+class MediaWorkerTests(MediaStorageTestCase):
+    def queue_image(self, name='photo.png'):
+        media = Media.objects.create(file=ContentFile(self.image_bytes(), name=name), file_name=name,
+                                     file_type='image', processing_status=Media.STATUS_PENDING)
+        MediaProcessingJob.objects.create(media=media)
+        return media
+
+    def test_jobs_are_claimed_rendered_and_completed(self):
+        media = self.queue_image()
+        call_command('media_worker', '--once', '--workers', '1', stdout=io.StringIO())
+        media.refresh_from_db()
+        self.assertEqual(media.processing_status, Media.STATUS_READY)
+        self.assertEqual((media.width, media.height), (400, 300))
+        self.assertTrue(all(os.path.exists(getattr(media, name).path)
+                            for name in ('thumbnail_small', 'thumbnail_medium', 'thumbnail_large')))
+        self.assertFalse(MediaProcessingJob.objects.exists())
+
+    def test_media_deleted_while_rendering_is_dropped(self):
+        media = self.queue_image()
+        worker = MediaWorkerCommand(stdout=io.StringIO(), stderr=io.StringIO())
+        worker.max_attempts = 3
+        [job] = worker.claim_jobs(10)
+        rendered = render_source(self.image_bytes())
+        Media.objects.filter(pk=media.pk).delete()
+
+        self.assertFalse(worker.complete_job(job, rendered))
+        worker.fail_job(job, 'late failure')
+        self.assertEqual(self.stored_files(), [os.path.relpath(media.file.path, self.media_root)])
+
+    def test_regenerate_includes_media_without_a_type(self):
+        media = Media.objects.create(file=ContentFile(self.image_bytes(), name='legacy.png'), file_name='legacy.png')
+        call_command('regenerate_thumbnails', '--workers', '1', stdout=io.StringIO(), stderr=io.StringIO())
+        media.refresh_from_db()
+        self.assertEqual((media.file_type, media.processing_status), (Media.TYPE_IMAGE, Media.STATUS_READY))
+        self.assertTrue(media.thumbnail_small)
+
+
+class RenditionTests(MediaStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(MEDIA_RENDITION_CACHE_DIR=os.path.join(self.media_root, 'renditions'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        renditions._cache = None
+        self.addCleanup(setattr, renditions, '_cache', None)
+
+    def create_media(self, data, name='photo.jpg'):
+        return Media.objects.create(file=ContentFile(data, name=name), file_name=name, file_type='image')
+
+    def test_unreadable_source_is_rejected(self):
+        media = self.create_media(b'not an image')
+        response = self.client.get(f'/api/media/{media.pk}/rendition/', {'w': 96, 'fmt': 'png'})
+        self.assertEqual(response.status_code, 422)
+
+    def test_evicted_cache_file_is_rendered_again(self):
+        media = self.create_media(self.image_bytes())
+        url = f'/api/media/{media.pk}/rendition/'
+        self.assertEqual(self.client.get(url, {'w': 96, 'fmt': 'png'}).status_code, 200)
+
+        # The file disappears between the cache lookup and the open
+        cache = renditions.get_rendition_cache()
+        with mock.patch.object(cache, 'get', side_effect=cache.path_for):
+            for path, _size, _mtime in list(cache._entries()):
+                os.remove(path)
+            response = self.client.get(url, {'w': 96, 'fmt': 'png'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(response.content)).size, (96, 72))
+
+    def test_if_none_match_lists_and_weak_validators(self):
+        media = self.create_media(self.image_bytes())
+        url = f'/api/media/{media.pk}/rendition/'
+        etag = self.client.get(url, {'w': 96, 'fmt': 'png'})['ETag']
+        for header in (etag, f'"other", {etag}', f'W/{etag}', '*'):
+            response = self.client.get(url, {'w': 96, 'fmt': 'png'}, HTTP_IF_NONE_MATCH=header)
+            self.assertEqual(response.status_code, 304, header)
+            self.assertEqual(response['ETag'], etag)
+        response = self.client.get(url, {'w': 96, 'fmt': 'png'}, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_draft_follows_exif_orientation(self):
+        output = io.BytesIO()
+        exif = Image.Exif()
+        exif[renditions.EXIF_ORIENTATION_TAG] = 6  # Stored 400x300, displayed 300x400
+        Image.new('RGB', (400, 300), (200, 40, 40)).save(output, 'JPEG', exif=exif)
+
+        with mock.patch.object(renditions.ImageOps, 'fit', wraps=renditions.ImageOps.fit) as fit:
+            data = renditions.render_rendition(io.BytesIO(output.getvalue()), 192, 96, 'cover')
+        self.assertGreaterEqual(fit.call_args.args[0].width, 192)  # Not drafted below the box
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (192, 96))
 
-# Create your tests here.
@@ -18,6 +18,7 @@ router.register(r'testimonials', views.TestimonialViewSet)
 router.register(r'clients', views.ClientViewSet)
 router.register(r'news', views.NewsViewSet)
 router.register(r'media', views.MediaViewSet)
+router.register(r'media-uploads', views.UploadSessionViewSet)
 router.register(r'social-media', views.SocialMediaViewSet)
 router.register(r'settings', views.SettingViewSet)
 router.register(r'content-history', views.ContentHistoryViewSet)
@@ -29,7 +30,12 @@ urlpatterns = [
     # REST API endpoints
     path("api/", include(router.urls)),
     
+    # Media files with Range and conditional GET support
+    path("media-files/<int:media_id>/", views.serve_media, name="serve_media"),
+    path("media-files/<int:media_id>/<str:variant>/", views.serve_media, name="serve_media_variant"),
+    
     # Content management API endpoints
+    path("api/site/", views.site_document, name="site_document"),
     path("api/content/banner/", views.banner_content_api, name="banner_content_api"),
     path("api/content/services/", views.service_content_api, name="service_content_api"),
     path("api/content/about/", views.about_content_api, name="about_content_api"),
@@ -2,10 +2,17 @@
 Utility functions for media handling
 """
 import os
+import base64
+import hashlib
 import mimetypes
-from PIL import Image
-from django.core.files.base import ContentFile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from PIL import Image, ImageOps, features
+from django.conf import settings
+from django.core.files.base import ContentFile, File
 from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Max
 from io import BytesIO
 
 
@@ -18,11 +25,32 @@ ALLOWED_AUDIO_EXTENSIONS = ['.mp3', '.wav', '.ogg', '.m4a']
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 MAX_IMAGE_SIZE = 5 * 1024 * 1024   # 5MB for images
 
+# Chunked upload sessions (large videos and documents)
+MAX_CHUNKED_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
+MIN_CHUNK_SIZE = 256 * 1024  # 256KB
+MAX_CHUNK_SIZE = 50 * 1024 * 1024  # 50MB
+DEFAULT_CHUNK_SIZE = 5 * 1024 * 1024  # 5MB
+UPLOAD_SESSION_TTL = timedelta(hours=24)
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# Bulk uploads
+MAX_BULK_UPLOAD_FILES = 50
+DEFAULT_BULK_UPLOAD_WORKERS = 4
+
 THUMBNAIL_SIZES = {
     'small': (150, 150),
     'medium': (300, 300),
     'large': (600, 600),
 }
+THUMBNAIL_QUALITY = 85
+EXIF_ORIENTATION_TAG = 0x0112
+
+# Inline preview shown while thumbnails load (longest edge in pixels)
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+# Media fields that point at files in storage
+MEDIA_FILE_FIELDS = ('file', 'thumbnail_small', 'thumbnail_medium', 'thumbnail_large')
 
 
 def get_file_type_from_extension(filename):
@@ -43,14 +71,18 @@ def get_file_type_from_extension(filename):
 
 def validate_file_upload(uploaded_file):
     """Validate uploaded file"""
+    return validate_file_metadata(uploaded_file.name, uploaded_file.size)
+
+
+def validate_file_metadata(filename, size, max_size=MAX_FILE_SIZE):
+    """Validate a file's name and size before accepting it"""
     errors = []
     
     # Check file size
-    if uploaded_file.size > MAX_FILE_SIZE:
-        errors.append(f"File size too large. Maximum allowed: {MAX_FILE_SIZE // (1024*1024)}MB")
+    if size > max_size:
+        errors.append(f"File size too large. Maximum allowed: {max_size // (1024*1024)}MB")
     
     # Check file extension
-    filename = uploaded_file.name
     ext = os.path.splitext(filename)[1].lower()
     all_allowed = (ALLOWED_IMAGE_EXTENSIONS + ALLOWED_DOCUMENT_EXTENSIONS + 
                    ALLOWED_VIDEO_EXTENSIONS + ALLOWED_AUDIO_EXTENSIONS)
@@ -60,7 +92,7 @@ def validate_file_upload(uploaded_file):
     
     # Additional check for images
     file_type = get_file_type_from_extension(filename)
-    if file_type == 'image' and uploaded_file.size > MAX_IMAGE_SIZE:
+    if file_type == 'image' and size > MAX_IMAGE_SIZE:
         errors.append(f"Image size too large. Maximum allowed: {MAX_IMAGE_SIZE // (1024*1024)}MB")
     
     return errors
@@ -75,6 +107,106 @@ def get_image_dimensions(image_file):
         return None, None
 
 
+def flatten_to_rgb(img):
+    """Convert an image to RGB, compositing transparency onto white"""
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA'):
+        # Create a white background
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def encode_jpeg(img):
+    """Encode an RGB image as a thumbnail JPEG"""
+    thumb_io = BytesIO()
+    img.save(thumb_io, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+    return thumb_io.getvalue()
+
+
+def render_placeholder(img):
+    """
+    Build a tiny inline preview and the dominant colour of an RGB image.
+
+    Returns a ``(data_uri, hex_colour)`` pair. The preview is a few hundred
+    bytes at most and is meant to be scaled up with a CSS blur.
+    """
+    preview = img.copy()
+    preview.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BILINEAR)
+    
+    output = BytesIO()
+    if features.check('webp'):
+        preview.save(output, format='WEBP', quality=PLACEHOLDER_QUALITY)
+        mime_type = 'image/webp'
+    else:
+        preview.save(output, format='PNG', optimize=True)
+        mime_type = 'image/png'
+    data_uri = f"data:{mime_type};base64,{base64.b64encode(output.getvalue()).decode('ascii')}"
+    
+    # Most common colour of a small palette, which unlike the mean is not
+    # muddied by contrasting areas
+    palette_image = preview.quantize(colors=8)
+    _count, index = max(palette_image.getcolors())
+    red, green, blue = palette_image.getpalette()[index * 3:index * 3 + 3]
+    
+    return data_uri, f"#{red:02x}{green:02x}{blue:02x}"
+
+
+def render_thumbnails(image_file):
+    """
+    Decode an image once and derive every thumbnail size from it.
+
+    Large JPEGs are decoded at a reduced scale via ``draft``, the EXIF
+    orientation is applied and the colour mode normalised once, and each size
+    is resized from the previous (larger) output instead of from full
+    resolution. Returns a dict with the original ``width``/``height`` as
+    displayed, the encoded JPEG bytes per size key and the inline
+    ``placeholder``/``dominant_color``, or None if the image cannot be decoded.
+    """
+    try:
+        with Image.open(image_file) as img:
+            width, height = img.size
+            largest = max(THUMBNAIL_SIZES.values())
+            # EXIF orientations 5-8 rotate the stored pixels by 90 degrees
+            if img.getexif().get(EXIF_ORIENTATION_TAG) in (5, 6, 7, 8):
+                width, height = height, width
+
+            # JPEG only: let the decoder downscale by 1/2, 1/4 or 1/8 while
+            # staying above the largest thumbnail size (square, so the
+            # orientation does not matter)
+            img.draft('RGB', largest)
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ('RGB', 'RGBA', 'LA', 'L'):
+                img = img.convert('RGBA')
+
+            # Shrink before flattening so transparency is composited on the
+            # small image rather than at full resolution
+            img.thumbnail(largest, Image.Resampling.LANCZOS)
+            img = flatten_to_rgb(img)
+
+            thumbnails = {}
+            for size_key, size in sorted(THUMBNAIL_SIZES.items(), key=lambda item: item[1], reverse=True):
+                # thumbnail() works in place, so each step starts from the last one
+                img.thumbnail(size, Image.Resampling.LANCZOS)
+                thumbnails[size_key] = encode_jpeg(img)
+
+            # The smallest thumbnail is plenty to derive the placeholder from
+            placeholder, dominant_color = render_placeholder(img)
+
+            return {
+                'width': width, 'height': height, 'thumbnails': thumbnails,
+                'placeholder': placeholder, 'dominant_color': dominant_color,
+            }
+
+    except Exception as e:
+        print(f"Error creating thumbnails: {e}")
+        return None
+
+
 def create_thumbnail(image_file, size_key='medium'):
     """Create thumbnail for an image"""
     if size_key not in THUMBNAIL_SIZES:
@@ -85,36 +217,38 @@ def create_thumbnail(image_file, size_key='medium'):
     try:
         # Open the image
         with Image.open(image_file) as img:
-            # Convert to RGB if necessary (for PNG with transparency)
-            if img.mode in ('RGBA', 'LA', 'P'):
-                # Create a white background
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
+            img.draft('RGB', size)
+            img = flatten_to_rgb(img)
             
             # Create thumbnail
             img.thumbnail(size, Image.Resampling.LANCZOS)
             
-            # Save to BytesIO
-            thumb_io = BytesIO()
-            img.save(thumb_io, format='JPEG', quality=85, optimize=True)
-            thumb_io.seek(0)
-            
-            return ContentFile(thumb_io.read())
+            return ContentFile(encode_jpeg(img))
     
     except Exception as e:
         print(f"Error creating thumbnail: {e}")
         return None
 
 
-def process_media_file(media_instance, uploaded_file):
-    """Process uploaded media file and create thumbnails if it's an image"""
-    
-    # Set basic file information
+def save_thumbnails(media_instance, original_name, thumbnails):
+    """Attach rendered thumbnail bytes to the media instance's thumbnail fields"""
+    for size_key, content in thumbnails.items():
+        thumbnail_filename = f"{size_key}_{original_name}"
+        thumbnail_field = getattr(media_instance, f'thumbnail_{size_key}')
+        thumbnail_field.save(thumbnail_filename, ContentFile(content), save=False)
+
+
+def compute_sha256(uploaded_file):
+    """Hash an uploaded file chunk by chunk without reading it into memory"""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def set_file_metadata(media_instance, uploaded_file):
+    """Fill in the name, size and type information of an uploaded file"""
     media_instance.file_name = uploaded_file.name
     media_instance.file_size = uploaded_file.size
     media_instance.mime_type = mimetypes.guess_type(uploaded_file.name)[0]
@@ -123,30 +257,259 @@ def process_media_file(media_instance, uploaded_file):
     # Set title if not provided
     if not media_instance.title:
         media_instance.title = os.path.splitext(uploaded_file.name)[0]
+
+
+def process_media_file(media_instance, uploaded_file, defer_thumbnails=False):
+    """
+    Process uploaded media file and create thumbnails if it's an image.
+
+    With ``defer_thumbnails`` only the file metadata is filled in and images are
+    marked as pending; the media_worker command renders them later.
+    """
+    
+    set_file_metadata(media_instance, uploaded_file)
     
     # Process images
-    if media_instance.file_type == 'image':
-        # Get image dimensions
-        width, height = get_image_dimensions(uploaded_file)
-        if width and height:
-            media_instance.width = width
-            media_instance.height = height
-        
-        # Create thumbnails
-        uploaded_file.seek(0)  # Reset file pointer
+    if media_instance.file_type == 'image' and defer_thumbnails:
+        media_instance.processing_status = media_instance.STATUS_PENDING
+    
+    elif media_instance.file_type == 'image':
+        uploaded_file.seek(0)
         
-        for size_key in THUMBNAIL_SIZES.keys():
-            thumbnail_content = create_thumbnail(uploaded_file, size_key)
-            if thumbnail_content:
-                thumbnail_filename = f"{size_key}_{uploaded_file.name}"
-                thumbnail_field = getattr(media_instance, f'thumbnail_{size_key}')
-                thumbnail_field.save(thumbnail_filename, thumbnail_content, save=False)
+        # Decode once for dimensions and every thumbnail size
+        rendered = render_thumbnails(uploaded_file)
+        if rendered:
+            apply_rendered_image(media_instance, uploaded_file.name, rendered)
         
         uploaded_file.seek(0)  # Reset file pointer again
     
     return media_instance
 
 
+def apply_rendered_image(media_instance, original_name, rendered):
+    """Copy the output of render_thumbnails onto a media instance"""
+    media_instance.width = rendered['width']
+    media_instance.height = rendered['height']
+    media_instance.placeholder = rendered['placeholder']
+    media_instance.dominant_color = rendered['dominant_color']
+    save_thumbnails(media_instance, original_name, rendered['thumbnails'])
+
+
+def find_duplicate_media(company_id, sha256):
+    """Return an existing, fully processed media row of the company with the same content"""
+    from .models import Media
+    
+    return (
+        Media.objects
+        .filter(company_id=company_id, sha256=sha256, processing_status=Media.STATUS_READY)
+        .exclude(file='')
+        .exclude(file__isnull=True)
+        .order_by('pk')
+        .first()
+    )
+
+
+def reuse_media_files(media_instance, existing):
+    """Point a media instance at the stored file and thumbnails of an identical upload"""
+    for field_name in MEDIA_FILE_FIELDS:
+        setattr(media_instance, field_name, getattr(existing, field_name).name or None)
+    
+    media_instance.width = existing.width
+    media_instance.height = existing.height
+    media_instance.placeholder = existing.placeholder
+    media_instance.dominant_color = existing.dominant_color
+    media_instance.processing_status = existing.processing_status
+
+
+def ingest_upload(media_instance, uploaded_file, defer_thumbnails=False, sha256=None):
+    """
+    Store an uploaded file as a media instance.
+
+    Uploads whose content already exists for the same company reuse the stored
+    file and thumbnails instead of being written and processed again. Pass
+    ``sha256`` when the content hash is already known.
+    """
+    media_instance.sha256 = sha256 or compute_sha256(uploaded_file)
+    existing = find_duplicate_media(media_instance.company_id, media_instance.sha256)
+    
+    if existing:
+        set_file_metadata(media_instance, uploaded_file)
+        reuse_media_files(media_instance, existing)
+    else:
+        process_media_file(media_instance, uploaded_file, defer_thumbnails=defer_thumbnails)
+    
+    with transaction.atomic():
+        media_instance.save()
+        if media_instance.processing_status == media_instance.STATUS_PENDING:
+            enqueue_media_processing(media_instance)
+    
+    return media_instance
+
+
+def enqueue_media_processing(media_instance):
+    """Queue a saved media instance for background thumbnail generation"""
+    from .models import MediaProcessingJob
+    
+    return MediaProcessingJob.objects.create(media=media_instance)
+
+
+def prepare_upload(uploaded_file, render=True):
+    """Hash an upload and render its thumbnails; safe to run in a worker thread"""
+    sha256 = compute_sha256(uploaded_file)
+    rendered = None
+    if render and get_file_type_from_extension(uploaded_file.name) == 'image':
+        rendered = render_thumbnails(uploaded_file)
+        uploaded_file.seek(0)
+    return sha256, rendered
+
+
+def bulk_ingest_uploads(uploaded_files, company=None, gallery=None, project=None, defer_thumbnails=False):
+    """
+    Store many validated uploads at once.
+
+    Hashing and thumbnail rendering run in parallel on a bounded thread pool,
+    the media rows are inserted with a single ``bulk_create`` (sending
+    post_save for each) and, when a ``gallery`` or ``project`` is given,
+    attached to it in the same transaction.
+    Returns the created media in upload order.
+    """
+    from .models import Media, MediaProcessingJob, GalleryItem, ProjectGallery
+    from .signals import bulk_create_with_signals
+    
+    workers = min(len(uploaded_files), getattr(settings, 'MEDIA_BULK_UPLOAD_WORKERS', DEFAULT_BULK_UPLOAD_WORKERS))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        prepared = list(pool.map(lambda f: prepare_upload(f, render=not defer_thumbnails), uploaded_files))
+    
+    # One query for every hash that already exists for this company
+    existing_by_hash = {}
+    duplicates = Media.objects.filter(
+        company=company, sha256__in={sha256 for sha256, _rendered in prepared},
+        processing_status=Media.STATUS_READY,
+    ).exclude(file='').exclude(file__isnull=True).order_by('-pk')
+    for media in duplicates:
+        existing_by_hash[media.sha256] = media
+    
+    media_list = []
+    written_names = []
+    try:
+        for uploaded_file, (sha256, rendered) in zip(uploaded_files, prepared):
+            media = Media(company=company, sha256=sha256)
+            set_file_metadata(media, uploaded_file)
+            
+            existing = existing_by_hash.get(sha256)
+            if existing:
+                reuse_media_files(media, existing)
+            else:
+                media.file.save(uploaded_file.name, uploaded_file, save=False)
+                written_names.append(media.file.name)
+                if rendered:
+                    apply_rendered_image(media, uploaded_file.name, rendered)
+                    written_names.extend(
+                        getattr(media, f'thumbnail_{size}').name for size in rendered['thumbnails']
+                    )
+                elif media.file_type == 'image' and defer_thumbnails:
+                    media.processing_status = Media.STATUS_PENDING
+                
+                # Later duplicates within the same batch share this upload
+                if media.processing_status == Media.STATUS_READY:
+                    existing_by_hash[sha256] = media
+            
+            media_list.append(media)
+        
+        with transaction.atomic():
+            # With post_save, as for single uploads; also saves one by one where
+            # the database cannot return the primary keys the rows below need
+            bulk_create_with_signals(Media, media_list)
+            
+            MediaProcessingJob.objects.bulk_create([
+                MediaProcessingJob(media=media)
+                for media in media_list if media.processing_status == Media.STATUS_PENDING
+            ])
+            
+            if gallery is not None:
+                last_ordering = gallery.items.aggregate(last=Max('ordering'))['last']
+                start = last_ordering + 1 if last_ordering is not None else 0
+                # With post_save, so the content history records the new items
+                bulk_create_with_signals(GalleryItem, [
+                    GalleryItem(gallery=gallery, media=media, title=media.title, ordering=start + offset)
+                    for offset, media in enumerate(media_list)
+                ])
+            
+            if project is not None:
+                last_order = project.gallery_images.aggregate(last=Max('display_order'))['last']
+                start = last_order + 1 if last_order is not None else 0
+                # With post_save, so the cached projects section is invalidated
+                bulk_create_with_signals(ProjectGallery, [
+                    ProjectGallery(project=project, image_path=media.get_file_url(),
+                                   caption=media.title, display_order=start + offset)
+                    for offset, media in enumerate(media_list)
+                ])
+    
+    except Exception:
+        # Nothing references the files written for this batch
+        for name in written_names:
+            try:
+                default_storage.delete(name)
+            except Exception as e:
+                print(f"Error deleting file {name}: {e}")
+        raise
+    
+    return media_list
+
+
+class ChunkedUploadFile(File):
+    """An assembled chunked upload that storage can move into place instead of copying"""
+    
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def upload_session_path(session):
+    """Local path of the file a chunked upload session is assembled in"""
+    upload_dir = getattr(settings, 'MEDIA_UPLOAD_SESSION_DIR', os.path.join(settings.BASE_DIR, 'upload_sessions'))
+    return os.path.join(str(upload_dir), f"{session.pk}.part")
+
+
+def write_upload_chunk(session, index, stream, expected_sha256):
+    """
+    Stream one chunk into its slot in the session file.
+
+    The body is copied in small blocks so memory use stays constant regardless of
+    the chunk size. Returns an error message, or None when the chunk was written
+    with the expected length and checksum.
+    """
+    expected_length = session.expected_chunk_length(index)
+    digest = hashlib.sha256()
+    written = 0
+    
+    with open(upload_session_path(session), 'r+b') as part_file:
+        part_file.seek(index * session.chunk_size)
+        while stream is not None:
+            block = stream.read(min(STREAM_BLOCK_SIZE, expected_length - written + 1))
+            if not block:
+                break
+            written += len(block)
+            if written > expected_length:
+                return f"Chunk {index} must be {expected_length} bytes"
+            digest.update(block)
+            part_file.write(block)
+    
+    if written != expected_length:
+        return f"Chunk {index} must be {expected_length} bytes, received {written}"
+    if digest.hexdigest() != expected_sha256.lower():
+        return f"Checksum mismatch for chunk {index}"
+    return None
+
+
+def hash_local_file(path):
+    """SHA-256 of a file on local disk, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as local_file:
+        for block in iter(lambda: local_file.read(STREAM_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def get_media_url(media_instance, thumbnail_size=None):
     """Get URL for media file or thumbnail"""
     if thumbnail_size and media_instance.is_image():
@@ -154,18 +517,42 @@ def get_media_url(media_instance, thumbnail_size=None):
     return media_instance.get_file_url()
 
 
+def shared_file_names(media_instance):
+    """
+    Stored file names that other media rows still reference.
+
+    Deduplicated uploads share files with rows holding the same content hash, so
+    the rows of that hash group act as the reference count for each file.
+    """
+    from .models import Media
+    
+    if not media_instance.sha256:
+        return set()
+    
+    rows = (
+        Media.objects
+        .filter(company_id=media_instance.company_id, sha256=media_instance.sha256)
+        .exclude(pk=media_instance.pk)
+        .values_list(*MEDIA_FILE_FIELDS)
+    )
+    return {name for row in rows for name in row if name}
+
+
 def delete_media_files(media_instance):
-    """Delete all files associated with a media instance"""
+    """Delete all files associated with a media instance that no other media still uses"""
     files_to_delete = []
+    still_referenced = shared_file_names(media_instance)
     
     # Main file
-    if media_instance.file and default_storage.exists(media_instance.file.name):
+    if (media_instance.file and media_instance.file.name not in still_referenced
+            and default_storage.exists(media_instance.file.name)):
         files_to_delete.append(media_instance.file.name)
     
     # Thumbnails
     for size in THUMBNAIL_SIZES.keys():
         thumbnail_field = getattr(media_instance, f'thumbnail_{size}')
-        if thumbnail_field and default_storage.exists(thumbnail_field.name):
+        if (thumbnail_field and thumbnail_field.name not in still_referenced
+                and default_storage.exists(thumbnail_field.name)):
             files_to_delete.append(thumbnail_field.name)
     
     # Delete files
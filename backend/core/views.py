@@ -1,43 +1,73 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, FileResponse, Http404, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Prefetch, Window
+from django.db.models.functions import RowNumber
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.paginator import Paginator
-from rest_framework import viewsets, status
+from django.core.validators import validate_ipv46_address
+from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
+from rest_framework.negotiation import BaseContentNegotiation
 import json
+import os
 
+from .cache import cached_content
+from .conditional import content_condition
+from .middleware import measure, query_budget
+from .mixins import (
+    BulkModelMixin, ConditionalGetMixin, CreatedRangeFilterMixin, QuerysetOptimizerMixin, SerializerTimingMixin,
+    SparseFieldsetMixin
+)
 from .models import (
     User, Company, TeamMember, UserLog, Category, HomeContent, 
     AboutUs, Service, Contact, Project, ProjectGallery, Testimonial, 
-    Client, News, Media, SocialMedia, Setting, ContentHistory, Gallery, GalleryItem
+    Client, News, Media, UploadSession, SocialMedia, Setting, ContentHistory, Gallery, GalleryItem
 )
+from .pagination import CreatedAtCursorPagination
 from .serializers import (
     CompanySerializer, UserSerializer, TeamMemberSerializer, UserLogSerializer,
     CategorySerializer, HomeContentSerializer, AboutUsSerializer, ServiceSerializer,
     ContactSerializer, ProjectSerializer, TestimonialSerializer, ClientSerializer,
     NewsSerializer, MediaSerializer, SocialMediaSerializer, SettingSerializer,
     ContentHistorySerializer, BannerContentSerializer, ServiceContentSerializer,
-    GallerySerializer, GalleryItemSerializer
+    GallerySerializer, GalleryItemSerializer, UploadSessionSerializer
 )
 
 
 def index(request):
     """Main index view"""
-    return render(request, "index.html")
+    context = {}
+    if getattr(settings, 'SITE_DOCUMENT_INLINE', False):
+        # Inline the site document so the frontend can render without fetching it
+        from .site_document import get_site_document
+        company_id = getattr(settings, 'SITE_DOCUMENT_COMPANY_ID', None)
+        company = Company.objects.filter(pk=company_id).first() if company_id else None
+        content, _etag = get_site_document(company)
+        context['site_document'] = json.loads(content)
+    return render(request, "index.html", context)
 
 
 # ViewSets for REST API
-class CompanyViewSet(viewsets.ModelViewSet):
+class ContentViewSet(ConditionalGetMixin, SerializerTimingMixin, SparseFieldsetMixin, QuerysetOptimizerMixin,
+                     viewsets.ModelViewSet):
+    """ModelViewSet with the conditional GET, timing, sparse fieldset and query optimizing mixins"""
+
+
+class CompanyViewSet(ContentViewSet):
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
     permission_classes = [AllowAny]
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ContentViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
@@ -45,107 +75,191 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def staff(self, request):
         """Get all staff members"""
-        staff_users = User.objects.filter(role='staff').select_related('company')
+        staff_users = self.get_queryset().filter(role='staff')
         serializer = self.get_serializer(staff_users, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def admins(self, request):
         """Get all admin users"""
-        admin_users = User.objects.filter(role='admin').select_related('company')
+        admin_users = self.get_queryset().filter(role='admin')
         serializer = self.get_serializer(admin_users, many=True)
         return Response(serializer.data)
 
 
-class TeamMemberViewSet(viewsets.ModelViewSet):
+class TeamMemberViewSet(BulkModelMixin, ContentViewSet):
     queryset = TeamMember.objects.all()
     serializer_class = TeamMemberSerializer
     permission_classes = [AllowAny]
 
 
-class UserLogViewSet(viewsets.ModelViewSet):
+class UserLogViewSet(CreatedRangeFilterMixin, ContentViewSet):
     queryset = UserLog.objects.all()
     serializer_class = UserLogSerializer
     permission_classes = [AllowAny]
+    pagination_class = CreatedAtCursorPagination
     
-    def get_queryset(self):
-        queryset = UserLog.objects.all()
-        user_id = self.request.query_params.get('user_id', None)
-        if user_id is not None:
-            queryset = queryset.filter(user_id=user_id)
-        return queryset.order_by('-created_at')
+    @action(detail=False, methods=['get'])
+    def archive(self, request):
+        """Read archived logs of a month (?month=YYYY-MM, optional user_id, cursor, limit) or list archived months"""
+        from itertools import islice
+        from rest_framework.utils.urls import replace_query_param
+        from .log_archive import MONTH_RE, archived_months, decode_cursor, encode_cursor, read_archive
+        
+        month = request.query_params.get('month')
+        if not month:
+            return Response({'months': archived_months()})
+        if not MONTH_RE.match(month):
+            return Response({'error': 'month must be in YYYY-MM format'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            user_id = request.query_params.get('user_id')
+            user_id = int(user_id) if user_id else None
+            limit = min(max(int(request.query_params.get('limit', 100)), 1), 1000)
+        except ValueError:
+            return Response({'error': 'user_id and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            cursor = request.query_params.get('cursor')
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Archives are read sequentially, oldest first, from the (created_at, id)
+        # key of the cursor; one extra row tells whether more follow
+        records = list(islice(read_archive(month, user_id, after), limit + 1))
+        has_more = len(records) > limit
+        records = records[:limit]
+        next_url = None
+        if has_more:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', encode_cursor(records[-1]))
+        return Response({
+            'month': month,
+            'next': next_url,
+            'has_more': has_more,
+            'results': records,
+        })
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Daily activity counts per user or company from the rollup table
+        (?group=user|company, optional user_id, company_id, kind, since, until as YYYY-MM-DD)"""
+        from django.db.models import Sum
+        from django.utils.dateparse import parse_date
+        from .models import UserActivityRollup
+
+        group = request.query_params.get('group', 'user')
+        if group not in ('user', 'company'):
+            return Response({'error': 'group must be user or company'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rollups = UserActivityRollup.objects.all()
+        try:
+            for param in ('user_id', 'company_id'):
+                if request.query_params.get(param):
+                    rollups = rollups.filter(**{param: int(request.query_params[param])})
+            since = request.query_params.get('since')
+            until = request.query_params.get('until')
+            if since:
+                rollups = rollups.filter(day__gte=parse_date(since))
+            if until:
+                rollups = rollups.filter(day__lte=parse_date(until))
+        except (TypeError, ValueError):
+            return Response({'error': 'user_id and company_id must be integers, since and until YYYY-MM-DD dates'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if request.query_params.get('kind'):
+            rollups = rollups.filter(kind=request.query_params['kind'])
 
+        key = f'{group}_id'
+        rows = rollups.values(key, 'day').annotate(count=Sum('count')).order_by(key, 'day')
+        series = {}
+        for row in rows:
+            entry = series.setdefault(row[key], {key: row[key], 'total': 0, 'days': []})
+            entry['days'].append({'day': row['day'].isoformat(), 'count': row['count']})
+            entry['total'] += row['count']
+        return Response({'group': group, 'results': list(series.values())})
 
-class CategoryViewSet(viewsets.ModelViewSet):
+
+class CategoryViewSet(ContentViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
 
 
-class HomeContentViewSet(viewsets.ModelViewSet):
+class HomeContentViewSet(ContentViewSet):
     queryset = HomeContent.objects.all()
     serializer_class = HomeContentSerializer
     permission_classes = [AllowAny]
 
 
-class AboutUsViewSet(viewsets.ModelViewSet):
+class AboutUsViewSet(ContentViewSet):
     queryset = AboutUs.objects.all()
     serializer_class = AboutUsSerializer
     permission_classes = [AllowAny]
 
 
-class ServiceViewSet(viewsets.ModelViewSet):
+class ServiceViewSet(BulkModelMixin, ContentViewSet):
     queryset = Service.objects.all()
     serializer_class = ServiceSerializer
     permission_classes = [AllowAny]
 
 
-class ContactViewSet(viewsets.ModelViewSet):
+class ContactViewSet(ContentViewSet):
     queryset = Contact.objects.all()
     serializer_class = ContactSerializer
     permission_classes = [AllowAny]
 
 
-class ProjectViewSet(viewsets.ModelViewSet):
+class ProjectViewSet(ContentViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
     permission_classes = [AllowAny]
     
     @action(detail=False, methods=['get'])
+    @cached_content('projects')
     def featured(self, request):
         """Get featured projects"""
-        featured_projects = Project.objects.filter(featured=True)
+        featured_projects = self.get_queryset().filter(featured=True)
+        company_id = request.query_params.get('company_id')
+        if company_id:
+            featured_projects = featured_projects.filter(company_id=company_id)
         serializer = self.get_serializer(featured_projects, many=True)
         return Response(serializer.data)
 
 
-class TestimonialViewSet(viewsets.ModelViewSet):
+class TestimonialViewSet(ContentViewSet):
     queryset = Testimonial.objects.all()
     serializer_class = TestimonialSerializer
     permission_classes = [AllowAny]
     
     @action(detail=False, methods=['get'])
+    @cached_content('testimonials')
     def featured(self, request):
         """Get featured testimonials"""
-        featured_testimonials = Testimonial.objects.filter(is_featured=True)
+        featured_testimonials = self.get_queryset().filter(is_featured=True)
+        company_id = request.query_params.get('company_id')
+        if company_id:
+            featured_testimonials = featured_testimonials.filter(company_id=company_id)
         serializer = self.get_serializer(featured_testimonials, many=True)
         return Response(serializer.data)
 
 
-class ClientViewSet(viewsets.ModelViewSet):
+class ClientViewSet(BulkModelMixin, ContentViewSet):
     queryset = Client.objects.all()
     serializer_class = ClientSerializer
     permission_classes = [AllowAny]
     
     @action(detail=False, methods=['get'])
+    @cached_content('clients')
     def featured(self, request):
         """Get featured clients"""
-        featured_clients = Client.objects.filter(is_featured=True)
+        featured_clients = self.get_queryset().filter(is_featured=True)
+        company_id = request.query_params.get('company_id')
+        if company_id:
+            featured_clients = featured_clients.filter(company_id=company_id)
         serializer = self.get_serializer(featured_clients, many=True)
         return Response(serializer.data)
 
 
-class NewsViewSet(viewsets.ModelViewSet):
+class NewsViewSet(ContentViewSet):
     queryset = News.objects.all()
     serializer_class = NewsSerializer
     permission_classes = [AllowAny]
@@ -153,15 +267,30 @@ class NewsViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def published(self, request):
         """Get published news"""
-        published_news = News.objects.filter(status='published').order_by('-published_at')
+        published_news = self.get_queryset().filter(status='published').order_by('-published_at')
         serializer = self.get_serializer(published_news, many=True)
         return Response(serializer.data)
 
 
-class MediaViewSet(viewsets.ModelViewSet):
+class FirstRendererContentNegotiation(BaseContentNegotiation):
+    """Skip Accept-based renderer selection for endpoints that return files"""
+    
+    def select_parser(self, request, parsers):
+        return parsers[0]
+    
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+class MediaViewSet(ContentViewSet):
     queryset = Media.objects.all()
     serializer_class = MediaSerializer
     permission_classes = [AllowAny]
+    field_dependencies = {
+        'file_url': ('file', 'file_path'),
+        'thumbnail_urls': ('file', 'file_path', 'file_type', 'thumbnail_small', 'thumbnail_medium', 'thumbnail_large'),
+        'display_name': ('title', 'file_name'),
+    }
     
     def get_serializer_class(self):
         """Use different serializer for upload action"""
@@ -172,7 +301,7 @@ class MediaViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Filter media by company if specified"""
-        queryset = Media.objects.all()
+        queryset = super().get_queryset()
         company_id = self.request.query_params.get('company_id')
         file_type = self.request.query_params.get('file_type')
         
@@ -201,6 +330,53 @@ class MediaViewSet(viewsets.ModelViewSet):
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    def perform_destroy(self, instance):
+        """Remove the stored files along with the database row"""
+        from .utils import delete_media_files
+        
+        delete_media_files(instance)
+        instance.delete()
+    
+    @action(detail=False, methods=['post'], url_path='bulk-upload')
+    def bulk_upload(self, request):
+        """Upload several files in one request, optionally adding them to a gallery or project"""
+        from .utils import validate_file_upload, bulk_ingest_uploads, MAX_BULK_UPLOAD_FILES
+        
+        files = request.FILES.getlist('files')
+        if not files:
+            return Response({'error': 'No files provided in the "files" field'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(files) > MAX_BULK_UPLOAD_FILES:
+            return Response({'error': f'At most {MAX_BULK_UPLOAD_FILES} files can be uploaded at once'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        # Validate everything before storing anything
+        results = [{'file_name': f.name, 'errors': validate_file_upload(f)} for f in files]
+        if any(result['errors'] for result in results):
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+        
+        company = gallery = project = None
+        try:
+            if request.data.get('company'):
+                company = Company.objects.get(pk=request.data['company'])
+            if request.data.get('gallery'):
+                gallery = Gallery.objects.get(pk=request.data['gallery'])
+            if request.data.get('project'):
+                project = Project.objects.get(pk=request.data['project'])
+        except (Company.DoesNotExist, Gallery.DoesNotExist, Project.DoesNotExist, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        defer_thumbnails = getattr(settings, 'MEDIA_ASYNC_PROCESSING', False)
+        media_list = bulk_ingest_uploads(
+            files, company=company, gallery=gallery, project=project, defer_thumbnails=defer_thumbnails
+        )
+        
+        serializer = MediaSerializer(media_list, many=True, context={'request': request})
+        results = [
+            {'file_name': uploaded_file.name, 'errors': [], 'media': data}
+            for uploaded_file, data in zip(files, serializer.data)
+        ]
+        return Response({'results': results}, status=status.HTTP_201_CREATED)
+    
     @action(detail=True, methods=['delete'])
     def delete_file(self, request, pk=None):
         """Delete media file and all associated thumbnails"""
@@ -215,6 +391,79 @@ class MediaViewSet(viewsets.ModelViewSet):
         
         return Response({'message': 'Media deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
     
+    @action(detail=True, methods=['get'], content_negotiation_class=FirstRendererContentNegotiation)
+    def rendition(self, request, pk=None):
+        """Render a resized copy of an image on demand, cached on disk"""
+        from PIL import Image, UnidentifiedImageError
+        from .renditions import (
+            RENDITION_SIZES, RENDITION_FITS, RENDITION_FORMATS,
+            negotiate_format, rendition_key, render_rendition, get_rendition_cache
+        )
+        
+        media = self.get_object()
+        if not media.is_image() or not media.file:
+            return Response({'error': 'Renditions are only available for uploaded images'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            width = int(request.query_params['w']) if request.query_params.get('w') else None
+            height = int(request.query_params['h']) if request.query_params.get('h') else None
+        except ValueError:
+            return Response({'error': 'w and h must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not width and not height:
+            return Response({'error': 'At least one of w or h is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if any(size and size not in RENDITION_SIZES for size in (width, height)):
+            return Response({'error': f"Allowed sizes: {', '.join(map(str, RENDITION_SIZES))}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        fit = request.query_params.get('fit', 'contain')
+        if fit not in RENDITION_FITS:
+            return Response({'error': f"fit must be one of: {', '.join(RENDITION_FITS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if fit == 'cover' and not (width and height):
+            return Response({'error': 'fit=cover requires both w and h'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        fmt = negotiate_format(request.query_params.get('fmt', 'auto'), request.META.get('HTTP_ACCEPT'))
+        if fmt is None:
+            return Response({'error': f"fmt must be auto or one of: {', '.join(RENDITION_FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        _pil_format, content_type, ext = RENDITION_FORMATS[fmt]
+        key = rendition_key(media, width, height, fit, fmt)
+        etag = f'"{key}"'
+        
+        # Handles lists, * and weak validators in If-None-Match
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache = get_rendition_cache()
+            path = cache.get(key, ext)
+            cached_file = None
+            if path is not None:
+                try:
+                    cached_file = open(path, 'rb')
+                except FileNotFoundError:
+                    pass  # Evicted by another process since the lookup; render again
+
+            if cached_file is not None:
+                response = FileResponse(cached_file, content_type=content_type)
+            else:
+                try:
+                    with media.file.open('rb') as source:
+                        data = render_rendition(source, width, height, fit, fmt)
+                except FileNotFoundError:
+                    return Response({'error': 'Source file not found'}, status=status.HTTP_404_NOT_FOUND)
+                except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+                    return Response({'error': 'Source file is not a readable image'},
+                                    status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                cache.put(key, ext, data)
+                response = HttpResponse(data, content_type=content_type)
+        
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=86400'
+        response['Vary'] = 'Accept'
+        return response
+    
     @action(detail=False, methods=['get'])
     def images(self, request):
         """Get only image files"""
@@ -229,39 +478,286 @@ class MediaViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class SocialMediaViewSet(viewsets.ModelViewSet):
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Chunked, resumable uploads for files too large for a single request.
+
+    Create a session, PUT each chunk to ``chunks/<index>/`` with its SHA-256 in
+    the ``X-Chunk-Checksum`` header, then POST to ``finalize/``. Retrieving the
+    session lists the chunks still missing, so interrupted uploads can resume.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [AllowAny]
+    
+    def get_active_session(self):
+        """Return the session, or an error response if it no longer accepts data"""
+        session = self.get_object()
+        if session.status == UploadSession.STATUS_FINALIZING:
+            return session, Response({'error': 'Upload session is being finalized'}, status=status.HTTP_409_CONFLICT)
+        if session.status != UploadSession.STATUS_ACTIVE:
+            return session, Response({'error': 'Upload session is already finalized'}, status=status.HTTP_409_CONFLICT)
+        if session.is_expired():
+            return session, Response({'error': 'Upload session has expired'}, status=status.HTTP_410_GONE)
+        return session, None
+    
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, pk=None, index=None):
+        """Upload one chunk of the file"""
+        from .utils import write_upload_chunk
+        
+        session, error_response = self.get_active_session()
+        if error_response:
+            return error_response
+        
+        index = int(index)
+        if index >= session.total_chunks:
+            return Response({'error': f'Chunk index must be below {session.total_chunks}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        checksum = request.META.get('HTTP_X_CHUNK_CHECKSUM')
+        if not checksum:
+            return Response({'error': 'X-Chunk-Checksum header with the chunk SHA-256 is required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            error = write_upload_chunk(session, index, request.stream, checksum)
+        except FileNotFoundError:
+            # Finalized or aborted by another request meanwhile
+            return Response({'error': 'Upload session no longer accepts chunks'}, status=status.HTTP_409_CONFLICT)
+        
+        # A failed write may have overwritten the slot, so it only counts as
+        # received after a fully verified write
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            received = set(session.received_chunks)
+            if error:
+                received.discard(index)
+            else:
+                received.add(index)
+            if received != set(session.received_chunks):
+                session.received_chunks = sorted(received)
+                session.save(update_fields=['received_chunks', 'updated_at'])
+        
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(session).data)
+    
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Assemble the uploaded chunks into a Media entry"""
+        from .utils import ChunkedUploadFile, hash_local_file, ingest_upload, upload_session_path
+        
+        session, error_response = self.get_active_session()
+        if error_response:
+            return error_response
+        
+        missing = session.missing_chunks()
+        if missing:
+            return Response({'error': 'Upload is incomplete', 'missing_chunks': missing},
+                            status=status.HTTP_409_CONFLICT)
+        
+        # Only the request that moves the session out of 'active' goes on, so
+        # concurrent finalize calls cannot ingest the same file twice
+        claimed = UploadSession.objects.filter(pk=session.pk, status=UploadSession.STATUS_ACTIVE).update(
+            status=UploadSession.STATUS_FINALIZING, updated_at=timezone.now()
+        )
+        if not claimed:
+            return Response({'error': 'Upload session is already being finalized'}, status=status.HTTP_409_CONFLICT)
+        
+        def release(**fields):
+            UploadSession.objects.filter(pk=session.pk, status=UploadSession.STATUS_FINALIZING).update(
+                status=UploadSession.STATUS_ACTIVE, updated_at=timezone.now(), **fields
+            )
+        
+        path = upload_session_path(session)
+        if not os.path.exists(path):
+            release(received_chunks=[])
+            return Response({'error': 'Uploaded data is missing; upload the chunks again'},
+                            status=status.HTTP_409_CONFLICT)
+        
+        try:
+            sha256 = hash_local_file(path)
+            if session.sha256 and session.sha256 != sha256:
+                release()
+                return Response({'error': 'Checksum of the assembled file does not match'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            
+            defer_thumbnails = getattr(settings, 'MEDIA_ASYNC_PROCESSING', False)
+            with open(path, 'rb') as part_file:
+                uploaded_file = ChunkedUploadFile(part_file, name=session.file_name)
+                media = Media(
+                    company=session.company,
+                    file=uploaded_file,
+                    title=session.title,
+                    alt_text=session.alt_text,
+                    description=session.description,
+                )
+                media = ingest_upload(media, uploaded_file, defer_thumbnails=defer_thumbnails, sha256=sha256)
+        except Exception:
+            release()
+            raise
+        
+        session.status = UploadSession.STATUS_COMPLETE
+        session.media = media
+        session.save(update_fields=['status', 'media', 'updated_at'])
+        
+        # Storage may have moved the file into place already
+        if os.path.exists(path):
+            os.remove(path)
+        
+        response_serializer = MediaSerializer(media, context={'request': request})
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+    
+    def perform_destroy(self, instance):
+        """Abort the upload and discard any received chunks"""
+        from .utils import upload_session_path
+        
+        path = upload_session_path(instance)
+        if os.path.exists(path):
+            os.remove(path)
+        instance.delete()
+
+
+class SocialMediaViewSet(BulkModelMixin, ContentViewSet):
     queryset = SocialMedia.objects.all()
     serializer_class = SocialMediaSerializer
     permission_classes = [AllowAny]
     
     @action(detail=False, methods=['get'])
+    @cached_content('social')
     def active(self, request):
         """Get active social media links"""
-        active_social = SocialMedia.objects.filter(is_active=True).order_by('display_order')
+        active_social = self.get_queryset().filter(is_active=True).order_by('display_order')
+        company_id = request.query_params.get('company_id')
+        if company_id:
+            active_social = active_social.filter(company_id=company_id)
         serializer = self.get_serializer(active_social, many=True)
         return Response(serializer.data)
 
 
-class SettingViewSet(viewsets.ModelViewSet):
+class SettingViewSet(ContentViewSet):
     queryset = Setting.objects.all()
     serializer_class = SettingSerializer
     permission_classes = [AllowAny]
+    
+    @action(detail=False, methods=['get'])
+    def snapshot(self, request):
+        """Get all settings of a company (?company_id=, global settings without) as a key/value object"""
+        from .site_settings import get_settings
+        
+        company_id = request.query_params.get('company_id') or None
+        if company_id is not None and not company_id.isdigit():
+            return Response({'error': 'company_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        snapshot = get_settings(int(company_id) if company_id else None)
+        return Response({'company_id': snapshot.company_id, 'settings': snapshot.as_dict()})
+    
+    @action(detail=False, methods=['post'], url_path='bulk-upsert')
+    def bulk_upsert(self, request):
+        """Create or update many settings of a company in one transaction"""
+        from .site_settings import bulk_upsert_settings
+        
+        company_id = request.data.get('company_id')
+        values = request.data.get('settings')
+        if not isinstance(values, dict) or not values:
+            return Response({'error': 'settings must be a non-empty object of key/value pairs'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        invalid_keys = [key for key in values if not key.strip() or len(key) > 255]
+        if invalid_keys:
+            return Response({'error': f'Invalid setting keys: {invalid_keys}'}, status=status.HTTP_400_BAD_REQUEST)
+        if company_id is not None and not (str(company_id).isdigit()
+                                           and Company.objects.filter(pk=company_id).exists()):
+            return Response({'error': 'Company not found'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            created, updated = bulk_upsert_settings(company_id, values)
+        except IntegrityError:
+            return Response({'error': 'Settings were changed concurrently, retry the request'},
+                            status=status.HTTP_409_CONFLICT)
+        return Response({'company_id': company_id, 'created': created, 'updated': updated})
 
 
-class ContentHistoryViewSet(viewsets.ModelViewSet):
+class ContentHistoryViewSet(CreatedRangeFilterMixin, ContentViewSet):
     queryset = ContentHistory.objects.all()
     serializer_class = ContentHistorySerializer
     permission_classes = [AllowAny]
+    pagination_class = CreatedAtCursorPagination
 
+    @action(detail=False, methods=['get'])
+    def timeline(self, request):
+        """Changes of one record, oldest first (?table=news&record_id=3), and with
+        ?version=<entry id> the record's field values right after that change"""
+        from .content_history import get_tracked_model, rebuild_version
 
-class GalleryViewSet(viewsets.ModelViewSet):
+        table = request.query_params.get('table')
+        model = get_tracked_model(table)
+        if model is None:
+            return Response({'error': 'table must name a tracked content model'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            record_id = int(request.query_params.get('record_id', ''))
+            version = request.query_params.get('version')
+            version = int(version) if version else None
+        except ValueError:
+            return Response({'error': 'record_id and version must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        entries = list(ContentHistory.objects.filter(table_name=table, record_id=record_id)
+                       .select_related('user').order_by('created_at', 'id'))
+        data = {
+            'table': table,
+            'record_id': record_id,
+            'entries': [{
+                'id': entry.id,
+                'action': entry.action,
+                'user': entry.user_id,
+                'username': entry.user.username if entry.user_id else None,
+                'created_at': entry.created_at,
+                'changes': entry.changed_data,
+            } for entry in entries],
+        }
+        if version is not None:
+            if not any(entry.id == version for entry in entries):
+                return Response({'error': 'version is not an entry of this record'}, status=status.HTTP_404_NOT_FOUND)
+            data['version'] = version
+            data['values'] = rebuild_version(model, record_id, entries, version)
+        return Response(data)
+
+
+class GalleryViewSet(ContentViewSet):
     queryset = Gallery.objects.all()
     serializer_class = GallerySerializer
     permission_classes = [AllowAny]
+    field_dependencies = {'items_count': ()}  # Annotated in get_queryset
+    
+    # Actions that work on the gallery row alone and load items themselves
+    ITEM_ACTIONS = ('items', 'add_item', 'modify_item')
+    
+    def get_items_limit(self):
+        """Optional ?items_limit= capping the items nested in each gallery"""
+        try:
+            limit = int(self.request.query_params['items_limit'])
+        except (KeyError, ValueError):
+            return None
+        return max(limit, 0)
+    
+    def get_extra_prefetch_related(self):
+        items = GalleryItem.objects.select_related('media').order_by('ordering', 'created_at')
+        limit = self.get_items_limit()
+        if limit is not None:
+            # First N items of every gallery in the same single query. A sliced
+            # queryset would need to_attr, changing what the serializer reads.
+            items = items.annotate(
+                position=Window(RowNumber(), partition_by=F('gallery'), order_by=[F('ordering'), F('created_at')])
+            ).filter(position__lte=limit)
+        return (Prefetch('items', queryset=items),)
     
     def get_queryset(self):
         """Filter galleries by company if specified"""
-        queryset = Gallery.objects.all()
+        if self.action in self.ITEM_ACTIONS:
+            queryset = Gallery.objects.all()
+        else:
+            queryset = super().get_queryset().annotate(items_count=Count('items'))
         company_id = self.request.query_params.get('company_id')
         
         if company_id:
@@ -271,9 +767,15 @@ class GalleryViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def items(self, request, pk=None):
-        """Get all items for a specific gallery"""
+        """Get all items for a specific gallery, paginated when ?page= is given"""
         gallery = self.get_object()
-        items = gallery.items.all().order_by('ordering', 'created_at')
+        items = gallery.items.select_related('media').order_by('ordering', 'created_at')
+        
+        if 'page' in request.query_params:
+            page = self.paginate_queryset(items)
+            serializer = GalleryItemSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
         serializer = GalleryItemSerializer(items, many=True)
         return Response(serializer.data)
     
@@ -317,14 +819,85 @@ class GalleryViewSet(viewsets.ModelViewSet):
             return Response({'message': 'Gallery item deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
 
 
+# Media file serving
+MEDIA_VARIANT_FIELDS = {
+    'original': 'file',
+    'small': 'thumbnail_small',
+    'medium': 'thumbnail_medium',
+    'large': 'thumbnail_large',
+}
+
+
+@require_http_methods(["GET", "HEAD"])
+def serve_media(request, media_id, variant='original'):
+    """Serve a media file or thumbnail with Range, conditional GET and offload support"""
+    from django.core.files.storage import default_storage
+    from .serving import serve_stored_file
+    
+    field_name = MEDIA_VARIANT_FIELDS.get(variant)
+    if field_name is None:
+        raise Http404('Unknown media variant')
+    
+    # Single primary key lookup loading only the columns needed here
+    media = Media.objects.only('file', field_name, 'mime_type').filter(pk=media_id).first()
+    if media is None:
+        raise Http404('Media not found')
+    
+    stored_file = getattr(media, field_name)
+    if field_name != 'file' and not stored_file:
+        stored_file = media.file  # Fallback to original file
+    if not stored_file:
+        raise Http404('Media has no stored file')
+    
+    content_type = media.mime_type if stored_file is media.file else None
+    return serve_stored_file(request, default_storage, stored_file.name, content_type)
+
+
+# Aggregated public site content
+@require_http_methods(["GET", "HEAD"])
+@query_budget(12)
+def site_document(request):
+    """Everything the public site loads on first render as one cacheable document"""
+    from .site_document import get_site_document
+    
+    company = None
+    company_id = request.GET.get('company_id')
+    if company_id:
+        if not company_id.isdigit():
+            return JsonResponse({'error': 'company_id must be an integer'}, status=400)
+        company = Company.objects.filter(pk=company_id).first()
+        if company is None:
+            return JsonResponse({'error': 'Company not found'}, status=404)
+    
+    content, etag = get_site_document(company)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    # Stored by browsers and proxies but revalidated, so edits show up at once
+    response['Cache-Control'] = 'public, no-cache'
+    return response
+
+
 # Content Management API endpoints
+def _company_content(model, *related):
+    """Queryset of a content model filtered by the optional ?company_id= parameter"""
+    def get_queryset(request):
+        queryset = model.objects.select_related(*related)
+        company_id = request.GET.get('company_id')
+        return queryset.filter(company_id=company_id) if company_id else queryset
+    return get_queryset
+
+
 @api_view(['GET', 'POST'])
+@cached_content('banner')
+@content_condition(_company_content(HomeContent))
 def banner_content_api(request):
     """API for banner content management"""
     if request.method == 'GET':
         # Return banner content from HomeContent model
         try:
-            home_content = HomeContent.objects.first()
+            home_content = _company_content(HomeContent)(request).first()
             if home_content:
                 data = {
                     'id': home_content.id,
@@ -364,11 +937,13 @@ def banner_content_api(request):
 
 
 @api_view(['GET', 'POST'])
+@cached_content('services')
+@content_condition(_company_content(Service, 'company', 'category'), related=('company', 'category'))
 def service_content_api(request):
     """API for service content management"""
     if request.method == 'GET':
         # Return services
-        services = Service.objects.all()
+        services = _company_content(Service, 'company', 'category')(request)
         serializer = ServiceSerializer(services, many=True)
         return Response(serializer.data)
     
@@ -382,12 +957,14 @@ def service_content_api(request):
 
 
 @api_view(['GET', 'POST'])
+@cached_content('about')
+@content_condition(_company_content(AboutUs, 'company'), related=('company',))
 def about_content_api(request):
     """API for about us content management"""
     if request.method == 'GET':
         # Return about us content
         try:
-            about_us = AboutUs.objects.first()
+            about_us = _company_content(AboutUs, 'company')(request).first()
             if about_us:
                 serializer = AboutUsSerializer(about_us)
                 return Response(serializer.data)
@@ -423,6 +1000,7 @@ def about_content_api(request):
 
 
 # Legacy API endpoints (maintained for backward compatibility)
+@query_budget(2)
 def staff_list(request):
     """API endpoint to list all staff members"""
     staff_users = User.objects.filter(role='staff').select_related('company')
@@ -432,21 +1010,22 @@ def staff_list(request):
     paginator = Paginator(staff_users, 10)
     page_obj = paginator.get_page(page_number)
     
-    staff_data = []
-    for user in page_obj:
-        staff_data.append({
-            'id': user.id,
-            'username': user.username,
-            'email': user.email,
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-            'full_name': user.get_full_name(),
-            'company': user.company.name if user.company else None,
-            'is_active': user.is_active,
-            'profile_image': user.profile_image,
-            'created_at': user.created_at.isoformat(),
-            'last_login_at': user.last_login_at.isoformat() if user.last_login_at else None,
-        })
+    with measure(request, 'serialize'):
+        staff_data = []
+        for user in page_obj:
+            staff_data.append({
+                'id': user.id,
+                'username': user.username,
+                'email': user.email,
+                'first_name': user.first_name,
+                'last_name': user.last_name,
+                'full_name': user.get_full_name(),
+                'company': user.company.name if user.company else None,
+                'is_active': user.is_active,
+                'profile_image': user.profile_image,
+                'created_at': user.created_at.isoformat(),
+                'last_login_at': user.last_login_at.isoformat() if user.last_login_at else None,
+            })
     
     return JsonResponse({
         'staff': staff_data,
@@ -460,43 +1039,46 @@ def staff_list(request):
     })
 
 
+@query_budget(2)
 def staff_detail(request, staff_id):
     """API endpoint to get staff member details"""
-    staff = get_object_or_404(User, id=staff_id, role='staff')
+    staff = get_object_or_404(User.objects.select_related('company'), id=staff_id, role='staff')
     
     # Get recent activity logs
     recent_logs = UserLog.objects.filter(user=staff).order_by('-created_at')[:10]
     
-    staff_data = {
-        'id': staff.id,
-        'username': staff.username,
-        'email': staff.email,
-        'first_name': staff.first_name,
-        'last_name': staff.last_name,
-        'full_name': staff.get_full_name(),
-        'company': {
-            'id': staff.company.id,
-            'name': staff.company.name,
-        } if staff.company else None,
-        'is_active': staff.is_active,
-        'profile_image': staff.profile_image,
-        'two_factor_enabled': staff.two_factor_enabled,
-        'created_at': staff.created_at.isoformat(),
-        'updated_at': staff.updated_at.isoformat(),
-        'last_login_at': staff.last_login_at.isoformat() if staff.last_login_at else None,
-        'recent_activity': [
-            {
-                'id': log.id,
-                'activity': log.activity,
-                'ip_address': log.ip_address,
-                'created_at': log.created_at.isoformat(),
-            } for log in recent_logs
-        ]
-    }
+    with measure(request, 'serialize'):
+        staff_data = {
+            'id': staff.id,
+            'username': staff.username,
+            'email': staff.email,
+            'first_name': staff.first_name,
+            'last_name': staff.last_name,
+            'full_name': staff.get_full_name(),
+            'company': {
+                'id': staff.company.id,
+                'name': staff.company.name,
+            } if staff.company else None,
+            'is_active': staff.is_active,
+            'profile_image': staff.profile_image,
+            'two_factor_enabled': staff.two_factor_enabled,
+            'created_at': staff.created_at.isoformat(),
+            'updated_at': staff.updated_at.isoformat(),
+            'last_login_at': staff.last_login_at.isoformat() if staff.last_login_at else None,
+            'recent_activity': [
+                {
+                    'id': log.id,
+                    'activity': log.activity,
+                    'ip_address': log.ip_address,
+                    'created_at': log.created_at.isoformat(),
+                } for log in recent_logs
+            ]
+        }
     
     return JsonResponse({'staff': staff_data})
 
 
+@query_budget(1)
 def team_members_list(request):
     """API endpoint to list team members for public display"""
     team_members = TeamMember.objects.all().select_related('company')
@@ -511,19 +1093,20 @@ def team_members_list(request):
     if is_management is not None:
         team_members = team_members.filter(is_management=is_management.lower() == 'true')
     
-    team_data = []
-    for member in team_members:
-        team_data.append({
-            'id': member.id,
-            'name': member.name,
-            'position': member.position,
-            'bio': member.bio,
-            'image_path': member.image_path,
-            'email': member.email,
-            'linkedin_url': member.linkedin_url,
-            'is_management': member.is_management,
-            'company': member.company.name if member.company else None,
-        })
+    with measure(request, 'serialize'):
+        team_data = []
+        for member in team_members:
+            team_data.append({
+                'id': member.id,
+                'name': member.name,
+                'position': member.position,
+                'bio': member.bio,
+                'image_path': member.image_path,
+                'email': member.email,
+                'linkedin_url': member.linkedin_url,
+                'is_management': member.is_management,
+                'company': member.company.name if member.company else None,
+            })
     
     return JsonResponse({'team_members': team_data})
 
@@ -531,39 +1114,80 @@ def team_members_list(request):
 @csrf_exempt
 @require_http_methods(["POST"])
 def log_staff_activity(request):
-    """API endpoint to log staff activity"""
+    """API endpoint to log staff activity: one event object or an array of them"""
+    from .activity_log import BufferFull, get_active_staff_ids, log_activity
+    
     try:
         data = json.loads(request.body)
-        user_id = data.get('user_id')
-        activity = data.get('activity')
+        single = isinstance(data, dict)
+        events = [data] if single else data
         
-        if not user_id or not activity:
-            return JsonResponse({'error': 'user_id and activity are required'}, status=400)
+        if not isinstance(events, list) or not events or not all(isinstance(event, dict) for event in events):
+            return JsonResponse({'error': 'Send an event object or a non-empty array of events'}, status=400)
+        max_batch = getattr(settings, 'ACTIVITY_LOG_MAX_BATCH', 500)
+        if len(events) > max_batch:
+            return JsonResponse({'error': f'At most {max_batch} events per request'}, status=400)
         
-        staff = get_object_or_404(User, id=user_id, role='staff')
-        
-        # Get client IP
+        # Get client IP; spooled events must fit the GenericIPAddressField
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
-            ip_address = x_forwarded_for.split(',')[0]
+            ip_address = x_forwarded_for.split(',')[0].strip()
         else:
             ip_address = request.META.get('REMOTE_ADDR')
+        try:
+            validate_ipv46_address(ip_address)
+        except DjangoValidationError:
+            ip_address = None
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
         
-        # Create log entry
-        log_entry = UserLog.objects.create(
-            user=staff,
-            activity=activity,
-            ip_address=ip_address,
-            user_agent=request.META.get('HTTP_USER_AGENT', '')
-        )
+        # Events of a user deleted after the ids were cached are dead-lettered
+        # when stored (see ActivityLogBuffer.store)
+        staff_ids = get_active_staff_ids()
+        accepted = []
+        rejected = []
+        for index, event in enumerate(events):
+            user_id = event.get('user_id')
+            activity = event.get('activity')
+            if not user_id or not activity or not isinstance(activity, str):
+                rejected.append({'index': index, 'status': 400, 'error': 'user_id and activity are required'})
+            elif not str(user_id).isdigit() or int(user_id) not in staff_ids:
+                rejected.append({'index': index, 'status': 404, 'error': 'Staff member not found'})
+            else:
+                accepted.append({
+                    'user_id': int(user_id),
+                    'activity': activity,
+                    'ip_address': ip_address,
+                    'user_agent': user_agent,
+                })
         
-        return JsonResponse({
+        if single and rejected:
+            return JsonResponse({'error': rejected[0]['error']}, status=rejected[0]['status'])
+        
+        # Events are buffered and answered with 202, unless write-behind is off
+        # or a single event asks for its log_id with ?return_id=true
+        return_id = single and request.GET.get('return_id', '').lower() == 'true'
+        logs = log_activity(accepted, write_behind=False if return_id else None) if accepted else []
+        if single and logs:
+            return JsonResponse({
+                'success': True,
+                'log_id': logs[0].id,
+                'message': 'Activity logged successfully'
+            })
+        
+        response = {
             'success': True,
-            'log_id': log_entry.id,
+            'accepted': len(accepted),
+            'rejected': rejected,
             'message': 'Activity logged successfully'
-        })
+        }
+        if logs is None:
+            return JsonResponse(response, status=202)
+        response['log_ids'] = [log.id for log in logs]
+        return JsonResponse(response)
         
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except BufferFull as e:
+        return JsonResponse({'error': str(e)}, status=503)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)